@@ -0,0 +1,637 @@
+import asyncio
+import json
+import time
+import weakref
+
+import aiohttp
+
+from ScaleFunctions import ScaleInventory, sc_get_inventory, sc_new_tags, sc_plan_tag_changes
+from ScaleLimiter import RateLimiter
+from ScaleTelemetry import metrics
+
+# asyncio version of ScaleFunctions. The functions have the same names and arguments as in ScaleFunctions but are
+# coroutines, so they need to be awaited. Every cluster (node) gets one aiohttp session with its own connection pool,
+# which lets thousands of operations against many clusters run on a single event loop.
+#
+# As in ScaleFunctions certificate verification is disabled to work with the self-signed node certificates.
+
+
+class AsyncScaleClient:
+    """
+    Keep-alive asyncio connection to the hypercore API
+
+    The asyncio counterpart of ScaleFunctions.ScaleClient. It owns one aiohttp.ClientSession with a connection pool
+    towards one node. The session is created lazily on first use so the client can be created outside of the event
+    loop. All sc_* coroutines in this module use one AsyncScaleClient per node (see sc_get_client). As the sync client
+    it does not keep the session of a login, login() returns the api headers and every call takes them.
+
+    :example:
+    >>> client = AsyncScaleClient("192.168.0.1", limit=50)
+    >>> session = await client.login("admin", "admin")
+    >>> vms = await client.get_json("VirDomain/", session)
+    >>> await client.logout(session)
+    >>> await client.close()
+
+    :param node: IP address or FQDN for a scale computing node, this can be any node in the cluster you are managing.
+    :type node: str
+    :param limit: maximum number of connections open to the node at the same time.
+    :type limit: int
+    :param verify: certificate verification, False (default) or an ssl.SSLContext.
+    :type verify: bool | ssl.SSLContext
+    :param limiter: optional ScaleLimiter.RateLimiter every request of this client goes through.
+    :type limiter: RateLimiter
+    """
+
+    def __init__(self, node: str, limit: int = 20, verify=False, limiter: RateLimiter = None):
+        self.node = node
+        self.api_prefix = 'https://' + node + '/rest/v1/'
+        self.api_headers = {
+            'Content-Type': 'application/json'
+        }
+        self.limit = limit
+        self.verify = verify
+        self.limiter = limiter
+        self.session = None
+
+    def _get_session(self) -> aiohttp.ClientSession:
+        if self.session is None or self.session.closed:
+            # the sessionID cookie is sent explicitly in the headers, so the cookie jar is not needed
+            self.session = aiohttp.ClientSession(connector=aiohttp.TCPConnector(limit=self.limit, ssl=self.verify),
+                                                 cookie_jar=aiohttp.DummyCookieJar())
+        return self.session
+
+    async def request(self, method: str, endpoint: str, api_headers: dict = None, payload: str = None):
+        """
+        Perform a single request on the pooled session and return (status code, body text, response cookies).
+        """
+
+        if api_headers is None:
+            api_headers = self.api_headers
+        if self.limiter is not None:
+            await self.limiter.acquire_async()
+        start = time.monotonic()
+        status = None
+        retry_after = None
+        try:
+            async with self._get_session().request(method,
+                                                   self.api_prefix + endpoint,
+                                                   headers=api_headers,
+                                                   data=payload
+                                                   ) as response:
+                status = response.status
+                if status == 429:
+                    try:
+                        retry_after = float(response.headers.get('Retry-After', 0))
+                    except ValueError:
+                        pass
+                return response.status, await response.text(), response.cookies
+        finally:
+            seconds = time.monotonic() - start
+            metrics.observe_request(self.node, self.node, method, endpoint, status, seconds)
+            if self.limiter is not None:
+                self.limiter.release_async(endpoint, seconds, status, retry_after)
+
+    async def get_json(self, endpoint: str, api_headers: dict = None):
+        """
+        GET an endpoint and return the decoded json body.
+        """
+
+        status, text, cookies = await self.request("GET", endpoint, api_headers)
+        return json.loads(text)
+
+    async def post_json(self, endpoint: str, payload: dict, api_headers: dict = None):
+        """
+        POST a dict as json to an endpoint and return the decoded json body.
+        """
+
+        status, text, cookies = await self.request("POST", endpoint, api_headers, json.dumps(payload))
+        return json.loads(text)
+
+    async def login(self, username: str, password: str) -> dict:
+        """
+        Log in and return the api headers with the sessionID cookie, without keeping them on the client. See sc_login.
+        """
+
+        login_payload = json.dumps({
+            "username": username,
+            "password": password,
+            "useOIDC": False
+        })
+
+        api_headers = {
+            'Content-Type': 'application/json'
+        }
+
+        status, text, cookies = await self.request("POST", 'login', api_headers, login_payload)
+
+        if status == 401:
+            print(status)
+            raise Exception(f'Login failed.')
+        if status == 500:
+            print(status)
+            raise Exception(f'An internal error occurred.')
+
+        session_cookie = cookies.get('sessionID')
+        api_headers['Cookie'] = 'sessionID={0}'.format(
+            session_cookie.value if session_cookie is not None else None)
+        return api_headers
+
+    async def logout(self, api_headers: dict) -> bool:
+        """
+        Log out the session of the given headers. See sc_logout.
+        """
+
+        status, text, cookies = await self.request("POST", 'logout', api_headers)
+        return status == 200
+
+    async def close(self) -> None:
+        """
+        Close all pooled connections of this client.
+        """
+
+        if self.session is not None:
+            await self.session.close()
+            self.session = None
+
+
+# limits for the RateLimiter of every node client created by sc_get_client, see ScaleLimiter.py. Set to None to send
+# requests without any client side limit.
+rate_limits = {"max_rate": 100.0, "max_in_flight": 16}
+
+# one client per node and event loop, shared by all sc_* coroutines so they reuse the same pooled connections. An
+# aiohttp session only works on the loop it was created on, so every event loop (asyncio.run) gets its own clients and
+# they go away together with their loop.
+_clients = weakref.WeakKeyDictionary()
+
+
+def sc_get_client(node: str) -> AsyncScaleClient:
+    """
+    Get the shared AsyncScaleClient for a node on the running event loop
+
+    :param node: IP address or FQDN for a scale computing node, this can be any node in the cluster you are managing.
+    :type node: str
+    :return: AsyncScaleClient
+    """
+
+    clients = _clients.setdefault(asyncio.get_running_loop(), {})
+    client = clients.get(node)
+    if client is None:
+        client = AsyncScaleClient(node, limiter=RateLimiter(**rate_limits) if rate_limits else None)
+        clients[node] = client
+    return client
+
+
+async def sc_close(node: str = None) -> None:
+    """
+    Close the pooled connections for a node, or for all nodes when no node is given, on the running event loop
+
+    aiohttp warns about sessions that are still open when the event loop ends, so call this once you are done.
+
+    :example:
+    >>> await sc_logout(session, host)
+    >>> await sc_close()
+
+    :param node: IP address or FQDN for a scale computing node, this can be any node in the cluster you are managing.
+    :type node: str
+    :return: none
+    """
+
+    clients = _clients.get(asyncio.get_running_loop(), {})
+    nodes = [node] if node is not None else list(clients)
+    for close_node in nodes:
+        client = clients.pop(close_node, None)
+        if client is not None:
+            await client.close()
+
+
+async def sc_login(username: str, password: str, node: str) -> dict:
+    """
+    perform login to the hypercore API
+
+    See ScaleFunctions.sc_login. Make sure to always end and/or exit with a logout as otherwise the session will be
+    valid for another 100 days.
+
+    :example:
+    >>> session = await sc_login("admin", "admin", "192.168.0.1")
+
+    :param username: A valid hypercore username.
+    :type username: str
+    :param password: The password for the used username.
+    :type password: str
+    :param node: IP address or FQDN for a scale computing node, this can be any node in the cluster you are managing.
+    :type node: str
+    :return: api headers with the session cookie
+    :rtype: dict
+    :raises Exception: Failure description.
+    """
+
+    return await sc_get_client(node).login(username, password)
+
+
+async def sc_logout(api_headers: dict, node: str) -> bool:
+    """
+    Log out from the Hypercore API
+
+    See ScaleFunctions.sc_logout.
+
+    :example:
+    >>> await sc_logout(session, "192.168.0.1")
+
+    :param api_headers: a dict with the api headers that include the sessionID cookie.
+    :type api_headers: dict
+    :param node: IP address or FQDN for a scale computing node, this can be any node in the cluster you are managing.
+    :type node: str
+    :return: bool
+    """
+
+    return await sc_get_client(node).logout(api_headers)
+
+
+async def sc_wait_for_task(api_headers: dict, sctag: str, timeout: int, node: str) -> bool:
+    """
+    Wait for task to complete
+
+    See ScaleFunctions.sc_wait_for_task. Waiting is done with asyncio.sleep so other coroutines keep running while
+    the task is polled.
+
+    :example:
+    >>> await sc_wait_for_task(session, "123456", 3600, "192.16.0.1")
+    True
+
+    :param api_headers: a dict with the api headers that include the sessionID cookie.
+    :type api_headers: dict
+    :param sctag: A string with the task tag returned by another function.
+    :type sctag: str
+    :param timeout: Timeout for this function in seconds.
+    :type timeout: int
+    :param node: IP address or FQDN for a scale computing node, this can be any node in the cluster you are managing.
+    :type node: str
+    :return: bool
+    :raises Exception: Failure description, or the timeout was reached.
+    """
+
+    completed = await _wait_for_task(api_headers, sctag, timeout, node)
+    if completed is None:
+        raise Exception(
+            f'Timeout for task reached! The task might still be running on the cluster, please inspect cluster logs')
+    return completed
+
+
+async def _wait_for_task(api_headers: dict, sctag: str, timeout: int, node: str) -> bool:
+    # sc_wait_for_task without the exception for the timeout, that one returns None
+    client = sc_get_client(node)
+    # tasks needs to be completed within this time in secconds
+    wait_start = time.time()
+    wait_timeout = wait_start + timeout
+
+    while time.time() < wait_timeout:
+        task_check_json = await client.get_json('TaskTag/' + str(sctag), api_headers)
+        if task_check_json[0]["state"] == "COMPLETE":
+            metrics.observe_task_wait(node, str(sctag), "COMPLETE", time.time() - wait_start)
+            return True
+        elif task_check_json[0]["state"] == "ERROR":
+            metrics.observe_task_wait(node, str(sctag), "ERROR", time.time() - wait_start)
+            return False
+        else:
+            # wait for 2 seconds before re-testing to prevent ddos-ing the api
+            await asyncio.sleep(2)
+    metrics.observe_task_wait(node, str(sctag), "TIMEOUT", time.time() - wait_start)
+    return None
+
+
+async def sc_wait_for_tasks(api_headers: dict, sctags: list, timeout: int, node: str) -> dict:
+    """
+    Wait for many tasks to complete
+
+    Runs sc_wait_for_task for all taskTags concurrently. A task that reaches the timeout is reported as None, any other
+    failure (the api not answering, an unknown taskTag, ...) is raised once all tasks have been waited for.
+
+    :example:
+    >>> await sc_wait_for_tasks(session, ["1234", "1235"], 3600, host)
+    {'1234': True, '1235': True}
+
+    :param api_headers: a dict with the api headers that include the sessionID cookie.
+    :type api_headers: dict
+    :param sctags: A list with the task tags returned by other functions.
+    :type sctags: list
+    :param timeout: Timeout for this function in seconds.
+    :type timeout: int
+    :param node: IP address or FQDN for a scale computing node, this can be any node in the cluster you are managing.
+    :type node: str
+    :return: dict with per taskTag True (complete), False (error) or None (timeout)
+    :raises Exception: Failure description of the first task that failed for another reason than the timeout.
+    """
+
+    results = await asyncio.gather(*(_wait_for_task(api_headers, sctag, timeout, node) for sctag in sctags),
+                                   return_exceptions=True)
+    for result in results:
+        if isinstance(result, BaseException):
+            raise result
+    return {str(sctag): result for sctag, result in zip(sctags, results)}
+
+
+async def sc_get_all_vminfo(api_headers: dict, node: str) -> dict:
+    """
+    Load all vm info in disct
+
+    See ScaleFunctions.sc_get_all_vminfo.
+
+    :param api_headers: a dict with the api headers that include the sessionID cookie.
+    :type api_headers: dict
+    :param node: IP address or FQDN for a scale computing node, this can be any node in the cluster you are managing.
+    :type node: str
+    :return: dict
+    """
+
+    return await sc_get_client(node).get_json('VirDomain/', api_headers)
+
+
+async def sc_get_vm_info(type: str, identifier: str, api_headers: dict, node: str) -> dict:
+    """
+    Load all specific vm info in disct
+
+    See ScaleFunctions.sc_get_vm_info.
+
+    :param type: this can be either "vm" or "uuid".
+    :type type: str
+    :param identifier: The name or uuid for a vm depending on what was requested in type
+    :type identifier: str
+    :param api_headers: a dict with the api headers that include the sessionID cookie.
+    :type api_headers: dict
+    :param node: IP address or FQDN for a scale computing node, this can be any node in the cluster you are managing.
+    :type node: str
+    :return: dict
+    """
+
+    match type:
+        case "vm":
+            vm_uuid: str = await sc_get_uuid("vm", identifier, api_headers, node)
+        case "uuid":
+            vm_uuid = identifier
+
+    return await sc_get_client(node).get_json('VirDomain/' + vm_uuid, api_headers)
+
+
+async def sc_get_all_nodeinfo(api_headers: dict, node: str) -> dict:
+    """
+    Load all Node info in disct
+
+    See ScaleFunctions.sc_get_all_nodeinfo.
+
+    :param api_headers: a dict with the api headers that include the sessionID cookie.
+    :type api_headers: dict
+    :param node: IP address or FQDN for a scale computing node, this can be any node in the cluster you are managing.
+    :type node: str
+    :return: dict
+    """
+
+    return await sc_get_client(node).get_json('Node/', api_headers)
+
+
+async def _inventory(api_headers: dict, node: str, max_age: float, nodes: bool = False) -> ScaleInventory:
+    # the inventory ScaleFunctions uses for the node, but filled with aiohttp: left to itself it would fetch with
+    # requests and block the event loop
+    inventory = sc_get_inventory(api_headers, node)
+    if nodes and inventory.stale(max_age, nodes=True):
+        inventory.load_nodes(await sc_get_all_nodeinfo(api_headers, node))
+    elif not nodes and inventory.stale(max_age):
+        inventory.load_vms(await sc_get_all_vminfo(api_headers, node))
+    return inventory
+
+
+async def sc_get_uuid(type: str, identifier: str, api_headers: dict, node: str, max_age: float = 0) -> str:
+    """
+    Get UUID for a node or vm
+
+    See ScaleFunctions.sc_get_uuid, the lookup goes through the same inventory and indexes. By default the list is
+    fetched fresh, with max_age a list fetched at most that many seconds ago is used instead.
+
+    :param type: definition of what uuid is needed. can be "vm" or "node"
+    :type type: str
+    :param identifier: either vm name or node lanIP address
+    :type identifier: str
+    :param api_headers: a dict with the api headers that include the sessionID cookie.
+    :type api_headers: dict
+    :param node: IP address or FQDN for a scale computing node, this can be any node in the cluster you are managing.
+    :type node: str
+    :param max_age: seconds a cached list may be old, 0 always fetches.
+    :type max_age: float
+    :return: str
+    :raises Exception: Invalid type defined.
+    """
+
+    # the lists were brought up to date by _inventory, an infinite max_age keeps the inventory from fetching again
+    match type:
+        case "vm":
+            inventory = await _inventory(api_headers, node, max_age)
+            return inventory.vm_uuid(identifier, max_age=float("inf"))
+
+        case "node":
+            inventory = await _inventory(api_headers, node, max_age, nodes=True)
+            return inventory.node_uuid(identifier, max_age=float("inf"))
+
+        case _:
+            raise Exception(
+                f'invalid type defined. First argument must a string containing the text vm or node')
+
+
+async def sc_get_by_tag(tag: str, api_headers: dict, node: str, max_age: float = 0) -> dict:
+    """
+    Get a dict with all vms and their uuid with a given tag.
+
+    See ScaleFunctions.sc_get_by_tag, as in sc_get_uuid the list is fetched fresh unless a max_age is given.
+
+    :param tag: The tag to search for.
+    :type tag: str
+    :param api_headers: a dict with the api headers that include the sessionID cookie.
+    :type api_headers: dict
+    :param node: IP address or FQDN for a scale computing node, this can be any node in the cluster you are managing.
+    :type node: str
+    :param max_age: seconds a cached list may be old, 0 always fetches.
+    :type max_age: float
+    :return: dict
+    """
+
+    inventory = await _inventory(api_headers, node, max_age)
+    vm_list = {}
+    for vm in inventory.tagged_vms(tag, max_age=float("inf")):
+        key = vm["name"]
+        vm_list[key] = vm["uuid"]
+    return vm_list
+
+
+async def sc_snapshot(type: str, identifier: str, snapshot_label: str, api_headers: dict, node: str,
+                      max_in_flight: int = 8) -> dict:
+    """
+    Create a snapshot for one or more vms
+
+    See ScaleFunctions.sc_snapshot. With the 'tag' method the snapshot requests run concurrently, at most
+    max_in_flight at the same time, and a result map per vm uuid is returned as in ScaleFunctions.sc_snapshot_by_tag.
+
+    :example:
+    >>> await sc_snapshot("tag", "exampletag", "scripted snap by tag", session, host)
+
+    :param type: definition of snapshot to be made. Can be "uuid", "vmname" or "tag"
+    :type type: str
+    :param identifier: uuid, vmname or tag to be snappped.
+    :type identifier: str
+    :param snapshot_label: label for the snapshot
+    :type snapshot_label: str
+    :param api_headers: a dict with the api headers that include the sessionID cookie.
+    :type api_headers: dict
+    :param node: IP address or FQDN for a scale computing node, this can be any node in the cluster you are managing.
+    :type node: str
+    :param max_in_flight: only used for "tag", the maximum number of snapshot requests running at the same time.
+    :type max_in_flight: int
+    :return: snapshot response for "uuid" and "vmname", result map per vm uuid for "tag"
+    :raises Exception: Error message
+    """
+
+    client = sc_get_client(node)
+
+    match type:
+        case "uuid":
+            snapshot_payload = {
+                "domainUUID": identifier,
+                "label": snapshot_label
+            }
+            snapshot_response = await client.post_json('VirDomainSnapshot/', snapshot_payload, api_headers)
+            sc_get_inventory(api_headers, node).invalidate()
+            return snapshot_response
+
+        case "vmname":
+            get_uuid = await sc_get_uuid("vm", identifier, api_headers, node)
+            if get_uuid is None:
+                raise Exception(
+                    f'vm name {identifier} could not be found on the targeted cluster')
+            snapshot_payload = {
+                "domainUUID": get_uuid,
+                "label": snapshot_label
+            }
+            snapshot_response = await client.post_json('VirDomainSnapshot/', snapshot_payload, api_headers)
+            sc_get_inventory(api_headers, node).invalidate()
+            return snapshot_response
+
+        case "tag":
+            to_snap_dict = await sc_get_by_tag(identifier, api_headers, node)
+            if not to_snap_dict:
+                raise Exception(f'No VMs with tag {identifier} were found')
+            in_flight = asyncio.Semaphore(max(1, max_in_flight))
+
+            async def snap(name: str, get_uuid: str) -> None:
+                snapshot_payload = json.dumps({
+                    "domainUUID": get_uuid,
+                    "label": snapshot_label
+                })
+                try:
+                    async with in_flight:
+                        status, text, cookies = await client.request("POST", 'VirDomainSnapshot/', api_headers,
+                                                                     snapshot_payload)
+                    if status != 200:
+                        raise Exception(f'snapshot failed with status {status}: {text}')
+                    results[get_uuid] = {"name": name, "taskTag": json.loads(text)["taskTag"], "error": None}
+                except Exception as e:
+                    results[get_uuid] = {"name": name, "taskTag": None, "error": str(e)}
+
+            results = {}
+            await asyncio.gather(*(snap(name, get_uuid) for name, get_uuid in to_snap_dict.items()))
+            sc_get_inventory(api_headers, node).invalidate()
+            return results
+
+
+async def sc_change_tag(type: str, identifier: str, method: str, tags: list, api_headers: dict, node: str) -> None:
+    """
+    Change tags and tag order for vm's
+
+    See ScaleFunctions.sc_change_tag, the new tags are worked out by the same ScaleFunctions.sc_new_tags.
+
+    :example:
+    >>> await sc_change_tag("vm", "test123", "group", "dmo", session, host)
+
+    :param type: definition of vm to be changed. Can be "uuid" or "vm"
+    :type type: str
+    :param identifier: uuid or vm to be changed.
+    :type identifier: str
+    :param method: which method will be used, can be "add", "remove", "group" or "manual"
+    :type method: str
+    :param tags: tag to add, remove, group by, or comma delimited manual list.
+    :type tags: str
+    :param api_headers: a dict with the api headers that include the sessionID cookie.
+    :type api_headers: dict
+    :param node: IP address or FQDN for a scale computing node, this can be any node in the cluster you are managing.
+    :type node: str
+    :return: none
+    :raises Exception: Error message
+    """
+
+    vm_info = await sc_get_vm_info(type, identifier, api_headers, node)
+    vm_tags_str = sc_new_tags(vm_info[0]["tags"], method, tags)
+
+    tagchange_payload = {
+        "tags": vm_tags_str
+    }
+
+    tagchange_response = await sc_get_client(node).post_json('VirDomain/' + vm_info[0]["uuid"], tagchange_payload,
+                                                             api_headers)
+    sc_get_inventory(api_headers, node).invalidate()
+    return tagchange_response
+
+
+async def sc_change_tags_bulk(selector, method: str, tags: str, api_headers: dict, node: str,
+                              max_in_flight: int = 8) -> dict:
+    """
+    Change tags for many vm's at once
+
+    See ScaleFunctions.sc_change_tags_bulk. The vms are selected and their new tags worked out by the same
+    ScaleFunctions.sc_plan_tag_changes, the POSTs for the vms whose tags change run concurrently, at most
+    max_in_flight at the same time.
+
+    :example:
+    >>> report = await sc_change_tags_bulk("linux", "add", "patched", session, host)
+
+    :param selector: a tag (str), a list of vm names or uuids, or a function that gets a vm dict and returns True for
+        the vms to change.
+    :type selector: str | list | callable
+    :param method: which method will be used, can be "add", "remove", "group" or "manual"
+    :type method: str
+    :param tags: tag to add, remove, group by, or comma delimited manual list.
+    :type tags: str
+    :param api_headers: a dict with the api headers that include the sessionID cookie.
+    :type api_headers: dict
+    :param node: IP address or FQDN for a scale computing node, this can be any node in the cluster you are managing.
+    :type node: str
+    :param max_in_flight: maximum number of tag change requests running at the same time.
+    :type max_in_flight: int
+    :return: dict with per vm uuid a dict with name, old, new, status ("changed", "unchanged" or "error"), taskTag and
+        error
+    """
+
+    client = sc_get_client(node)
+    report = sc_plan_tag_changes(await sc_get_all_vminfo(api_headers, node), selector, method, tags)
+    in_flight = asyncio.Semaphore(max(1, max_in_flight))
+
+    async def change(vm_uuid: str) -> None:
+        entry = report[vm_uuid]
+        tagchange_payload = json.dumps({
+            "tags": entry["new"]
+        })
+        try:
+            async with in_flight:
+                status, text, cookies = await client.request("POST", 'VirDomain/' + vm_uuid, api_headers,
+                                                             tagchange_payload)
+            if status != 200:
+                raise Exception(f'tag change failed with status {status}: {text}')
+            entry["taskTag"] = json.loads(text).get("taskTag")
+            entry["status"] = "changed"
+        except Exception as e:
+            entry["status"] = "error"
+            entry["error"] = str(e)
+
+    await asyncio.gather(*(change(vm_uuid) for vm_uuid, entry in report.items() if entry["new"] != entry["old"]))
+    sc_get_inventory(api_headers, node).invalidate()
+    return report
+
+
+if __name__ == "__main__":
+    print("This script was never intended to be run directly. Feel free to do so, but a more elegant way would be to import it"
+          " as a module into your own code.")
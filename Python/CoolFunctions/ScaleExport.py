@@ -0,0 +1,310 @@
+import json
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, wait
+from contextlib import contextmanager
+
+import ScaleFunctions as sc
+
+# Pipelined vm exports on top of ScaleFunctions.
+#
+# The PowerShell export scripts (ExportVM, ExportVMLastSnap, ExportReplica) handle one vm at a time: clone, export,
+# wait, delete the clone, next vm. Here every vm is a job that moves through the same stages, but the stages of
+# different jobs overlap: while a few exports are writing to the SMB share the next clones are already being made and
+# finished clones are cleaned up. Every stage has its own concurrency limit, the export limit counts per SMB server.
+#
+# Unlike the PowerShell scripts the export is written to <path>/<vm name><date> instead of <path>/<vm name>/<vm name>
+# <date>, python has no way to create the per vm folder on the share first.
+
+STAGES = ("clone", "export", "cleanup")
+
+
+def sc_export_path(target: dict, export_name: str, credentials: bool = True) -> str:
+    """
+    Build the smb:// pathURI for an export
+
+    :example:
+    >>> target = {"server": "fileserver.mydomain.local", "path": "/exports", "domain": "mydomain.local",
+    ...           "username": "administrator", "password": "MyS3cret"}
+    >>> sc_export_path(target, "testvm012024-01-01-0200", credentials=False)
+    'smb://fileserver.mydomain.local/exports/testvm012024-01-01-0200'
+
+    :param target: dict with server, path (starting with a / and ending without one), domain, username and password.
+    :type target: dict
+    :param export_name: name of the export folder.
+    :type export_name: str
+    :param credentials: include the credentials, leave them out for anything that is printed or stored.
+    :type credentials: bool
+    :return: str
+    """
+
+    login = f'{target["domain"]};{target["username"]}:{target["password"]}@' if credentials else ''
+    return f'smb://{login}{target["server"]}{target["path"]}/{export_name}'
+
+
+class ExportPipeline:
+    """
+    Export many vms with overlapping clone, export and cleanup stages
+
+    Every vm passes through the stages clone (a clone of the vm, or of its last snapshot with from_snapshot), export
+    (of the clone) and cleanup (deleting the clone again, also when the export failed). Without clone the vm itself (or
+    with from_snapshot its last snapshot) is exported and there is nothing to clean up.
+
+    Each stage has its own limit on the number of jobs in it at the same time, the export limit counts per SMB server
+    so a slow share only holds up its own exports. A job waiting for an export slot keeps its clone, so the number of
+    clones on the cluster never exceeds the sum of the limits. Every progress_interval seconds a progress line is
+    printed, summary() returns the time spent per stage. The tasks of all jobs are polled by one sc.TaskWatcher, which
+    backs off from quick polls for short tasks up to poll_interval for the long exports.
+
+    :example:
+    >>> pipeline = ExportPipeline(session, host, target, from_snapshot=True, clone_in_flight=8, export_in_flight=2)
+    >>> jobs = pipeline.run(sc.sc_get_all_vminfo(session, host))
+    >>> pipeline.summary()["stages"]["export"]
+    {'done': 40, 'failed': 0, 'running': 0, 'seconds': 5123.4, 'mean': 128.1, 'max': 301.2, 'waiting': 812.5}
+
+    :param api_headers: a dict with the api headers that include the sessionID cookie.
+    :type api_headers: dict
+    :param node: IP address or FQDN for a scale computing node, this can be any node in the cluster you are managing.
+    :type node: str
+    :param target: the SMB target (see sc_export_path), or a function that gets a vm dict and returns its target.
+    :type target: dict | callable
+    :param clone: export a clone of the vm instead of the vm itself.
+    :type clone: bool
+    :param from_snapshot: use the last snapshot of the vm, required for replicas.
+    :type from_snapshot: bool
+    :param clone_in_flight: maximum number of clones being made at the same time.
+    :type clone_in_flight: int
+    :param export_in_flight: maximum number of exports running at the same time per SMB server.
+    :type export_in_flight: int
+    :param cleanup_in_flight: maximum number of clones being deleted at the same time.
+    :type cleanup_in_flight: int
+    :param timeout: Timeout per task in seconds.
+    :type timeout: int
+    :param poll_interval: upper limit for the seconds between two polls of a running task.
+    :type poll_interval: float
+    :param progress_interval: seconds between two progress lines, 0 to print none.
+    :type progress_interval: float
+    """
+
+    def __init__(self, api_headers: dict, node: str, target, clone: bool = True, from_snapshot: bool = False,
+                 clone_in_flight: int = 8, export_in_flight: int = 2, cleanup_in_flight: int = 8, timeout: int = 7200,
+                 poll_interval: float = 30.0, progress_interval: float = 10.0):
+        self.client = sc.sc_get_client(node)
+        self.api_headers = api_headers
+        self.node = node
+        self.target = target
+        self.clone = clone
+        self.from_snapshot = from_snapshot
+        self.limits = {"clone": max(1, clone_in_flight), "export": max(1, export_in_flight),
+                       "cleanup": max(1, cleanup_in_flight)}
+        self.timeout = timeout
+        self.poll_interval = poll_interval
+        self.progress_interval = progress_interval
+
+        self.watcher = None
+        self.jobs = {}
+        self.started = None
+        self.finished = None
+        self.stages = {stage: {"done": 0, "failed": 0, "running": 0, "seconds": 0.0, "max": 0.0, "waiting": 0.0}
+                       for stage in STAGES}
+        self._slots = {}
+        self._lock = threading.Lock()
+
+    def _target(self, vm: dict) -> dict:
+        return self.target(vm) if callable(self.target) else self.target
+
+    def _slot(self, stage: str, key: str = None) -> threading.Semaphore:
+        with self._lock:
+            if (stage, key) not in self._slots:
+                self._slots[(stage, key)] = threading.Semaphore(self.limits[stage])
+            return self._slots[(stage, key)]
+
+    @contextmanager
+    def _stage(self, stage: str, job: dict, key: str = None):
+        # wait for a slot in the stage, then time the work done in it
+        waited = time.time()
+        job["status"] = "waiting"
+        with self._slot(stage, key):
+            start = time.time()
+            with self._lock:
+                self.stages[stage]["waiting"] += start - waited
+                self.stages[stage]["running"] += 1
+            job["status"] = stage
+            try:
+                yield
+            except Exception:
+                self._count(stage, job, start, "failed")
+                raise
+            self._count(stage, job, start, "done")
+
+    def _count(self, stage: str, job: dict, start: float, outcome: str) -> None:
+        seconds = time.time() - start
+        job["seconds"][stage] = round(seconds, 3)
+        with self._lock:
+            stats = self.stages[stage]
+            stats["running"] -= 1
+            stats[outcome] += 1
+            stats["seconds"] += seconds
+            stats["max"] = max(stats["max"], seconds)
+
+    def _task(self, method: str, endpoint: str, payload: dict = None) -> dict:
+        response = self.client.request(method, endpoint, self.api_headers,
+                                       json.dumps(payload) if payload is not None else None)
+        if response.status_code != 200:
+            raise Exception(f'{method} {endpoint} failed with status {response.status_code}: {response.text}')
+        return json.loads(response.text)
+
+    def _wait(self, job: dict, sctag: str) -> None:
+        # the watcher polls, the job only picks up the progressPercent of the task every now and then
+        sctag = str(sctag)
+        future = self.watcher.add(sctag)[0]
+        while not wait([future], self.poll_interval)[0]:
+            job["progress"] = self.watcher.progress.get(sctag)
+        job["progress"] = self.watcher.progress.get(sctag)
+        if not future.result():
+            raise Exception(f'task {sctag} failed on the cluster')
+
+    def _run_job(self, vm: dict) -> None:
+        job = self.jobs[vm["uuid"]]
+        target = self._target(vm)
+        export_uuid = vm["uuid"]
+        snap_uuid = None
+        try:
+            if self.from_snapshot:
+                if not vm.get("snapUUIDs"):
+                    raise Exception(f'vm {vm["name"]} has no snapshot to export')
+                snap_uuid = vm["snapUUIDs"][-1]
+
+            if self.clone:
+                with self._stage("clone", job):
+                    clone_payload = {"template": {"name": job["export"], "tags": "BackupRun," + vm["tags"]}}
+                    if snap_uuid is not None:
+                        clone_payload["snapUUID"] = snap_uuid
+                    clone_response = self._task("POST", 'VirDomain/' + vm["uuid"] + '/clone', clone_payload)
+                    job["clone"] = clone_response["createdUUID"]
+                    self._wait(job, clone_response["taskTag"])
+                export_uuid = job["clone"]
+                snap_uuid = None
+
+            with self._stage("export", job, target["server"]):
+                export_payload = {"target": {"pathURI": sc_export_path(target, job["export"]),
+                                             "definitionFileName": job["export"] + ".xml"}}
+                if snap_uuid is not None:
+                    export_payload["snapUUID"] = snap_uuid
+                export_response = self._task("POST", 'VirDomain/' + export_uuid + '/export', export_payload)
+                self._wait(job, export_response["taskTag"])
+            job["exported"] = True
+        except Exception as e:
+            job["error"] = str(e)
+        finally:
+            if job["clone"] is not None:
+                try:
+                    with self._stage("cleanup", job):
+                        self._wait(job, self._task("DELETE", 'VirDomain/' + job["clone"])["taskTag"])
+                except Exception as e:
+                    job["error"] = job["error"] or f'clone {job["clone"]} could not be removed: {e}'
+        job["status"] = "done" if job["exported"] and job["error"] is None else "error"
+        print(f'{vm["name"]} - ' + (f'exported to {job["path"]}' if job["status"] == "done" else job["error"]))
+
+    def progress(self) -> dict:
+        """
+        Number of jobs per status (queued, waiting for a stage slot, clone, export, cleanup, done, error).
+        """
+
+        counts = dict.fromkeys(("queued", "waiting") + STAGES + ("done", "error"), 0)
+        for job in list(self.jobs.values()):
+            counts[job["status"]] += 1
+        return counts
+
+    def _report(self, stop: threading.Event) -> None:
+        while not stop.wait(self.progress_interval):
+            counts = self.progress()
+            print(f'export progress after {time.time() - self.started:.0f}s: ' +
+                  ', '.join(f'{status} {count}' for status, count in counts.items()))
+
+    def run(self, vms: list) -> dict:
+        """
+        Export the vms and return a dict with per vm uuid its job.
+
+        A job is a dict with name, export (the export name), path (the export path without credentials), clone (the
+        uuid of the clone), status ("done" or "error"), error, exported, progress (progressPercent of the last polled
+        task) and seconds (the time spent per stage).
+        """
+
+        stamp = time.strftime("%Y-%m-%d-%H%M")
+        servers = set()
+        for vm in vms:
+            target = self._target(vm)
+            servers.add(target["server"])
+            self.jobs[vm["uuid"]] = {"name": vm["name"], "export": vm["name"] + stamp,
+                                     "path": sc_export_path(target, vm["name"] + stamp, credentials=False),
+                                     "clone": None, "status": "queued", "error": None, "exported": False,
+                                     "progress": None, "seconds": {}}
+
+        # one thread per job that is in a stage (or holding a clone while it waits for the next one)
+        workers = self.limits["export"] * max(1, len(servers))
+        if self.clone:
+            workers += self.limits["clone"] + self.limits["cleanup"]
+        self.started = time.time()
+        stop = threading.Event()
+        if self.progress_interval:
+            threading.Thread(target=self._report, args=(stop,), daemon=True).start()
+        self.watcher = sc.TaskWatcher(self.api_headers, self.node, self.timeout,
+                                      initial_interval=min(0.5, self.poll_interval), max_interval=self.poll_interval)
+        self.watcher.start(keep_running=True)
+        try:
+            with ThreadPoolExecutor(max_workers=workers) as pool:
+                list(pool.map(self._run_job, vms))
+        finally:
+            self.watcher.stop()
+            stop.set()
+            self.finished = time.time()
+        if self.clone:
+            sc.sc_invalidate_inventory(self.node)
+        return self.jobs
+
+    def summary(self) -> dict:
+        """
+        Wall time, job counts and per stage the number of jobs done and failed, the seconds spent in the stage (total,
+        mean and max) and the seconds jobs waited for a slot in it.
+        """
+
+        with self._lock:
+            stages = {stage: dict(stats, seconds=round(stats["seconds"], 3), max=round(stats["max"], 3),
+                                  waiting=round(stats["waiting"], 3),
+                                  mean=round(stats["seconds"] / (stats["done"] + stats["failed"]), 3)
+                                  if stats["done"] + stats["failed"] else None)
+                      for stage, stats in self.stages.items()}
+        return {"seconds": round((self.finished or time.time()) - self.started, 3) if self.started else None,
+                "jobs": self.progress(), "stages": stages}
+
+
+def sc_export_by_tag(tag: str, target, api_headers: dict, node: str, **options) -> dict:
+    """
+    Export all vms with a given tag through an ExportPipeline
+
+    :example:
+    >>> jobs = sc_export_by_tag("MakeReplicaBackup", target, session, host, from_snapshot=True, export_in_flight=2)
+
+    :param tag: All vm's with this tag will be exported.
+    :type tag: str
+    :param target: the SMB target (see sc_export_path), or a function that gets a vm dict and returns its target.
+    :type target: dict | callable
+    :param api_headers: a dict with the api headers that include the sessionID cookie.
+    :type api_headers: dict
+    :param node: IP address or FQDN for a scale computing node, this can be any node in the cluster you are managing.
+    :type node: str
+    :param options: passed on to ExportPipeline (clone, from_snapshot, the stage limits, ...).
+    :return: dict with per vm uuid its job, see ExportPipeline.run
+    :raises Exception: No vms with the tag were found.
+    """
+
+    vms = sc.sc_get_inventory(api_headers, node).tagged_vms(tag, max_age=0)
+    if not vms:
+        raise Exception(f'No VMs with tag {tag} were found')
+    return ExportPipeline(api_headers, node, target, **options).run(vms)
+
+
+if __name__ == "__main__":
+    print("This script was never intended to be run directly. Feel free to do so, but a more elegant way would be to import it"
+          " as a module into your own code.")
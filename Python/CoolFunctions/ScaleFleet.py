@@ -0,0 +1,197 @@
+import inspect
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import ScaleFunctions as sc
+from ScaleLimiter import RateLimiter
+
+# Fleet layer on top of ScaleFunctions: run the same sc_* operation against many clusters at once.
+#
+# Every cluster gets one logged in session, its own small worker pool and one request limiter that all operations on
+# it share, so a slow or busy cluster can never take more than its share of work while all clusters make progress in
+# parallel. Results come back as one dict keyed by cluster name. Used as a context manager the sessions are always
+# logged out again, also when an operation raises.
+
+
+def _bind(signature, args: tuple, kwargs: dict, api_headers, node) -> tuple:
+    # put api_headers and node on their own parameters and let args fill the others in signature order
+    if signature is None:
+        return args, dict(kwargs, api_headers=api_headers, node=node)
+    fleet_values = {"api_headers": api_headers, "node": node}
+    remaining = list(args)
+    positional = []
+    for parameter in signature.parameters.values():
+        if not remaining or parameter.kind not in (parameter.POSITIONAL_ONLY, parameter.POSITIONAL_OR_KEYWORD):
+            break
+        if parameter.name in fleet_values:
+            positional.append(fleet_values.pop(parameter.name))
+        else:
+            positional.append(remaining.pop(0))
+    bound = signature.bind(*positional, *remaining, **kwargs, **fleet_values)
+    return bound.args, bound.kwargs
+
+
+class ScaleFleet:
+    """
+    Run sc_* operations across many clusters in parallel
+
+    clusters is a list of dicts with "node", "username" and "password" and an optional "name" (defaults to the node)
+    that is used as key in the results. Login happens for all clusters in parallel when entering the with block (or on
+    login()); a cluster that fails to log in is reported with its error by every run() and skipped otherwise.
+
+    :example:
+    >>> clusters = [{"name": "site-a", "node": "10.0.0.1", "username": "admin", "password": "admin"},
+    ...             {"name": "site-b", "node": "10.1.0.1", "username": "admin", "password": "admin"}]
+    >>> with ScaleFleet(clusters, per_cluster=4) as fleet:
+    ...     vms = fleet.run(sc.sc_get_all_vminfo)
+    ...     snaps = fleet.run(sc.sc_snapshot_by_tag, "SnapMeScript", "nightly")
+    >>> vms["site-a"]["result"]
+
+    :param clusters: the clusters to manage.
+    :type clusters: list
+    :param per_cluster: maximum number of operations, and of requests, running against a single cluster at the same
+        time. Also passed as max_in_flight to the sc_* functions that take it, unless given explicitly. The request
+        limit is one RateLimiter on a ScaleClient of the fleet for that cluster (see ScaleFunctions.ClientNode) that all
+        operations share, so operations that fan out themselves still send at most per_cluster requests at once.
+    :type per_cluster: int
+    """
+
+    def __init__(self, clusters: list, per_cluster: int = 4):
+        self.clusters = {}
+        for cluster in clusters:
+            name = cluster.get("name", cluster["node"])
+            if name in self.clusters:
+                raise Exception(f'cluster {name} is listed more than once')
+            self.clusters[name] = dict(cluster, name=name)
+        self.per_cluster = max(1, per_cluster)
+        self.sessions = {}
+        self.login_errors = {}
+        self._pools = {}
+        self._nodes = {}
+
+    def _for_each(self, function, names) -> dict:
+        # one call per cluster, in parallel over the clusters, keyed by name
+        with ThreadPoolExecutor(max_workers=max(1, len(names))) as pool:
+            futures = {name: pool.submit(function, self.clusters[name]) for name in names}
+        results = {}
+        for name, future in futures.items():
+            try:
+                results[name] = (future.result(), None)
+            except Exception as e:
+                results[name] = (None, str(e))
+        return results
+
+    def login(self) -> dict:
+        """
+        Log in to every cluster that has no session yet, in parallel.
+
+        :return: dict with per cluster name the login error, None when the login worked
+        """
+
+        names = [name for name in self.clusters if name not in self.sessions]
+        for name in names:
+            # all requests to this cluster, from every operation and every worker they start, go over this client and
+            # share its limit. Other code in the process keeps using the shared client of the node.
+            if name not in self._nodes:
+                node = self.clusters[name]["node"]
+                limiter = RateLimiter(**dict(sc.rate_limits or {"max_rate": 0}, max_in_flight=self.per_cluster))
+                self._nodes[name] = sc.ClientNode(node, sc.ScaleClient(node, pool_maxsize=self.per_cluster,
+                                                                       limiter=limiter))
+        logins = self._for_each(lambda cluster: sc.sc_login(cluster["username"], cluster["password"],
+                                                            self._nodes[cluster["name"]]), names)
+        for name, (session, error) in logins.items():
+            if error is None:
+                self.sessions[name] = session
+                self.login_errors.pop(name, None)
+                self._pools[name] = ThreadPoolExecutor(max_workers=self.per_cluster)
+            else:
+                self.login_errors[name] = error
+        return {name: error for name, (session, error) in logins.items()}
+
+    def run(self, function, *args, clusters: list = None, **kwargs) -> dict:
+        """
+        Run one sc_* operation on every cluster
+
+        function is called once per cluster with the session and node of that cluster for its api_headers and node
+        parameters. args fill the other parameters in the order of the signature of function, so both
+        fleet.run(sc.sc_snapshot, "tag", "linux", "nightly") and fleet.run(sc.sc_wait_for_task, "1234", 600) work.
+        Calls for different clusters run in parallel, calls for the same cluster share its per_cluster worker pool
+        and request limiter, so run() can safely be called from several threads at once.
+
+        :example:
+        >>> fleet.run(sc.sc_change_tags_bulk, "linux", "add", "patched")
+        {'site-a': {'result': {...}, 'error': None, 'seconds': 0.41}, 'site-b': {...}}
+
+        :param function: any function with api_headers and node parameters, like the sc_* functions.
+        :type function: callable
+        :param clusters: names of the clusters to run on, defaults to all.
+        :type clusters: list
+        :return: dict with per cluster name a dict with result, error (None or the error text) and seconds
+        :raises TypeError: the arguments do not fit the signature of function.
+        """
+
+        names = list(self.clusters) if clusters is None else list(clusters)
+        try:
+            signature = inspect.signature(function)
+        except (TypeError, ValueError):
+            signature = None
+        if signature is not None and "max_in_flight" in signature.parameters and "max_in_flight" not in kwargs:
+            kwargs["max_in_flight"] = self.per_cluster
+        # fail once here instead of once per cluster when the arguments do not fit
+        _bind(signature, args, kwargs, None, None)
+
+        def timed(name: str):
+            call_args, call_kwargs = _bind(signature, args, kwargs, self.sessions[name], self._nodes[name])
+            start = time.perf_counter()
+            result = function(*call_args, **call_kwargs)
+            return result, time.perf_counter() - start
+
+        futures = {}
+        results = {}
+        for name in names:
+            if name not in self.clusters:
+                raise Exception(f'cluster {name} is not part of this fleet')
+            if name in self.sessions:
+                futures[name] = self._pools[name].submit(timed, name)
+            else:
+                results[name] = {"result": None, "seconds": 0.0,
+                                 "error": self.login_errors.get(name, "not logged in")}
+
+        for name, future in futures.items():
+            try:
+                result, seconds = future.result()
+                results[name] = {"result": result, "error": None, "seconds": round(seconds, 4)}
+            except Exception as e:
+                results[name] = {"result": None, "error": str(e), "seconds": None}
+        return {name: results[name] for name in names}
+
+    def logout(self) -> dict:
+        """
+        Log out of every cluster, in parallel. Errors do not stop the other logouts.
+
+        :return: dict with per cluster name the logout error, None when the logout worked
+        """
+
+        for pool in self._pools.values():
+            pool.shutdown(wait=True)
+        self._pools = {}
+        names = list(self.sessions)
+        logouts = self._for_each(lambda cluster: sc.sc_logout(self.sessions[cluster["name"]],
+                                                              self._nodes[cluster["name"]]), names)
+        self.sessions = {}
+        for node in self._nodes.values():
+            node.client.close()
+        self._nodes = {}
+        return {name: error for name, (result, error) in logouts.items()}
+
+    def __enter__(self):
+        self.login()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.logout()
+
+
+if __name__ == "__main__":
+    print("This script was never intended to be run directly. Feel free to do so, but a more elegant way would be to import it"
+          " as a module into your own code.")
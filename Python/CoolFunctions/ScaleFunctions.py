@@ -1,8 +1,23 @@
 import requests
+import requests.adapters
+import codecs
 import json
+import os
+import random
+import re
+import stat
 import time
+import threading
+from collections import namedtuple
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, as_completed, wait
+from concurrent.futures import TimeoutError as FutureTimeoutError
 import urllib3
 
+from ScaleLimiter import RateLimiter
+from ScaleRecords import BlockDev, Node, Vm, VmStatsSample
+from ScaleTelemetry import metrics
+
 # The below is to ignore self-signed certificate. This is a bad practice. I need to figure out some way to get the node cert and ca
 # and write thos as a PEM to the OS. (also not something i like, but at least then this is also applicable to stuff that is properly
 # setup)
@@ -11,6 +26,618 @@ import urllib3
 urllib3.disable_warnings(category=urllib3.exceptions.InsecureRequestWarning)
 
 
+class NodePool:
+    """
+    The nodes of one cluster that reads can be spread over
+
+    The latency of a node is the median of its last 5 requests, so a single slow request (a new TLS connection) does not
+    count against it. pick() takes two random healthy nodes and returns the clearly faster one, or either when they are
+    about as fast, so load goes to all nodes but less of it to a slow one. A node without at least 3 recent requests
+    has no latency yet and is preferred, which also makes an avoided node get tried again after forget_seconds.
+
+    A node is ejected for eject_seconds when a request to it fails (no answer or a 5xx), or when its latency gets
+    eject_factor times slower than the fastest other node (and slower than eject_floor). The last healthy node is never
+    ejected.
+
+    With hedge_percentile set, hedge_after() returns the latency of that percentile of the last 256 requests of an
+    endpoint, ScaleClient sends a duplicate of a GET to a second node once the first has taken that long.
+
+    :example:
+    >>> client.use_all_nodes(session, hedge_percentile=0.95)
+    >>> client.nodes
+    NodePool(healthy=3/3, ejections=0, hedges=0)
+
+    :param primary: the node the client was made for.
+    :type primary: str
+    :param addresses: all node addresses, including the primary.
+    :type addresses: list
+    :param eject_factor: eject a node this many times slower than the fastest other node.
+    :type eject_factor: float
+    :param eject_floor: never eject for latency below this many seconds.
+    :type eject_floor: float
+    :param eject_seconds: how long an ejected node is skipped.
+    :type eject_seconds: float
+    :param hedge_percentile: latency percentile after which a GET is hedged, None to never hedge.
+    :type hedge_percentile: float
+    :param forget_seconds: latencies older than this are forgotten.
+    :type forget_seconds: float
+    """
+
+    def __init__(self, primary: str, addresses: list, eject_factor: float = 3.0, eject_floor: float = 0.2,
+                 eject_seconds: float = 30.0, hedge_percentile: float = None, forget_seconds: float = 2.0):
+        self.primary = primary
+        self.addresses = list(addresses)
+        self.eject_factor = eject_factor
+        self.eject_floor = eject_floor
+        self.eject_seconds = eject_seconds
+        self.hedge_percentile = hedge_percentile
+        self.forget_seconds = forget_seconds
+        self.recent = {address: deque(maxlen=5) for address in self.addresses}
+        self.updated = {}
+        self.ejected = {}
+        self.samples = {}
+        self.ejections = 0
+        self.hedges = 0
+        self._lock = threading.Lock()
+        self._random = random.Random()
+
+    def latency(self, address: str) -> float:
+        """
+        Median latency of the recent requests to a node, None when there are too few.
+        """
+
+        recent = self.recent.get(address)
+        if not recent or len(recent) < 3 or time.monotonic() - self.updated.get(address, 0.0) > self.forget_seconds:
+            return None
+        return sorted(recent)[len(recent) // 2]
+
+    def healthy(self) -> list:
+        """
+        The addresses that are not ejected right now. Nodes whose ejection has ended start without a latency.
+        """
+
+        now = time.monotonic()
+        with self._lock:
+            for address, until in list(self.ejected.items()):
+                if until <= now:
+                    del self.ejected[address]
+                    self.recent[address].clear()
+            return [address for address in self.addresses if address not in self.ejected]
+
+    def pick(self, exclude: str = None) -> str:
+        """
+        A healthy node for the next read, None when exclude was the only option.
+        """
+
+        candidates = [address for address in self.healthy() if address != exclude]
+        if not candidates:
+            return self.primary if exclude != self.primary else None
+        if len(candidates) == 1:
+            return candidates[0]
+        first, second = self._random.sample(candidates, 2)
+        first_latency = self.latency(first) or 0.0
+        second_latency = self.latency(second) or 0.0
+        return second if second_latency * 1.5 < first_latency else first
+
+    def record(self, address: str, endpoint: str, seconds: float, ok: bool) -> None:
+        """
+        Update the node health with the outcome of a request.
+        """
+
+        with self._lock:
+            if address not in self.recent:
+                return
+            if time.monotonic() - self.updated.get(address, 0.0) > self.forget_seconds:
+                self.recent[address].clear()
+            self.recent[address].append(seconds)
+            self.updated[address] = time.monotonic()
+            if ok:
+                self.samples.setdefault(endpoint.split('/', 1)[0], deque(maxlen=256)).append(seconds)
+
+            others = [other for other in self.addresses if other != address and other not in self.ejected]
+            if address in self.ejected or not others:
+                return
+            latency = self.latency(address)
+            known = [other_latency for other_latency in map(self.latency, others) if other_latency is not None]
+            if not ok or (latency is not None and known and latency > self.eject_floor
+                          and latency > self.eject_factor * min(known)):
+                self.ejected[address] = time.monotonic() + self.eject_seconds
+                self.ejections += 1
+
+    def readmit(self, addresses: list) -> None:
+        """
+        End the ejection of these nodes, used after a successful health check.
+        """
+
+        with self._lock:
+            for address in addresses:
+                if self.ejected.pop(address, None) is not None:
+                    self.recent[address].clear()
+
+    def hedge_after(self, endpoint: str) -> float:
+        """
+        Seconds after which a GET on this endpoint is hedged, None when hedging is off or there is too little data.
+        """
+
+        if self.hedge_percentile is None:
+            return None
+        samples = self.samples.get(endpoint.split('/', 1)[0])
+        if samples is None or len(samples) < 20:
+            return None
+        ordered = sorted(samples)
+        return ordered[min(len(ordered) - 1, int(len(ordered) * self.hedge_percentile))]
+
+    def __repr__(self) -> str:
+        return (f'NodePool(healthy={len(self.healthy())}/{len(self.addresses)}, ejections={self.ejections}, '
+                f'hedges={self.hedges})')
+
+
+class ScaleClient:
+    """
+    Keep-alive connection to the hypercore API
+
+    This class owns a single requests.Session with a connection pool towards one node. Consecutive calls reuse the same
+    TCP and TLS connection instead of doing a fresh handshake for every request. All sc_* functions in this module use
+    a ScaleClient under the hood (one per node, see sc_get_client), so you only need to create one yourself when you
+    want to tune the pool. The client is shared by everyone working with the node, so it does not keep the session of a
+    login: login() returns the api headers and every call takes them.
+
+    :example:
+    >>> client = ScaleClient("192.168.0.1", pool_maxsize=20)
+    >>> session = client.login("admin", "admin")
+    >>> vms = client.get_json("VirDomain/", session)
+    >>> client.logout(session)
+
+    :param node: IP address or FQDN for a scale computing node, this can be any node in the cluster you are managing.
+    :type node: str
+    :param pool_connections: number of connection pools to cache.
+    :type pool_connections: int
+    :param pool_maxsize: maximum number of connections kept alive to the node. Raise this when running calls in parallel.
+    :type pool_maxsize: int
+    :param verify: certificate verification, False (default) or a path to a CA bundle.
+    :type verify: bool | str
+    :param limiter: optional ScaleLimiter.RateLimiter every request of this client goes through.
+    :type limiter: RateLimiter
+    """
+
+    def __init__(self, node: str, pool_connections: int = 1, pool_maxsize: int = 32, verify=False,
+                 limiter: RateLimiter = None):
+        self.node = node
+        self.limiter = limiter
+        self.nodes = None
+        self._hedger = None
+        self.pool_maxsize = pool_maxsize
+        self.connect_timeout = None
+        self.api_prefix = 'https://' + node + '/rest/v1/'
+        self.api_headers = {
+            'Content-Type': 'application/json'
+        }
+
+        self.verify = verify
+        self.session = requests.Session()
+        adapter = requests.adapters.HTTPAdapter(pool_connections=pool_connections,
+                                                pool_maxsize=pool_maxsize)
+        self.session.mount('https://', adapter)
+
+    def request(self, method: str, endpoint: str, api_headers: dict = None, payload: str = None,
+                stream: bool = False) -> requests.Response:
+        """
+        Perform a single request on the pooled session
+
+        :param method: HTTP method, "GET", "POST", "DELETE", ...
+        :type method: str
+        :param endpoint: endpoint below /rest/v1/, for example "VirDomain/" or "TaskTag/123".
+        :type endpoint: str
+        :param api_headers: headers to send, defaults to headers without a session cookie.
+        :type api_headers: dict
+        :param payload: json encoded request body.
+        :type payload: str
+        :param stream: do not read the body yet, it is read while iterating over response.iter_content().
+        :type stream: bool
+        :return: requests.Response
+        """
+
+        if api_headers is None:
+            api_headers = self.api_headers
+        cookie = api_headers.get('Cookie')
+        response = self._send(method, endpoint, api_headers, payload, stream)
+
+        # headers of a ScaleSession log in again once when the session expired or was logged out, then retry
+        if response.status_code == 401 and isinstance(api_headers, SessionHeaders) and endpoint not in ('login', 'logout'):
+            if api_headers.session.relogin(cookie):
+                response = self._send(method, endpoint, api_headers, payload, stream)
+        return response
+
+    def _send(self, method: str, endpoint: str, api_headers: dict, payload: str, stream: bool) -> requests.Response:
+        # only reads are spread over the nodes, everything that changes something goes to the node the client was made for
+        if self.nodes is None or method != "GET":
+            return self._send_to(self.node, method, endpoint, api_headers, payload, stream)
+
+        address = self.nodes.pick()
+        try:
+            hedge_after = self.nodes.hedge_after(endpoint) if not stream else None
+            if hedge_after is None:
+                return self._send_to(address, method, endpoint, api_headers, payload, stream)
+            return self._send_hedged(address, hedge_after, method, endpoint, api_headers, payload)
+        except requests.exceptions.RequestException:
+            # the node is down or rebooting (and is ejected by now), try once more on the original node
+            if address == self.node:
+                raise
+            return self._send_to(self.node, method, endpoint, api_headers, payload, stream)
+
+    def _send_hedged(self, address: str, hedge_after: float, method: str, endpoint: str, api_headers: dict,
+                     payload: str) -> requests.Response:
+        # send the same GET to a second node when the first one is slower than usual, the first answer wins
+        first = self._hedger.submit(self._send_to, address, method, endpoint, api_headers, payload, False)
+        try:
+            return first.result(timeout=hedge_after)
+        except FutureTimeoutError:
+            pass
+        second_address = self.nodes.pick(exclude=address)
+        if second_address is None:
+            return first.result()
+        self.nodes.hedges += 1
+        second = self._hedger.submit(self._send_to, second_address, method, endpoint, api_headers, payload, False)
+
+        pending = {first, second}
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                if future.exception() is None:
+                    for loser in pending:
+                        loser.add_done_callback(lambda f: f.exception() is None and f.result().close())
+                    return future.result()
+        return first.result()
+
+    def _send_to(self, address: str, method: str, endpoint: str, api_headers: dict, payload: str,
+                 stream: bool) -> requests.Response:
+        if self.limiter is not None:
+            self.limiter.acquire()
+        start = time.monotonic()
+        status = None
+        retry_after = None
+        try:
+            response = self.session.request(method,
+                                            'https://' + address + '/rest/v1/' + endpoint,
+                                            headers=api_headers,
+                                            data=payload,
+                                            verify=self.verify,
+                                            stream=stream,
+                                            timeout=(self.connect_timeout, None) if self.connect_timeout else None
+                                            )
+            status = response.status_code
+            if status == 429:
+                try:
+                    retry_after = float(response.headers.get('Retry-After', 0))
+                except ValueError:
+                    pass
+            return response
+        finally:
+            seconds = time.monotonic() - start
+            metrics.observe_request(self.node, address, method, endpoint, status, seconds)
+            if self.limiter is not None:
+                self.limiter.release(endpoint, seconds, status, retry_after)
+            if self.nodes is not None:
+                self.nodes.record(address, endpoint, seconds, status is not None and status < 500)
+
+    def use_all_nodes(self, api_headers: dict = None, hedge_percentile: float = None, connect_timeout: float = 3.0,
+                      **pool_options) -> list:
+        """
+        Spread reads over all nodes of the cluster
+
+        Looks up the lanIP of every node and from then on sends GET requests to the healthy nodes instead of only to
+        this client's node. POST, DELETE, login and logout keep going to this client's node. See NodePool for the
+        health checking and hedge_percentile.
+
+        :param api_headers: headers with the session, defaults to the headers of the last login on this client.
+        :type api_headers: dict
+        :param hedge_percentile: send a duplicate GET to a second node when the first one is slower than this
+            percentile (0.95 for example) of the recent latencies of that endpoint. None disables hedging.
+        :type hedge_percentile: float
+        :param connect_timeout: seconds to wait for a connection, so a node that is down is ejected quickly.
+        :type connect_timeout: float
+        :return: list with the addresses of the nodes in use
+        """
+
+        node_json = self.get_json('Node/', api_headers)
+        port = ':' + self.node.rsplit(':', 1)[1] if ':' in self.node else ''
+        addresses = [self.node] + [node_info['lanIP'] + port for node_info in node_json]
+        self.nodes = NodePool(self.node, list(dict.fromkeys(addresses)), hedge_percentile=hedge_percentile,
+                              **pool_options)
+        self.connect_timeout = connect_timeout
+
+        # keep a connection pool per node instead of only for the most recent host
+        adapter = requests.adapters.HTTPAdapter(pool_connections=len(self.nodes.addresses),
+                                                pool_maxsize=self.pool_maxsize)
+        self.session.mount('https://', adapter)
+        if hedge_percentile is not None and self._hedger is None:
+            self._hedger = ThreadPoolExecutor(max_workers=self.pool_maxsize)
+        return self.nodes.addresses
+
+    def check_nodes(self, api_headers: dict = None) -> dict:
+        """
+        Probe every node of the pool (ejected ones included) with a GET and update their health.
+
+        :return: dict with per node address the seconds the probe took, None when it failed
+        """
+
+        def probe(address: str):
+            try:
+                response = self._send_to(address, "GET", 'Node/', api_headers or self.api_headers, None, False)
+            except requests.exceptions.RequestException:
+                return None
+            return self.nodes.recent[address][-1] if response.status_code < 500 else None
+
+        with ThreadPoolExecutor(max_workers=len(self.nodes.addresses)) as pool:
+            results = dict(zip(self.nodes.addresses, pool.map(probe, self.nodes.addresses)))
+        self.nodes.readmit([address for address, seconds in results.items() if seconds is not None])
+        return results
+
+    def get_json(self, endpoint: str, api_headers: dict = None, fields: tuple = None):
+        """
+        GET an endpoint and return the decoded json body.
+
+        With fields the body is decoded while it streams in and only those fields are kept, see sc_iter_json.
+        """
+
+        if fields is None:
+            return json.loads(self.request("GET", endpoint, api_headers).text)
+        response = self.request("GET", endpoint, api_headers, stream=True)
+        try:
+            return list(sc_iter_json(response.iter_content(json_chunk_size), fields, response.encoding))
+        finally:
+            response.close()
+
+    def post_json(self, endpoint: str, payload: dict, api_headers: dict = None):
+        """
+        POST a dict as json to an endpoint and return the decoded json body.
+        """
+
+        return json.loads(self.request("POST", endpoint, api_headers, json.dumps(payload)).text)
+
+    def login(self, username: str, password: str) -> dict:
+        """
+        Log in and return the api headers with the sessionID cookie. See sc_login.
+
+        The headers are only returned, not kept on the client, so logins of other users on the same node do not
+        replace each other.
+        """
+
+        login_payload = json.dumps({
+            "username": username,
+            "password": password,
+            "useOIDC": False
+        })
+
+        api_headers = {
+            'Content-Type': 'application/json'
+        }
+
+        login_response = self.request("POST", 'login', api_headers, login_payload)
+
+        if login_response.status_code == 401:
+            print(login_response.status_code)
+            raise Exception(f'Login failed.')
+        if login_response.status_code == 500:
+            print(login_response.status_code)
+            raise Exception(f'An internal error occurred.')
+
+        # the cookie is sent explicitly through the headers, so do not let the session jar send it along as well
+        self.session.cookies.clear()
+        api_headers['Cookie'] = 'sessionID={0}'.format(
+            login_response.cookies.get('sessionID'))
+        return api_headers
+
+    def logout(self, api_headers: dict) -> bool:
+        """
+        Log out the session of the given headers. See sc_logout.
+        """
+
+        logout_response = self.request("POST", 'logout', api_headers)
+        return logout_response.status_code == 200
+
+    def close(self) -> None:
+        """
+        Close all pooled connections of this client.
+        """
+
+        self.session.close()
+        if self._hedger is not None:
+            self._hedger.shutdown(wait=False)
+            self._hedger = None
+
+
+# bytes read from the socket at a time when decoding a streamed json response
+json_chunk_size = 65536
+
+# the fields most scripts need from VirDomain, for sc_get_all_vminfo(..., fields=vm_summary_fields)
+vm_summary_fields = ("uuid", "name", "tags", "state", "nodeUUID", "blockDevs.uuid", "blockDevs.type")
+
+
+def _field_tree(fields: tuple) -> dict:
+    # ("name", "blockDevs.uuid", "blockDevs.type") -> {"name": None, "blockDevs": {"uuid": None, "type": None}}
+    tree = {}
+    for field in fields:
+        branch = tree
+        parts = field.split(".")
+        for part in parts[:-1]:
+            if branch.get(part, {}) is None:
+                break
+            branch = branch.setdefault(part, {})
+        else:
+            branch[parts[-1]] = None
+    return tree
+
+
+def _project(value, tree: dict):
+    # keep only the fields in tree, lists are projected element by element
+    if tree is None:
+        return value
+    if isinstance(value, list):
+        return [_project(item, tree) for item in value]
+    if isinstance(value, dict):
+        return {key: _project(value[key], branch) for key, branch in tree.items() if key in value}
+    return value
+
+
+def sc_iter_json(chunks, fields: tuple = None, encoding: str = None):
+    """
+    Decode a json list while it streams in, one element at a time
+
+    The hypercore API returns lists (VirDomain, Node, ...) as one json array. Instead of reading the whole body into a
+    string and turning all of it into dicts, this generator decodes one element as soon as it has arrived, keeps only
+    the requested fields and drops the rest right away. Peak memory is then the projected elements plus one chunk,
+    instead of the full text plus the full decoded tree. A body that is not a list (an error for example) is yielded as
+    a single element.
+
+    Fields are names of keys, nested keys are separated by a dot and apply to every element of a nested list.
+
+    :example:
+    >>> response = client.request("GET", "VirDomain/", session, stream=True)
+    >>> for vm in sc_iter_json(response.iter_content(65536), ("uuid", "name", "blockDevs.uuid", "blockDevs.type")):
+    ...     print(vm["name"], [disk["uuid"] for disk in vm["blockDevs"]])
+
+    :param chunks: the body as an iterable of bytes (or str) chunks.
+    :type chunks: iterable
+    :param fields: fields to keep, None keeps everything.
+    :type fields: tuple
+    :param encoding: encoding of the bytes, defaults to utf-8.
+    :type encoding: str
+    :return: generator of the decoded elements
+    :raises Exception: the body is not valid json.
+    """
+
+    tree = _field_tree(fields) if fields is not None else None
+    decoder = json.JSONDecoder()
+    text_decoder = codecs.getincrementaldecoder(encoding or 'utf-8')()
+    chunks = iter(chunks)
+    buffer = ''
+    position = 0
+    finished = False
+    in_list = None
+
+    def read(wanted: int) -> bool:
+        # append at least wanted characters (or the rest of the body), False once the body is finished
+        nonlocal buffer, finished
+        if finished:
+            return False
+        parts = []
+        size = 0
+        while size < wanted:
+            chunk = next(chunks, None)
+            if chunk is None:
+                parts.append(text_decoder.decode(b'', final=True))
+                finished = True
+                break
+            if isinstance(chunk, bytes):
+                chunk = text_decoder.decode(chunk)
+            parts.append(chunk)
+            size += len(chunk)
+        buffer += ''.join(parts)
+        return True
+
+    while True:
+        while position < len(buffer) and buffer[position] in ' \t\r\n':
+            position += 1
+        if position == len(buffer):
+            if read(1):
+                continue
+            if in_list:
+                raise Exception(f'json body ended before the closing ]')
+            return
+
+        if in_list is None:
+            in_list = buffer[position] == '['
+            if in_list:
+                position += 1
+            continue
+        if in_list and buffer[position] == ']':
+            return
+        if in_list and buffer[position] == ',':
+            position += 1
+            continue
+
+        try:
+            value, end = decoder.raw_decode(buffer, position)
+        except json.JSONDecodeError:
+            end = None
+        # an element that reaches the end of the buffer might continue in the next chunk, and so might a number that
+        # is only followed by what can still be part of it ("12." of "12.5", "1.5e" of "1.5e3")
+        if end is None or end == len(buffer) or (
+                type(value) in (int, float) and not buffer[end:].strip('0123456789.eE+-')):
+            if read(max(len(buffer) - position, 1)):
+                continue
+            if end is None:
+                raise Exception(f'invalid json body near: {buffer[position:position + 80]}')
+
+        yield _project(value, tree)
+        position = end
+        # drop what has been decoded so the buffer stays around one chunk
+        if position > len(buffer) // 2:
+            buffer = buffer[position:]
+            position = 0
+
+
+# limits for the RateLimiter of every node client created by sc_get_client, see ScaleLimiter.py. Set to None to send
+# requests without any client side limit.
+rate_limits = {"max_rate": 100.0, "max_in_flight": 16}
+
+# one client per node, shared by all sc_* functions so they reuse the same pooled connections
+_clients: dict = {}
+_clients_lock = threading.Lock()
+
+
+class ClientNode(str):
+    """
+    A node address that brings its own ScaleClient
+
+    A normal str with the node address that also carries a ScaleClient. sc_get_client returns that client instead of
+    the shared one of the node, so everything done with this node, also the requests sc_* functions send from their
+    own worker pools, goes over that client and its limiter without changing the shared client. ScaleFleet uses this
+    to give every cluster its own request limit.
+
+    :example:
+    >>> node = ClientNode("192.168.0.1", ScaleClient("192.168.0.1", limiter=RateLimiter(max_in_flight=4)))
+    >>> vms = sc_get_all_vminfo(session, node)
+
+    :param node: IP address or FQDN for a scale computing node, this can be any node in the cluster you are managing.
+    :type node: str
+    :param client: the client to use for this node.
+    :type client: ScaleClient
+    """
+
+    def __new__(cls, node: str, client: ScaleClient):
+        address = super().__new__(cls, node)
+        address.client = client
+        return address
+
+
+def sc_get_client(node: str) -> ScaleClient:
+    """
+    Get the shared ScaleClient for a node
+
+    This function returns the pooled client the sc_* functions use for a node, creating it on first use. Use it when you
+    want to issue your own requests over the same keep-alive connections. For a ClientNode its own client is returned.
+
+    :example:
+    >>> client = sc_get_client("192.168.0.1")
+    >>> client.get_json("Node/", session)
+
+    :param node: IP address or FQDN for a scale computing node, this can be any node in the cluster you are managing.
+    :type node: str
+    :return: ScaleClient
+    """
+
+    if isinstance(node, ClientNode):
+        return node.client
+    with _clients_lock:
+        client = _clients.get(node)
+        if client is None:
+            client = ScaleClient(node, limiter=RateLimiter(**rate_limits) if rate_limits else None)
+            _clients[node] = client
+        return client
+
+
 def sc_login(username: str, password: str, node: str) -> dict:
     """
     perform login to the hypercore API
@@ -35,35 +662,7 @@ def sc_login(username: str, password: str, node: str) -> dict:
     :raises Exception: Failure description.
     """
 
-    login_payload = json.dumps({
-        "username": username,
-        "password": password,
-        "useOIDC": False
-    })
-
-    api_headers = {
-        'Content-Type': 'application/json'
-    }
-
-    api_login = 'https://' + node + '/rest/v1/login'
-
-    login_response = requests.request("POST",
-                                      api_login,
-                                      headers=api_headers,
-                                      data=login_payload,
-                                      verify=False
-                                      )
-
-    if login_response.status_code == 401:
-        print(login_response.status_code)
-        raise Exception(f'Login failed.')
-    if login_response.status_code == 500:
-        print(login_response.status_code)
-        raise Exception(f'An internal error occurred.')
-
-    api_headers['Cookie'] = 'sessionID={0}'.format(
-        login_response.cookies.get('sessionID'))
-    return api_headers
+    return sc_get_client(node).login(username, password)
 
 
 def sc_logout(api_headers: dict, node: str) -> bool:
@@ -85,17 +684,189 @@ def sc_logout(api_headers: dict, node: str) -> bool:
     :raises Exception: Failure description.
     """
 
-    api_logout = 'https://' + node + '/rest/v1/logout'
-    logout_response = requests.request("POST",
-                                       api_logout,
-                                       headers=api_headers,
-                                       verify=False
-                                       )
+    return sc_get_client(node).logout(api_headers)
 
-    if logout_response.status_code == 200:
-        return True
-    else:
-        return False
+
+class SessionHeaders(dict):
+    """
+    The api headers of a ScaleSession
+
+    A normal headers dict that also knows the ScaleSession it belongs to, so ScaleClient can log in again when a
+    request with these headers gets a 401. The Cookie is replaced in place, so every holder of the dict picks up the new
+    session.
+    """
+
+    def __init__(self, session, headers: dict):
+        super().__init__(headers)
+        self.session = session
+
+
+class ScaleSession:
+    """
+    Logged in session with a guaranteed logout
+
+    Used as a context manager it logs in on entry, returns the api headers for the sc_* functions and always logs out
+    when the block ends, also when an exception is raised inside it. When a request gets a 401 halfway (session expired
+    or logged out elsewhere) the session logs in again once and the request is retried, without the caller noticing.
+
+    With cache_file set the session cookie is kept in that file (readable by the owner only) and reused by the next run
+    as long as it is younger than cache_seconds, so back to back short jobs skip the login. A cached session is not
+    logged out at the end of the block but once it is too old to be reused. A cached cookie that is no longer valid is
+    simply replaced through the 401 re-login.
+
+    :example:
+    >>> with ScaleSession("admin", "admin", "192.168.0.1") as session:
+    ...     sc_change_tag("vm", "testvm01", "add", "platform", session, "192.168.0.1")
+
+    >>> with ScaleSession("admin", "admin", "192.168.0.1", cache_file="~/.scale_session") as session:
+    ...     vms = sc_get_all_vminfo(session, "192.168.0.1")
+
+    :param username: A valid hypercore username.
+    :type username: str
+    :param password: The password for the used username.
+    :type password: str
+    :param node: IP address or FQDN for a scale computing node, this can be any node in the cluster you are managing.
+    :type node: str
+    :param cache_file: optional file to keep the session cookie in between runs.
+    :type cache_file: str
+    :param cache_seconds: maximum age of a cached session before it is logged out and replaced.
+    :type cache_seconds: float
+    """
+
+    def __init__(self, username: str, password: str, node: str, cache_file: str = None, cache_seconds: float = 3600):
+        self.username = username
+        self.password = password
+        self.node = node
+        self.cache_file = os.path.expanduser(cache_file) if cache_file else None
+        self.cache_seconds = cache_seconds
+        self.api_headers = None
+        self.logged_in = 0.0
+        self.relogins = 0
+        self._lock = threading.Lock()
+
+    def _read_cache(self) -> dict:
+        try:
+            fd = os.open(self.cache_file, os.O_RDONLY)
+        except OSError:
+            return None
+        with os.fdopen(fd) as f:
+            # never trust a cookie file someone else could have read or written
+            info = os.fstat(f.fileno())
+            if hasattr(os, "getuid") and (info.st_uid != os.getuid() or info.st_mode & (stat.S_IRWXG | stat.S_IRWXO)):
+                return None
+            try:
+                cached = json.load(f)
+            except ValueError:
+                return None
+        if cached.get("node") != self.node or cached.get("username") != self.username:
+            return None
+        return cached
+
+    def _write_cache(self) -> None:
+        fd = os.open(self.cache_file, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+        with os.fdopen(fd, "w") as f:
+            os.fchmod(f.fileno(), 0o600)
+            json.dump({"node": self.node, "username": self.username, "cookie": self.api_headers['Cookie'],
+                       "created": self.logged_in}, f)
+
+    def _remove_cache(self) -> None:
+        try:
+            os.remove(self.cache_file)
+        except OSError:
+            pass
+
+    def login(self) -> dict:
+        """
+        Log in, or reuse the cached session when there is a recent one, and return the api headers.
+        """
+
+        if self.cache_file:
+            cached = self._read_cache()
+            if cached is not None and time.time() - cached["created"] < self.cache_seconds:
+                self.api_headers = SessionHeaders(self, {'Content-Type': 'application/json', 'Cookie': cached["cookie"]})
+                self.logged_in = cached["created"]
+                return self.api_headers
+            if cached is not None:
+                # too old to reuse: end it on the cluster instead of leaving it valid for another 100 days
+                try:
+                    sc_get_client(self.node).logout({'Content-Type': 'application/json', 'Cookie': cached["cookie"]})
+                except Exception:
+                    pass
+                self._remove_cache()
+
+        self.api_headers = SessionHeaders(self, sc_get_client(self.node).login(self.username, self.password))
+        self.logged_in = time.time()
+        if self.cache_file:
+            self._write_cache()
+        return self.api_headers
+
+    def relogin(self, failed_cookie: str) -> bool:
+        """
+        Log in again after a 401 on failed_cookie, used by ScaleClient. Returns True when the request can be retried.
+
+        When several threads get a 401 at the same time only the first one logs in, the others reuse its new session.
+        """
+
+        with self._lock:
+            if self.api_headers is None:
+                return False
+            if self.api_headers.get('Cookie') == failed_cookie:
+                try:
+                    fresh = sc_get_client(self.node).login(self.username, self.password)
+                except Exception:
+                    return False
+                self.api_headers['Cookie'] = fresh['Cookie']
+                self.logged_in = time.time()
+                self.relogins += 1
+                if self.cache_file:
+                    self._write_cache()
+            return True
+
+    def logout(self, force: bool = False) -> bool:
+        """
+        Log out, unless the session is cached and still young enough to be reused (force logs out anyway).
+        """
+
+        if self.api_headers is None:
+            return True
+        if self.cache_file and not force and time.time() - self.logged_in < self.cache_seconds:
+            return True
+        try:
+            return sc_get_client(self.node).logout(self.api_headers)
+        finally:
+            if self.cache_file:
+                self._remove_cache()
+            self.api_headers = None
+
+    def __enter__(self) -> dict:
+        return self.login()
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.logout()
+
+
+def sc_use_all_nodes(api_headers: dict, node: str, hedge_percentile: float = None) -> list:
+    """
+    Spread the reads of all sc_* functions over every node of the cluster
+
+    After this call GET requests for this cluster go to all healthy nodes instead of only to node, slow or failing nodes
+    are ejected for a while, and with hedge_percentile a GET that takes longer than usual is also sent to a second node.
+    Changes (POST, DELETE) keep going to node. See ScaleClient.use_all_nodes and NodePool.
+
+    :example:
+    >>> sc_use_all_nodes(session, "192.168.0.1", hedge_percentile=0.95)
+    ['192.168.0.1', '192.168.0.2', '192.168.0.3']
+
+    :param api_headers: a dict with the api headers that include the sessionID cookie.
+    :type api_headers: dict
+    :param node: IP address or FQDN for a scale computing node, this can be any node in the cluster you are managing.
+    :type node: str
+    :param hedge_percentile: latency percentile after which a GET is hedged, None to never hedge.
+    :type hedge_percentile: float
+    :return: list with the addresses of the nodes in use
+    """
+
+    return sc_get_client(node).use_all_nodes(api_headers, hedge_percentile)
 
 
 def sc_wait_for_task(api_headers: dict, sctag: str, timeout: int, node: str) -> bool:
@@ -122,29 +893,274 @@ def sc_wait_for_task(api_headers: dict, sctag: str, timeout: int, node: str) ->
     :raises Exception: Failure description.
     """
 
-    api_tasktag = 'https://' + node + '/rest/v1/TaskTag/' + str(sctag)
+    client = sc_get_client(node)
     # tasks needs to be completed within this time in secconds
-    wait_timeout = time.time() + timeout
+    wait_start = time.time()
+    wait_timeout = wait_start + timeout
 
     while time.time() < wait_timeout:
-        task_check = requests.request("GET",
-                                      api_tasktag,
-                                      headers=api_headers,
-                                      verify=False)
-
-        task_check_json = json.loads(task_check.text)
+        task_check_json = client.get_json('TaskTag/' + str(sctag), api_headers)
         if task_check_json[0]["state"] == "COMPLETE":
+            metrics.observe_task_wait(node, str(sctag), "COMPLETE", time.time() - wait_start)
             return True
         elif task_check_json[0]["state"] == "ERROR":
+            metrics.observe_task_wait(node, str(sctag), "ERROR", time.time() - wait_start)
             return False
         else:
             # wait for 2 seconds before re-testing to prevent ddos-ing the api
             time.sleep(2)
+    metrics.observe_task_wait(node, str(sctag), "TIMEOUT", time.time() - wait_start)
     raise Exception(
         f'Timeout for task reached! The task might still be running on the cluster, please inspect cluster logs')
 
 
-def sc_get_all_vminfo(api_headers: dict, node: str) -> dict:
+class TaskWatcher:
+    """
+    Wait for many tasks with a single polling loop
+
+    Instead of one blocking sc_wait_for_task per taskTag, a TaskWatcher keeps all pending taskTags and polls them from
+    one loop. Every task starts with a short poll interval which grows with each poll that finds it still running, so
+    quick snapshots are picked up fast while long exports are not hammering the API. poll_count holds the total number
+    of TaskTag requests made, which tells you how much load the waiting put on the API. progress holds per taskTag the
+    progressPercent of its last poll.
+
+    :example:
+    >>> watcher = TaskWatcher(session, host, timeout=3600)
+    >>> watcher.add("1234", "1235", "1236")
+    >>> for sctag, completed in watcher.as_completed():
+    ...     print(sctag, completed)
+    >>> print(watcher.poll_count)
+
+    :param api_headers: a dict with the api headers that include the sessionID cookie.
+    :type api_headers: dict
+    :param node: IP address or FQDN for a scale computing node, this can be any node in the cluster you are managing.
+    :type node: str
+    :param timeout: Timeout per task in seconds, counted from the moment the task was added.
+    :type timeout: int
+    :param initial_interval: seconds between the first polls of a task.
+    :type initial_interval: float
+    :param max_interval: upper limit for the seconds between polls of a task.
+    :type max_interval: float
+    :param backoff: factor the poll interval of a task grows with after every poll that finds it still running.
+    :type backoff: float
+    :param max_in_flight: number of tasks that are due polled at the same time.
+    :type max_in_flight: int
+    """
+
+    def __init__(self, api_headers: dict, node: str, timeout: int = 3600, initial_interval: float = 0.5,
+                 max_interval: float = 30.0, backoff: float = 1.5, max_in_flight: int = 1):
+        self.client = sc_get_client(node)
+        self.api_headers = api_headers
+        self.timeout = timeout
+        self.initial_interval = initial_interval
+        self.max_interval = max_interval
+        self.backoff = backoff
+        self.max_in_flight = max(1, max_in_flight)
+        self.poll_count = 0
+        self.progress = {}
+
+        # taskTag -> [next poll time, current interval, deadline]
+        self._pending = {}
+        self._futures = {}
+        self._keep_running = False
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+
+    def add(self, *sctags: str) -> list:
+        """
+        Start watching one or more taskTags and return a Future per taskTag.
+
+        The futures resolve to True (COMPLETE) or False (ERROR) once the polling loop has seen the final state, either
+        from as_completed()/wait() or from the background thread started with start(). Adding a taskTag that is already
+        watched returns the existing future.
+        """
+
+        now = time.time()
+        futures = []
+        with self._lock:
+            for sctag in sctags:
+                sctag = str(sctag)
+                if sctag not in self._futures:
+                    self._futures[sctag] = Future()
+                    self._pending[sctag] = [now, self.initial_interval, now + self.timeout]
+                futures.append(self._futures[sctag])
+        self._wakeup.set()
+        return futures
+
+    def future(self, sctag: str) -> Future:
+        """
+        Return the Future for a taskTag that was added before.
+        """
+
+        return self._futures[str(sctag)]
+
+    def _poll(self, sctag: str) -> tuple:
+        # (completed, error, fatal): completed is True, False or None while the task runs. A poll that failed returns
+        # the error, fatal when polling again can not help (the session is gone or the cluster does not know the task).
+        try:
+            response = self.client.request("GET", 'TaskTag/' + sctag, self.api_headers)
+        except requests.RequestException as e:
+            return None, Exception(f'polling task {sctag} failed: {e}'), False
+        with self._lock:
+            self.poll_count += 1
+        if response.status_code in (401, 403, 404):
+            return None, Exception(f'polling task {sctag} failed with status {response.status_code}: {response.text}'), True
+        if response.status_code != 200:
+            return None, Exception(f'polling task {sctag} failed with status {response.status_code}'), False
+        try:
+            task_check_json = json.loads(response.text)
+        except ValueError:
+            return None, Exception(f'polling task {sctag} returned no json: {response.text[:100]!r}'), False
+        if not task_check_json:
+            return None, Exception(f'task {sctag} is not known on the cluster'), True
+        state = task_check_json[0].get("state")
+        self.progress[sctag] = task_check_json[0].get("progressPercent")
+        if state == "COMPLETE":
+            return True, None, False
+        if state == "ERROR":
+            return False, None, False
+        return None, None, False
+
+    def _poll_safe(self, sctag: str) -> tuple:
+        try:
+            return self._poll(sctag)
+        except Exception as e:
+            return None, e, True
+
+    def as_completed(self):
+        """
+        Poll all pending tasks and yield (taskTag, result) tuples in the order the tasks finish.
+
+        result is True when the task completed, False when the cluster reported an error and None when the timeout was
+        reached or the task could not be polled (the future of that task then raises the exception). Failed polls
+        (no connection, a 5xx, a body that is not json) are retried with the same backoff until the timeout, polls that
+        can not succeed (401, unknown task) end the task right away.
+        """
+
+        pool = ThreadPoolExecutor(max_workers=self.max_in_flight) if self.max_in_flight > 1 else None
+        try:
+            yield from self._completed(pool)
+        finally:
+            if pool is not None:
+                pool.shutdown()
+
+    def _completed(self, pool: ThreadPoolExecutor):
+        while True:
+            # cleared before the pending tasks are read, so an add() from here on always cuts the wait below short
+            self._wakeup.clear()
+            with self._lock:
+                if not self._pending and not self._keep_running:
+                    return
+                now = time.time()
+                due = [sctag for sctag, (next_poll, _, deadline) in self._pending.items()
+                       if next_poll <= now or deadline <= now]
+                next_wakeup = min((min(next_poll, deadline) for next_poll, _, deadline in self._pending.values()),
+                                  default=None)
+            if next_wakeup is None:
+                # a background thread started with keep_running idles until the next add() or stop()
+                self._wakeup.wait()
+                continue
+
+            # the due tasks are polled max_in_flight at a time, their results come back in the order of due
+            polls = pool.map(self._poll_safe, due) if pool is not None else map(self._poll_safe, due)
+            for sctag, (completed, error, fatal) in zip(due, polls):
+                with self._lock:
+                    next_poll, interval, deadline = self._pending[sctag]
+                    if completed is None and not fatal and time.time() < deadline:
+                        interval = min(interval * self.backoff, self.max_interval)
+                        self._pending[sctag] = [time.time() + interval, interval, deadline]
+                        continue
+                    del self._pending[sctag]
+                if error is not None and fatal:
+                    state = "ERROR"
+                else:
+                    state = {True: "COMPLETE", False: "ERROR"}.get(completed, "TIMEOUT")
+                metrics.observe_task_wait(self.client.node, sctag, state, time.time() - (deadline - self.timeout))
+                if completed is None:
+                    if not fatal:
+                        error = Exception(
+                            f'Timeout for task {sctag} reached! The task might still be running on the cluster, please inspect cluster logs'
+                            + (f' (last poll: {error})' if error is not None else ''))
+                    self._futures[sctag].set_exception(error)
+                else:
+                    self._futures[sctag].set_result(completed)
+                yield sctag, completed
+
+            if not due:
+                # sleep until the next task is due, but wake up early when new tasks are added
+                self._wakeup.wait(max(0.0, next_wakeup - time.time()))
+
+    def wait(self) -> dict:
+        """
+        Block until all watched tasks are finished and return a dict with the result per taskTag.
+        """
+
+        return dict(self.as_completed())
+
+    def start(self, keep_running: bool = False) -> threading.Thread:
+        """
+        Run the polling loop in a background thread so the futures returned by add() resolve on their own.
+
+        The thread ends once there are no pending tasks left, or with keep_running only after stop(), so tasks can be
+        added from other threads at any time and waited on with add(sctag)[0].result().
+        """
+
+        self._keep_running = keep_running
+        thread = threading.Thread(target=self._run, daemon=True)
+        thread.start()
+        return thread
+
+    def _run(self) -> None:
+        # whatever ends the background loop, no future may be left waiting forever
+        try:
+            self.wait()
+        except Exception as e:
+            with self._lock:
+                failed = list(self._pending)
+                self._pending.clear()
+            for sctag in failed:
+                if not self._futures[sctag].done():
+                    self._futures[sctag].set_exception(e)
+
+    def stop(self) -> None:
+        """
+        Let a background thread started with keep_running end once there are no pending tasks left.
+        """
+
+        self._keep_running = False
+        self._wakeup.set()
+
+
+def sc_wait_for_tasks(api_headers: dict, sctags: list, timeout: int, node: str) -> dict:
+    """
+    Wait for many tasks to complete
+
+    Same as sc_wait_for_task but for any number of taskTags at once, using a single TaskWatcher polling loop with
+    adaptive backoff. Where sc_wait_for_task raises on a timeout, this function reports None for that task so the
+    results of the other tasks are not lost.
+
+    :example:
+    >>> result = sc.sc_snapshot_by_tag("exampletag", "nightly", session, host)
+    >>> sc_wait_for_tasks(session, [r["taskTag"] for r in result.values() if r["taskTag"]], 3600, host)
+    {'1234': True, '1235': True}
+
+    :param api_headers: a dict with the api headers that include the sessionID cookie.
+    :type api_headers: dict
+    :param sctags: A list with the task tags returned by other functions.
+    :type sctags: list
+    :param timeout: Timeout for this function in seconds.
+    :type timeout: int
+    :param node: IP address or FQDN for a scale computing node, this can be any node in the cluster you are managing.
+    :type node: str
+    :return: dict with per taskTag True (complete), False (error) or None (timeout)
+    """
+
+    watcher = TaskWatcher(api_headers, node, timeout)
+    watcher.add(*sctags)
+    return watcher.wait()
+
+
+def sc_get_all_vminfo(api_headers: dict, node: str, fields: tuple = None, records: bool = False) -> dict:
     """
     Load all vm info in disct
 
@@ -154,25 +1170,27 @@ def sc_get_all_vminfo(api_headers: dict, node: str) -> dict:
     :example:
     >>> sc_get_all_vminfo(var_with_headers_dict, "192.168.0.1")
     dict
+    >>> sc_get_all_vminfo(var_with_headers_dict, "192.168.0.1", fields=vm_summary_fields)
+    dict
 
     :param api_headers: a dict with the api headers that include the sessionID cookie.
     :type api_headers: dict
     :param node: IP address or FQDN for a scale computing node, this can be any node in the cluster you are managing.
     :type node: str
+    :param fields: only keep these fields, decoded while the response streams in (see sc_iter_json).
+    :type fields: tuple
+    :param records: return ScaleRecords.Vm records instead of dicts, the response is then streamed with Vm.fields.
+    :type records: bool
     :return: dict
     :raises Exception: Failure description.
     """
 
-    api_virdomain = 'https://' + node + '/rest/v1/VirDomain/'
-    virdomain_response = json.loads(requests.request("GET",
-                                                     api_virdomain,
-                                                     headers=api_headers,
-                                                     verify=False
-                                                     ).text)
-    return virdomain_response
+    if records:
+        return [Vm.from_json(vm) for vm in sc_get_client(node).get_json('VirDomain/', api_headers, fields or Vm.fields)]
+    return sc_get_client(node).get_json('VirDomain/', api_headers, fields)
 
 
-def sc_get_vm_info(type: str, identifier: str, api_headers: dict, node: str) -> dict:
+def sc_get_vm_info(type: str, identifier: str, api_headers: dict, node: str, records: bool = False) -> dict:
     """
     Load all specific vm info in disct
 
@@ -191,6 +1209,8 @@ def sc_get_vm_info(type: str, identifier: str, api_headers: dict, node: str) ->
     :type api_headers: dict
     :param node: IP address or FQDN for a scale computing node, this can be any node in the cluster you are managing.
     :type node: str
+    :param records: return ScaleRecords.Vm records instead of dicts.
+    :type records: bool
     :return: dict
     :raises Exception: Failure description.
     """
@@ -201,16 +1221,13 @@ def sc_get_vm_info(type: str, identifier: str, api_headers: dict, node: str) ->
         case "uuid":
             vm_uuid = identifier
 
-    api_virdomain = 'https://' + node + '/rest/v1/VirDomain/' + vm_uuid
-    virdomain_response = json.loads(requests.request("GET",
-                                                     api_virdomain,
-                                                     headers=api_headers,
-                                                     verify=False
-                                                     ).text)
-    return virdomain_response
+    vm_info = sc_get_client(node).get_json('VirDomain/' + vm_uuid, api_headers)
+    if records:
+        return [Vm.from_json(vm) for vm in vm_info]
+    return vm_info
 
 
-def sc_get_all_nodeinfo(api_headers: dict, node: str) -> dict:
+def sc_get_all_nodeinfo(api_headers: dict, node: str, fields: tuple = None, records: bool = False) -> dict:
     """
     Load all Node info in disct
 
@@ -225,29 +1242,304 @@ def sc_get_all_nodeinfo(api_headers: dict, node: str) -> dict:
     :type api_headers: dict
     :param node: IP address or FQDN for a scale computing node, this can be any node in the cluster you are managing.
     :type node: str
+    :param fields: only keep these fields, decoded while the response streams in (see sc_iter_json).
+    :type fields: tuple
+    :param records: return ScaleRecords.Node records instead of dicts.
+    :type records: bool
     :return: dict
     :raises Exception: Failure description.
     """
 
-    api_virdomain = 'https://' + node + '/rest/v1/Node/'
-    virdomain_response = json.loads(requests.request("GET",
-                                                     api_virdomain,
-                                                     headers=api_headers,
-                                                     verify=False
-                                                     ).text)
-    return virdomain_response
+    if records:
+        return [Node.from_json(node_info) for node_info in sc_get_client(node).get_json('Node/', api_headers, fields or Node.fields)]
+    return sc_get_client(node).get_json('Node/', api_headers, fields)
+
+
+def sc_get_all_vmstats(api_headers: dict, node: str, records: bool = False) -> list:
+    """
+    Load the current stats of all vm's
+
+    This function retrieves the VirDomainStats of every vm in a single request: cpu usage, network bit rates and per
+    disk IOPS and latencies. The stats on the cluster are refreshed every 10 seconds.
+
+    :example:
+    >>> samples = sc_get_all_vmstats(var_with_headers_dict, "192.168.0.1", records=True)
+    >>> samples[0].cpu_usage
+    12.5
+
+    :param api_headers: a dict with the api headers that include the sessionID cookie.
+    :type api_headers: dict
+    :param node: IP address or FQDN for a scale computing node, this can be any node in the cluster you are managing.
+    :type node: str
+    :param records: return ScaleRecords.VmStatsSample records instead of dicts.
+    :type records: bool
+    :return: list
+    """
+
+    if records:
+        return [VmStatsSample.from_json(stats) for stats in sc_get_client(node).get_json('VirDomainStats/', api_headers,
+                                                                                         VmStatsSample.fields)]
+    return sc_get_client(node).get_json('VirDomainStats/', api_headers)
+
+
+# default time in seconds the vm and node inventory of a cluster is cached when a lookup does not pass its own max_age.
+# Set to 0 to always fetch fresh data.
+inventory_ttl = 10
+
 
+class ScaleInventory:
+    """
+    Cached VirDomain and Node inventory with lookup indexes
+
+    Looking up a single vm by name or tag means downloading the full VirDomain list, which on a large cluster is
+    megabytes per call. This class fetches the VirDomain and Node lists once, keeps them for ttl seconds and builds
+    dict indexes on top, so lookups are a dict access instead of a full download and linear scan. The lookups take a
+    max_age that overrides ttl for that call, max_age=0 always fetches. Functions that change vms call invalidate()
+    so the next lookup fetches fresh data. All lookups run under a lock and return copies, so a fetch in another thread
+    never changes what a caller got back, and changing a returned dict or set does not change the indexes.
+
+    Indexes (rebuilt on every fetch):
+        vm_by_uuid   uuid -> vm dict
+        vm_by_name   upper case vm name -> uuid (the first vm wins when names are not unique)
+        vms_by_tag   tag -> set of vm uuids
+        vms_by_node  nodeUUID -> list of vm dicts
+        node_by_ip   node lanIP -> node uuid
+
+    :example:
+    >>> inventory = sc_get_inventory(session, host)
+    >>> inventory.vm_uuid("testvm01")
+    '0946a2b5-f16b-44f8-823a-e682824a6261'
+
+    :param api_headers: a dict with the api headers that include the sessionID cookie.
+    :type api_headers: dict
+    :param node: IP address or FQDN for a scale computing node, this can be any node in the cluster you are managing.
+    :type node: str
+    :param ttl: seconds the fetched lists stay valid.
+    :type ttl: float
+    """
 
-def sc_get_uuid(type: str, identifier: str, api_headers: dict, node: str) -> str:
+    def __init__(self, api_headers: dict, node: str, ttl: float = None):
+        self.api_headers = api_headers
+        self.node = node
+        self.ttl = inventory_ttl if ttl is None else ttl
+        self._lock = threading.RLock()
+        self._vms_fetched = 0.0
+        self._nodes_fetched = 0.0
+
+        self.vms = []
+        self.vm_by_uuid = {}
+        self.vm_by_name = {}
+        self.vms_by_tag = {}
+        self.vms_by_node = {}
+        self.nodes = []
+        self.node_by_ip = {}
+
+    def invalidate(self, vms: bool = True, nodes: bool = False) -> None:
+        """
+        Drop the cached vm list (and optionally the node list) so the next lookup fetches it again.
+        """
+
+        with self._lock:
+            if vms:
+                self._vms_fetched = 0.0
+            if nodes:
+                self._nodes_fetched = 0.0
+
+    def stale(self, max_age: float = None, nodes: bool = False) -> bool:
+        """
+        Return True when the vm list (or with nodes the node list) is older than max_age (default ttl).
+        """
+
+        fetched = self._nodes_fetched if nodes else self._vms_fetched
+        return time.monotonic() - fetched >= (self.ttl if max_age is None else max_age)
+
+    def load_vms(self, vms: list) -> None:
+        """
+        Rebuild the vm indexes from a vm list fetched elsewhere, ScaleAsyncFunctions fetches with aiohttp this way.
+        """
+
+        with self._lock:
+            self._index_vms(vms)
+            self._vms_fetched = time.monotonic()
+
+    def load_nodes(self, nodes: list) -> None:
+        """
+        Rebuild the node index from a node list fetched elsewhere.
+        """
+
+        with self._lock:
+            self.nodes = nodes
+            self.node_by_ip = {snode["lanIP"]: snode["uuid"] for snode in nodes}
+            self._nodes_fetched = time.monotonic()
+
+    def refresh_vms(self, force: bool = False, max_age: float = None) -> list:
+        """
+        Return the vm list, fetching it and rebuilding the vm indexes when it is older than max_age (default ttl).
+        """
+
+        with self._lock:
+            if force or self.stale(max_age):
+                self.load_vms(sc_get_all_vminfo(self.api_headers, self.node))
+            return self.vms
+
+    def refresh_nodes(self, force: bool = False, max_age: float = None) -> list:
+        """
+        Return the node list, fetching it and rebuilding the node index when it is older than max_age (default ttl).
+        """
+
+        with self._lock:
+            if force or self.stale(max_age, nodes=True):
+                self.load_nodes(sc_get_all_nodeinfo(self.api_headers, self.node))
+            return self.nodes
+
+    def _index_vms(self, vms: list) -> None:
+        vm_by_uuid = {}
+        vm_by_name = {}
+        vms_by_tag = {}
+        vms_by_node = {}
+        for vm in vms:
+            vm_by_uuid[vm["uuid"]] = vm
+            vm_by_name.setdefault(vm["name"].upper(), vm["uuid"])
+            for tag in vm["tags"].split(","):
+                if tag:
+                    vms_by_tag.setdefault(tag, set()).add(vm["uuid"])
+            vms_by_node.setdefault(vm["nodeUUID"], []).append(vm)
+
+        self.vms = vms
+        self.vm_by_uuid = vm_by_uuid
+        self.vm_by_name = vm_by_name
+        self.vms_by_tag = vms_by_tag
+        self.vms_by_node = vms_by_node
+
+    def vm_uuid(self, name: str, max_age: float = None) -> str:
+        """
+        Return the uuid for a vm name (case insensitive) or None when there is no such vm.
+        """
+
+        with self._lock:
+            self.refresh_vms(max_age=max_age)
+            return self.vm_by_name.get(name.upper())
+
+    def vm(self, uuid: str) -> dict:
+        """
+        Return the cached vm dict for a uuid or None when there is no such vm.
+        """
+
+        with self._lock:
+            self.refresh_vms()
+            vm = self.vm_by_uuid.get(uuid)
+            return dict(vm) if vm is not None else None
+
+    def tagged(self, tag: str) -> set:
+        """
+        Return the set of vm uuids carrying a tag.
+        """
+
+        with self._lock:
+            self.refresh_vms()
+            return set(self.vms_by_tag.get(tag, ()))
+
+    def tagged_vms(self, tag: str, max_age: float = None) -> list:
+        """
+        Return the vm dicts carrying a tag, all taken from the same fetch.
+        """
+
+        with self._lock:
+            self.refresh_vms(max_age=max_age)
+            return [dict(self.vm_by_uuid[vm_uuid]) for vm_uuid in self.vms_by_tag.get(tag, ())]
+
+    def on_node(self, node_uuid: str) -> list:
+        """
+        Return the list of vm dicts running on a node.
+        """
+
+        with self._lock:
+            self.refresh_vms()
+            return [dict(vm) for vm in self.vms_by_node.get(node_uuid, ())]
+
+    def node_uuid(self, lan_ip: str, max_age: float = None) -> str:
+        """
+        Return the uuid for a node lanIP or None when there is no such node.
+        """
+
+        with self._lock:
+            self.refresh_nodes(max_age=max_age)
+            return self.node_by_ip.get(lan_ip)
+
+
+# one inventory per node, shared by the lookup functions below
+_inventories: dict = {}
+
+
+def sc_get_inventory(api_headers: dict, node: str, ttl: float = None) -> ScaleInventory:
+    """
+    Get the shared cached inventory for a cluster
+
+    This function returns the ScaleInventory the lookup functions (sc_get_uuid, sc_get_by_tag, ...) use for a node,
+    creating it on first use. The api headers and node (and so the client, see ClientNode) of the latest call are used
+    for the next fetch. The lookup functions
+    only serve cached data when they are given a max_age, by default they fetch fresh data and refresh this
+    inventory with it.
+
+    :example:
+    >>> inventory = sc_get_inventory(session, host)
+    >>> inventory.tagged("linux")
+    {'0946a2b5-f16b-44f8-823a-e682824a6261', 'acd74fde-b85c-48d9-85c3-841292ea0920'}
+
+    :param api_headers: a dict with the api headers that include the sessionID cookie.
+    :type api_headers: dict
+    :param node: IP address or FQDN for a scale computing node, this can be any node in the cluster you are managing.
+    :type node: str
+    :param ttl: seconds the fetched lists stay valid, defaults to the module wide inventory_ttl.
+    :type ttl: float
+    :return: ScaleInventory
+    """
+
+    with _clients_lock:
+        inventory = _inventories.get(node)
+        if inventory is None:
+            inventory = ScaleInventory(api_headers, node, ttl)
+            _inventories[node] = inventory
+    inventory.api_headers = api_headers
+    inventory.node = node
+    if ttl is not None:
+        inventory.ttl = ttl
+    return inventory
+
+
+def sc_invalidate_inventory(node: str) -> None:
+    """
+    Drop the cached vm and node lists of a cluster
+
+    Call this after changing vms outside of this module (for example creating or deleting vms) so the next lookup
+    fetches fresh data.
+
+    :param node: IP address or FQDN for a scale computing node, this can be any node in the cluster you are managing.
+    :type node: str
+    :return: none
+    """
+
+    inventory = _inventories.get(node)
+    if inventory is not None:
+        inventory.invalidate(vms=True, nodes=True)
+
+
+def sc_get_uuid(type: str, identifier: str, api_headers: dict, node: str, max_age: float = 0) -> str:
     """
     Get UUID for a node or vm
 
     This function allows you to retreive the UUID for a virtual machine or a node. This is usefull when using other
-    functions that can be targeted at a specific vm or node.
+    functions that can be targeted at a specific vm or node. The lookup goes through the inventory of the cluster (see
+    sc_get_inventory): by default it fetches the list fresh, with max_age a list fetched at most that many seconds ago
+    is used instead, which makes many lookups in a row a dict access each. The default of 0 is on purpose: a vm that
+    was created or renamed a moment ago (by another script or the UI) is always found, at the price of downloading
+    the full list on every call. Only callers that pass a max_age, and can live with data that old, get the cheap
+    lookups.
 
     :example:
     >>> sc_get_uuid("node", "192.168.0.1", session, host)
     dict
+    >>> [sc_get_uuid("vm", name, session, host, max_age=30) for name in ("testvm01", "testvm02")]
 
     :param type: definition of what uuid is needed. can be "vm" or "node"
     :type type: str
@@ -257,34 +1549,32 @@ def sc_get_uuid(type: str, identifier: str, api_headers: dict, node: str) -> str
     :type api_headers: dict
     :param node: IP address or FQDN for a scale computing node, this can be any node in the cluster you are managing.
     :type node: str
+    :param max_age: seconds a cached list may be old, 0 always fetches.
+    :type max_age: float
     :return: str
     :raises Exception: Invalid type defined.
     """
 
     match type:
         case "vm":
-            sc_info = sc_get_all_vminfo(api_headers, node)
-            for svm in sc_info:
-                if svm["name"].upper() == identifier.upper():
-                    return svm["uuid"]
+            return sc_get_inventory(api_headers, node).vm_uuid(identifier, max_age)
 
         case "node":
-            sc_info = sc_get_all_nodeinfo(api_headers, node)
-            for snode in sc_info:
-                if snode["lanIP"] == identifier:
-                    return snode["uuid"]
+            return sc_get_inventory(api_headers, node).node_uuid(identifier, max_age)
 
         case _:
             raise Exception(
                 f'invalid type defined. First argument must a string containing the text vm or node')
 
 
-def sc_get_by_tag(tag: str, api_headers: dict, node: str) -> dict:
+def sc_get_by_tag(tag: str, api_headers: dict, node: str, max_age: float = 0) -> dict:
     """
     Get a dict with all vms and their uuid with a given tag.
 
     This function searches for all virtual machines with a given tag, and then returns a dict with the vm's and
-    their uuid. Use this function to identify all vm's that require an operation based on their tags.
+    their uuid. Use this function to identify all vm's that require an operation based on their tags. As in
+    sc_get_uuid the list is fetched fresh unless a max_age is given, so the tags are always current by default and
+    only callers passing a max_age skip the download.
 
     :example:
     >>> result = sc.sc_get_by_tag("linux", session, host)
@@ -297,29 +1587,30 @@ def sc_get_by_tag(tag: str, api_headers: dict, node: str) -> dict:
     :type api_headers: dict
     :param node: IP address or FQDN for a scale computing node, this can be any node in the cluster you are managing.
     :type node: str
+    :param max_age: seconds a cached list may be old, 0 always fetches.
+    :type max_age: float
     :return: str
     :raises Exception: Invalid type defined.
     """
 
-    sc_info = sc_get_all_vminfo(api_headers, node)
     vm_list = {}
-    for vm in sc_info:
-        vm_tags_list = vm["tags"].split(",")
-        if tag in vm_tags_list:
-            key = vm["name"]
-            vm_list[key] = vm["uuid"]
+    for vm in sc_get_inventory(api_headers, node).tagged_vms(tag, max_age):
+        key = vm["name"]
+        vm_list[key] = vm["uuid"]
     return vm_list
 
 
-def sc_snapshot(type: str, identifier: str, snapshot_label: str, api_headers: dict, node: str) -> dict:
+def sc_snapshot(type: str, identifier: str, snapshot_label: str, api_headers: dict, node: str,
+                max_in_flight: int = 1) -> dict:
     """
     Create a snapshot for one or more vms
 
     This function allows you to create virtual machine snapshots based on the uuid, name or tag of a virtual machine
-    To run multiple snapshots use the 'tag' method.
+    To run multiple snapshots use the 'tag' method. With the 'tag' method the snapshot requests can be sent in parallel
+    by raising max_in_flight, see sc_snapshot_by_tag for the returned result map.
 
     :example:
-    >>> sc.sc_snapshot("tag", "exampletag", "scripted snap by tag", session, host)
+    >>> sc.sc_snapshot("tag", "exampletag", "scripted snap by tag", session, host, max_in_flight=16)
 
 
     :param type: definition of snapshot to be made. Can be "uuid", "vm" or "tag"
@@ -332,7 +1623,9 @@ def sc_snapshot(type: str, identifier: str, snapshot_label: str, api_headers: di
     :type api_headers: dict
     :param node: IP address or FQDN for a scale computing node, this can be any node in the cluster you are managing.
     :type node: str
-    :return: none
+    :param max_in_flight: only used for "tag", the maximum number of snapshot requests running at the same time.
+    :type max_in_flight: int
+    :return: snapshot response for "uuid" and "vmname", result map per vm uuid for "tag"
     :raises Exception: Error message
 
 
@@ -340,17 +1633,12 @@ def sc_snapshot(type: str, identifier: str, snapshot_label: str, api_headers: di
 
     match type:
         case "uuid":
-            api_snapshot = 'https://' + node + '/rest/v1/VirDomainSnapshot/'
-            snapshot_payload = json.dumps({
+            snapshot_payload = {
                 "domainUUID": identifier,
                 "label": snapshot_label
-            })
-            snapshot_response = json.loads(requests.request("POST",
-                                                            api_snapshot,
-                                                            headers=api_headers,
-                                                            data=snapshot_payload,
-                                                            verify=False)
-                                           .text)
+            }
+            snapshot_response = sc_get_client(node).post_json('VirDomainSnapshot/', snapshot_payload, api_headers)
+            sc_get_inventory(api_headers, node).invalidate()
             return snapshot_response
 
         case "vmname":
@@ -358,36 +1646,479 @@ def sc_snapshot(type: str, identifier: str, snapshot_label: str, api_headers: di
             if get_uuid is None:
                 raise Exception(
                     f'vm name {identifier} could not be found on the targeted cluster')
-            api_snapshot = 'https://' + node + '/rest/v1/VirDomainSnapshot/'
-            snapshot_payload = json.dumps({
+            snapshot_payload = {
                 "domainUUID": get_uuid,
                 "label": snapshot_label
-            })
-            snapshot_response = json.loads(requests.request("POST",
-                                                            api_snapshot,
-                                                            headers=api_headers,
-                                                            data=snapshot_payload,
-                                                            verify=False)
-                                           .text)
+            }
+            snapshot_response = sc_get_client(node).post_json('VirDomainSnapshot/', snapshot_payload, api_headers)
+            sc_get_inventory(api_headers, node).invalidate()
             return snapshot_response
 
         case "tag":
-            to_snap_dict = sc_get_by_tag(identifier, api_headers, node)
-            if not to_snap_dict:
-                raise Exception(f'No VMs with tag {identifier} were found')
-            for get_uuid in to_snap_dict.values():
-                api_snapshot = 'https://' + node + '/rest/v1/VirDomainSnapshot/'
-                snapshot_payload = json.dumps({
-                    "domainUUID": get_uuid,
-                    "label": snapshot_label
-                })
-                snapshot_response = json.loads(requests.request("POST",
-                                                                api_snapshot,
-                                                                headers=api_headers,
-                                                                data=snapshot_payload,
-                                                                verify=False)
-                                               .text)
+            return sc_snapshot_by_tag(identifier, snapshot_label, api_headers, node, max_in_flight)
+
+
+def sc_snapshot_by_tag(tag: str, snapshot_label: str, api_headers: dict, node: str, max_in_flight: int = 8) -> dict:
+    """
+    Snapshot all vms with a given tag in parallel
+
+    This function creates a snapshot for every vm carrying the tag. The snapshot requests are sent through a bounded
+    worker pool so at most max_in_flight requests are running against the cluster at the same time. The result map
+    holds the taskTag (or the error) per vm so you can wait for all the snapshot tasks together afterwards.
+
+    :example:
+    >>> result = sc.sc_snapshot_by_tag("exampletag", "nightly", session, host, max_in_flight=16)
+    >>> print(result)
+    {'0946a2b5-f16b-44f8-823a-e682824a6261': {'name': 'TestVM01', 'taskTag': '1234', 'error': None}}
+
+    :param tag: All vm's with this tag will be snapped.
+    :type tag: str
+    :param snapshot_label: label for the snapshot
+    :type snapshot_label: str
+    :param api_headers: a dict with the api headers that include the sessionID cookie.
+    :type api_headers: dict
+    :param node: IP address or FQDN for a scale computing node, this can be any node in the cluster you are managing.
+    :type node: str
+    :param max_in_flight: maximum number of snapshot requests running at the same time.
+    :type max_in_flight: int
+    :return: dict with per vm uuid a dict with name, taskTag and error
+    :raises Exception: No vms with the tag were found.
+    """
+
+    to_snap_dict = sc_get_by_tag(tag, api_headers, node)
+    if not to_snap_dict:
+        raise Exception(f'No VMs with tag {tag} were found')
+    client = sc_get_client(node)
+
+    def snap(get_uuid: str) -> dict:
+        snapshot_payload = json.dumps({
+            "domainUUID": get_uuid,
+            "label": snapshot_label
+        })
+        snapshot_response = client.request("POST", 'VirDomainSnapshot/', api_headers, snapshot_payload)
+        if snapshot_response.status_code != 200:
+            raise Exception(f'snapshot failed with status {snapshot_response.status_code}: {snapshot_response.text}')
+        return json.loads(snapshot_response.text)["taskTag"]
+
+    results = {}
+    with ThreadPoolExecutor(max_workers=max(1, max_in_flight)) as pool:
+        futures = {pool.submit(snap, get_uuid): (name, get_uuid) for name, get_uuid in to_snap_dict.items()}
+        for future in as_completed(futures):
+            name, get_uuid = futures[future]
+            try:
+                results[get_uuid] = {"name": name, "taskTag": future.result(), "error": None}
                 print(f'snapshot made for {get_uuid}')
+            except Exception as e:
+                results[get_uuid] = {"name": name, "taskTag": None, "error": str(e)}
+                print(f'snapshot failed for {get_uuid}: {e}')
+    sc_get_inventory(api_headers, node).invalidate()
+    return results
+
+
+# the VirDomainSnapshot fields snapshot pruning works with. Every snapshot entry also carries a full copy of its vm,
+# which is skipped while decoding.
+snapshot_prune_fields = ("uuid", "domainUUID", "label", "type", "timestamp", "domain.name", "domain.tags")
+
+
+def _snapshot_rule(policy: dict, vm_tags: str) -> dict:
+    # the policy with the rule of the first tag in policy["tags"] the vm carries laid over it
+    rule = {key: value for key, value in policy.items() if key != "tags"}
+    tags = (vm_tags or "").split(",")
+    for tag, tag_rule in policy.get("tags", {}).items():
+        if tag in tags:
+            rule.update(tag_rule)
+            break
+    return rule
+
+
+def sc_plan_snapshot_pruning(snapshots: list, policy: dict, now: float = None) -> dict:
+    """
+    Decide which snapshots a retention policy deletes
+
+    The snapshots are grouped per vm and every vm gets its own rule: the policy, with the rule of the first tag in
+    policy["tags"] that the vm carries laid over it. Only snapshots of one of the rule types whose label matches the
+    rule label are considered. The newest keep_last of those are always kept, whatever their age, so a vm whose snapshot
+    schedule stopped never loses its last snapshots. Of the rest a snapshot is deleted when it is older than max_age,
+    or, without max_age, simply because it is beyond the newest keep_last. Without keep_last and max_age nothing is
+    deleted. Nothing is sent to the cluster here.
+
+    Policy keys:
+        keep_last  always keep this many of the newest matching snapshots per vm
+        max_age    delete matching snapshots older than this many seconds, except the newest keep_last
+        label      regular expression the label must match (re.search), all labels when left out
+        types      snapshot types to consider, ("USER",) when left out so replication snapshots are never touched
+        tags       dict of tag -> rule with any of the keys above, for the vms carrying that tag
+
+    :example:
+    >>> policy = {"keep_last": 7, "label": "^nightly", "tags": {"prod": {"keep_last": 30, "max_age": None}}}
+    >>> sc_plan_snapshot_pruning(client.get_json("VirDomainSnapshot", session), policy)
+    {'5f2c...': {'vm': 'TestVM01', 'vmUUID': '0946a2b5-...', 'label': 'nightly', 'timestamp': 1700000000,
+                 'action': 'delete', 'reason': 'beyond the newest 7', 'status': 'planned', 'taskTag': None, 'error': None}}
+
+    :param snapshots: the decoded /rest/v1/VirDomainSnapshot list, at least the snapshot_prune_fields.
+    :type snapshots: list
+    :param policy: the retention policy, see above.
+    :type policy: dict
+    :param now: epoch the ages are counted from, defaults to the current time.
+    :type now: float
+    :return: dict with per considered snapshot uuid a dict with vm, vmUUID, label, timestamp, action ("keep" or
+        "delete"), reason, status ("kept" or "planned"), taskTag and error
+    """
+
+    now = time.time() if now is None else now
+    by_vm = {}
+    for snapshot in snapshots:
+        by_vm.setdefault(snapshot["domainUUID"], []).append(snapshot)
+
+    plan = {}
+    patterns = {}
+    for vm_uuid, vm_snapshots in by_vm.items():
+        domain = vm_snapshots[0].get("domain") or {}
+        rule = _snapshot_rule(policy, domain.get("tags"))
+        keep_last = rule.get("keep_last")
+        max_age = rule.get("max_age")
+        types = rule.get("types", ("USER",))
+        if rule.get("label") is not None and rule["label"] not in patterns:
+            patterns[rule["label"]] = re.compile(rule["label"])
+        label = patterns.get(rule.get("label"))
+
+        candidates = [snapshot for snapshot in vm_snapshots
+                      if snapshot.get("type", "USER") in types and (label is None or label.search(snapshot["label"]))]
+        candidates.sort(key=lambda snapshot: snapshot["timestamp"], reverse=True)
+        for position, snapshot in enumerate(candidates):
+            reason = None
+            if keep_last is not None and position < keep_last:
+                pass
+            elif max_age is not None:
+                if now - snapshot["timestamp"] > max_age:
+                    reason = f'older than {max_age} seconds'
+            elif keep_last is not None:
+                reason = f'beyond the newest {keep_last}'
+            plan[snapshot["uuid"]] = {"vm": domain.get("name"), "vmUUID": vm_uuid, "label": snapshot["label"],
+                                      "timestamp": snapshot["timestamp"], "action": "delete" if reason else "keep",
+                                      "reason": reason, "status": "planned" if reason else "kept", "taskTag": None,
+                                      "error": None}
+    return plan
+
+
+def sc_prune_snapshots(policy: dict, api_headers: dict, node: str, dry_run: bool = True, max_in_flight: int = 8,
+                       timeout: int = 3600) -> dict:
+    """
+    Delete the snapshots a retention policy no longer wants to keep
+
+    The whole VirDomainSnapshot list is fetched once (only the fields in snapshot_prune_fields are kept) and the
+    policy is evaluated locally, see sc_plan_snapshot_pruning for the policy keys. With dry_run (the default) the plan
+    is only printed and returned. Otherwise the deletes are sent through a bounded worker pool with at most
+    max_in_flight requests at the same time, and all the delete tasks are waited on together by one TaskWatcher.
+
+    !!! With dry_run=False this deletes snapshots on your cluster, check the dry run plan first !!!
+
+    :example:
+    >>> plan = sc_prune_snapshots({"keep_last": 7, "label": "^nightly"}, session, host)
+    >>> result = sc_prune_snapshots({"max_age": 30 * 86400, "tags": {"prod": {"max_age": 90 * 86400}}}, session, host,
+    ...                             dry_run=False, max_in_flight=16)
+
+    :param policy: the retention policy, see sc_plan_snapshot_pruning.
+    :type policy: dict
+    :param api_headers: a dict with the api headers that include the sessionID cookie.
+    :type api_headers: dict
+    :param node: IP address or FQDN for a scale computing node, this can be any node in the cluster you are managing.
+    :type node: str
+    :param dry_run: only plan, do not delete anything.
+    :type dry_run: bool
+    :param max_in_flight: maximum number of delete requests running at the same time.
+    :type max_in_flight: int
+    :param timeout: Timeout per delete task in seconds.
+    :type timeout: int
+    :return: the plan of sc_plan_snapshot_pruning, after deleting with status "deleted", "error" or "timeout" for the
+        deleted snapshots
+    """
+
+    client = sc_get_client(node)
+    plan = sc_plan_snapshot_pruning(client.get_json('VirDomainSnapshot', api_headers, snapshot_prune_fields), policy)
+    to_delete = [snap_uuid for snap_uuid, entry in plan.items() if entry["action"] == "delete"]
+
+    if dry_run:
+        for snap_uuid in to_delete:
+            print(f'{plan[snap_uuid]["vm"]} {snap_uuid} {plan[snap_uuid]["label"]} - would be deleted '
+                  f'({plan[snap_uuid]["reason"]})')
+        return plan
+
+    def delete(snap_uuid: str) -> str:
+        delete_response = client.request("DELETE", 'VirDomainSnapshot/' + snap_uuid, api_headers)
+        if delete_response.status_code != 200:
+            raise Exception(f'snapshot delete failed with status {delete_response.status_code}: {delete_response.text}')
+        return str(json.loads(delete_response.text)["taskTag"])
+
+    watcher = TaskWatcher(api_headers, node, timeout, max_in_flight=max_in_flight)
+    task_snapshots = {}
+    with ThreadPoolExecutor(max_workers=max(1, max_in_flight)) as pool:
+        futures = {pool.submit(delete, snap_uuid): snap_uuid for snap_uuid in to_delete}
+        for future in as_completed(futures):
+            entry = plan[futures[future]]
+            try:
+                entry["taskTag"] = future.result()
+                task_snapshots[entry["taskTag"]] = futures[future]
+                watcher.add(entry["taskTag"])
+            except Exception as e:
+                entry["status"] = "error"
+                entry["error"] = str(e)
+                print(f'{entry["vm"]} {futures[future]} - delete failed: {e}')
+
+    for sctag, completed in watcher.as_completed():
+        snap_uuid = task_snapshots[sctag]
+        entry = plan[snap_uuid]
+        if completed:
+            entry["status"] = "deleted"
+            print(f'{entry["vm"]} {snap_uuid} - has been deleted')
+        else:
+            entry["status"] = "error" if completed is False else "timeout"
+            entry["error"] = f'delete task {sctag} ' + ("reported an error" if completed is False else "timed out")
+            print(f'{entry["vm"]} {snap_uuid} - {entry["error"]}')
+
+    if to_delete:
+        sc_get_inventory(api_headers, node).invalidate()
+    return plan
+
+
+def sc_backup_disks_by_tag(tag: str, backup_vm: str, backup, api_headers: dict, node: str, max_attached: int = 2,
+                           snapshot_in_flight: int = 8, backup_in_flight: int = 1,
+                           label: str = "scripted backup snapshot", keep_failed_snapshots: bool = False,
+                           timeout: int = 3600) -> dict:
+    """
+    Back up the disks of all vms with a given tag through a backup vm
+
+    This is the MountSnapForBackup workflow for a whole tag group: snapshot the vm, clone the VIRTIO_DISKs of the
+    snapshot onto the backup vm, run the backup, delete the cloned disks and the snapshot. The snapshots of all vms are
+    taken at the same time (at most snapshot_in_flight requests at once). As soon as the snapshot of a vm is done its
+    disks are cloned onto the backup vm, while the backup of an earlier vm is still running. At most max_attached vms
+    have cloned disks on the backup vm at the same time and at most backup_in_flight backups run at the same time.
+
+    backup(vm, disks) is your own backup logic (rsync, smb copy, backup software, ...). It gets the vm dict and a list
+    with a dict per cloned disk: uuid (of the disk on the backup vm), source (the disk uuid of the vm) and capacity. What
+    it returns ends up in the result, when it raises the vm is reported as failed.
+
+    The cloned disks are always deleted again, also when the backup or a clone fails or the run is interrupted. The
+    snapshot is deleted as well, unless keep_failed_snapshots is set and something failed for that vm. All tasks are
+    waited on by one TaskWatcher.
+
+    :example:
+    >>> def backup(vm, disks):
+    ...     return subprocess.run(["/usr/local/bin/backup-disks", vm["name"]] + [disk["uuid"] for disk in disks]).returncode
+    >>> report = sc_backup_disks_by_tag("buclone", "backupvm01", backup, session, host, max_attached=2)
+
+    :param tag: All vm's with this tag will be backed up.
+    :type tag: str
+    :param backup_vm: uuid or name of the vm the disks are attached to.
+    :type backup_vm: str
+    :param backup: function that gets the vm dict and the list of cloned disks and makes the backup.
+    :type backup: callable
+    :param api_headers: a dict with the api headers that include the sessionID cookie.
+    :type api_headers: dict
+    :param node: IP address or FQDN for a scale computing node, this can be any node in the cluster you are managing.
+    :type node: str
+    :param max_attached: maximum number of vms with cloned disks on the backup vm at the same time.
+    :type max_attached: int
+    :param snapshot_in_flight: maximum number of snapshot requests running at the same time.
+    :type snapshot_in_flight: int
+    :param backup_in_flight: maximum number of backup() calls running at the same time.
+    :type backup_in_flight: int
+    :param label: label for the snapshots.
+    :type label: str
+    :param keep_failed_snapshots: keep the snapshot of a vm whose backup failed.
+    :type keep_failed_snapshots: bool
+    :param timeout: Timeout per task in seconds.
+    :type timeout: int
+    :return: dict with per vm uuid a dict with name, snapshot, disks, status ("done" or "error"), result, error,
+        leftover (uuids that could not be removed) and seconds per step
+    :raises Exception: The backup vm or vms with the tag were not found.
+    """
+
+    inventory = sc_get_inventory(api_headers, node)
+    inventory.refresh_vms(force=True)
+    backup_uuid = backup_vm if inventory.vm(backup_vm) is not None else inventory.vm_uuid(backup_vm)
+    if backup_uuid is None:
+        raise Exception(f'backup vm {backup_vm} could not be found on the targeted cluster')
+    vms = [vm for vm in inventory.tagged_vms(tag) if vm["uuid"] != backup_uuid]
+    if not vms:
+        raise Exception(f'No VMs with tag {tag} were found')
+
+    client = sc_get_client(node)
+    watcher = TaskWatcher(api_headers, node, timeout, max_in_flight=snapshot_in_flight)
+    backup_slots = threading.Semaphore(max(1, backup_in_flight))
+    cancelled = threading.Event()
+    report = {vm["uuid"]: {"name": vm["name"], "snapshot": None, "disks": [], "status": "queued", "result": None,
+                           "error": None, "leftover": [], "seconds": {}} for vm in vms}
+
+    def send(method: str, endpoint: str, payload: dict = None) -> tuple:
+        # send a request that starts a task, return the response and a future that resolves once the task is done
+        response = client.request(method, endpoint, api_headers, json.dumps(payload) if payload is not None else None)
+        if response.status_code != 200:
+            raise Exception(f'{method} {endpoint} failed with status {response.status_code}: {response.text}')
+        task_response = json.loads(response.text)
+        done = Future()
+        watcher.add(task_response["taskTag"])[0].add_done_callback(
+            lambda task: done.set_exception(task.exception()) if task.exception() else
+            done.set_result(True) if task.result() else
+            done.set_exception(Exception(f'{method} {endpoint} failed on the cluster (task {task_response["taskTag"]})')))
+        return task_response, done
+
+    def snap(vm: dict) -> None:
+        entry = report[vm["uuid"]]
+        if cancelled.is_set():
+            raise Exception('cancelled')
+        start = time.time()
+        snapshot_response, snapshot_task = send("POST", 'VirDomainSnapshot/', {"domainUUID": vm["uuid"], "label": label})
+        entry["snapshot"] = snapshot_response["createdUUID"]
+        snapshot_task.result()
+        entry["status"] = "snapshot"
+        entry["seconds"]["snapshot"] = round(time.time() - start, 3)
+
+    def cleanup(vm: dict) -> None:
+        # delete the cloned disks, then the snapshot. Whatever can not be removed is reported as leftover.
+        entry = report[vm["uuid"]]
+        start = time.time()
+        entry["status"] = "cleanup"
+        deletes = []
+        for disk_uuid in entry["disks"]:
+            try:
+                deletes.append((disk_uuid, send("DELETE", 'VirDomainBlockDevice/' + disk_uuid)[1]))
+            except Exception as e:
+                deletes.append((disk_uuid, e))
+        if entry["snapshot"] is not None and not (keep_failed_snapshots and entry["error"] is not None):
+            try:
+                # the disks are cloned from the snapshot, so it goes last
+                for disk_uuid, delete in deletes:
+                    if isinstance(delete, Future):
+                        delete.exception()
+                deletes.append((entry["snapshot"], send("DELETE", 'VirDomainSnapshot/' + entry["snapshot"])[1]))
+            except Exception as e:
+                deletes.append((entry["snapshot"], e))
+        for leftover_uuid, delete in deletes:
+            error = delete.exception() if isinstance(delete, Future) else delete
+            if error is not None:
+                entry["leftover"].append(leftover_uuid)
+                entry["error"] = entry["error"] or f'{leftover_uuid} could not be removed: {error}'
+        entry["seconds"]["cleanup"] = round(time.time() - start, 3)
+        entry["status"] = "done" if entry["error"] is None else "error"
+        print(f'{vm["name"]} - ' + ("backed up" if entry["error"] is None else entry["error"]))
+
+    def mount_and_backup(vm: dict) -> None:
+        entry = report[vm["uuid"]]
+        try:
+            if cancelled.is_set():
+                raise Exception('cancelled')
+            start = time.time()
+            entry["status"] = "clone"
+            snapshot = client.get_json('VirDomainSnapshot/' + entry["snapshot"], api_headers)[0]
+            clones = []
+            disks = []
+            for disk in snapshot["domain"]["blockDevs"]:
+                if disk["type"] == "VIRTIO_DISK":
+                    clone_payload = {
+                        "snapUUID": entry["snapshot"],
+                        "options": {"readOnly": False, "regenerateDiskID": False},
+                        "template": {"virDomainUUID": backup_uuid, "type": "VIRTIO_DISK", "capacity": disk["capacity"],
+                                     "tieringPriorityFactor": 8}
+                    }
+                    clone_response, clone_task = send("POST", 'VirDomainBlockDevice/' + disk["uuid"] + '/clone',
+                                                      clone_payload)
+                    entry["disks"].append(clone_response["createdUUID"])
+                    clones.append(clone_task)
+                    disks.append({"uuid": clone_response["createdUUID"], "source": disk["uuid"],
+                                  "capacity": disk["capacity"]})
+            for clone_task in clones:
+                clone_task.result()
+            entry["seconds"]["clone"] = round(time.time() - start, 3)
+
+            entry["status"] = "waiting"
+            with backup_slots:
+                if cancelled.is_set():
+                    raise Exception('cancelled')
+                start = time.time()
+                entry["status"] = "backup"
+                entry["result"] = backup(vm, disks)
+                entry["seconds"]["backup"] = round(time.time() - start, 3)
+        except Exception as e:
+            entry["error"] = str(e)
+        finally:
+            cleanup(vm)
+
+    watcher.start(keep_running=True)
+    try:
+        # every worker of the mount pool is one vm with cloned disks on the backup vm
+        with ThreadPoolExecutor(max_workers=max(1, max_attached)) as mounts:
+            try:
+                with ThreadPoolExecutor(max_workers=max(1, snapshot_in_flight)) as snapshots:
+                    futures = {snapshots.submit(snap, vm): vm for vm in vms}
+                    for future in as_completed(futures):
+                        vm = futures[future]
+                        if future.exception() is None:
+                            mounts.submit(mount_and_backup, vm)
+                        else:
+                            report[vm["uuid"]]["error"] = str(future.exception())
+                            cleanup(vm)
+            except BaseException:
+                cancelled.set()
+                raise
+    finally:
+        # snapshots that were taken but never got to the mount stage (the run was interrupted)
+        for vm in vms:
+            if report[vm["uuid"]]["status"] in ("queued", "snapshot") and report[vm["uuid"]]["snapshot"] is not None:
+                report[vm["uuid"]]["error"] = report[vm["uuid"]]["error"] or 'cancelled'
+                cleanup(vm)
+        watcher.stop()
+        inventory.invalidate()
+    return report
+
+
+def sc_new_tags(vm_tags: str, method: str, tags: str) -> str:
+    """
+    Compute a new tag string for a vm
+
+    This function applies a tag change to the comma delimited tag string of a vm without touching the cluster. It is
+    what sc_change_tag and sc_change_tags_bulk (here and in ScaleAsyncFunctions) use to work out the new tags. Adding
+    a tag the vm already has leaves the tags as they are.
+
+    :example:
+    >>> sc_new_tags("linux,prod", "group", "backup")
+    'backup,linux,prod'
+
+    :param vm_tags: the current comma delimited tags of the vm.
+    :type vm_tags: str
+    :param method: which method will be used, can be "add", "remove", "group" or "manual"
+    :type method: str
+    :param tags: tag to add, remove, group by, or comma delimited manual list.
+    :type tags: str
+    :return: str
+    :raises Exception: removing a tag the vm does not have, or an unknown method.
+    """
+
+    vm_tags_list = [tag for tag in vm_tags.split(",") if tag]
+
+    match method:
+        case "add":
+            if tags not in vm_tags_list:
+                vm_tags_list.append(tags)
+
+        case "remove":
+            if tags in vm_tags_list:
+                vm_tags_list.remove(tags)
+            else:
+                raise Exception(f'requested tag remove for tag that is not registered with vm')
+
+        case "group":
+            if tags in vm_tags_list:
+                vm_tags_list.remove(tags)
+            vm_tags_list.insert(0, tags)
+
+        case "manual":
+            return tags
+
+        case _:
+            raise Exception(f'invalid method {method}, use "add", "remove", "group" or "manual"')
+
+    return ','.join(vm_tags_list)
 
 
 def sc_change_tag(type: str, identifier: str, method: str, tags: list, api_headers: dict, node: str) -> None:
@@ -418,50 +2149,446 @@ def sc_change_tag(type: str, identifier: str, method: str, tags: list, api_heade
     """
 
     vm_info = sc_get_vm_info(type, identifier, api_headers, node)
-    vm_tags_list = vm_info[0]["tags"].split(",")
-
-    match method:
-        case "add":
-            vm_tags_list.append(tags)
-            vm_tags_str = ','.join(vm_tags_list)
-        
-        case "remove":
-            if tags in vm_tags_list:
-                vm_tags_list.remove(tags)
-                vm_tags_str = ','.join(vm_tags_list)
-                tagchange_payload = json.dumps({
-                    "tags": vm_tags_str
-                })
-            else:
-                raise Exception(f'requested tag remove for tag that is not registered with vm')
-
-        case "group":
-            if tags in vm_tags_list:
-                vm_tags_list.remove(tags)
-                vm_tags_list.insert(0, tags)
-                vm_tags_str = ','.join(vm_tags_list)
-                
-            else:
-                vm_tags_list.insert(0, tags)
-                vm_tags_str = ','.join(vm_tags_list)
+    vm_tags_str = sc_new_tags(vm_info[0]["tags"], method, tags)
 
-        case "manual":
-            vm_tags_str = tags
-    
-    tagchange_payload = json.dumps({
+    tagchange_payload = {
         "tags": vm_tags_str
-        })
+        }
     
-    api_tagchange = 'https://' + node + '/rest/v1/VirDomain/' + vm_info[0]["uuid"]
-    tagchange_response = json.loads(requests.request("POST",
-                                                     api_tagchange,
-                                                     headers=api_headers,
-                                                     data=tagchange_payload,
-                                                     verify=False)
-                                    .text)
+    tagchange_response = sc_get_client(node).post_json('VirDomain/' + vm_info[0]["uuid"], tagchange_payload, api_headers)
+    sc_get_inventory(api_headers, node).invalidate()
     return tagchange_response
 
 
+def sc_plan_tag_changes(vms: list, selector, method: str, tags: str) -> dict:
+    """
+    Work out a tag change for many vms
+
+    This function selects vms from a VirDomain list and computes their new tag strings with sc_new_tags, without
+    touching the cluster. It is what sc_change_tags_bulk here and in ScaleAsyncFunctions use to decide which vms to
+    POST. Removing a tag a vm does not have leaves that vm unchanged.
+
+    :example:
+    >>> report = sc_plan_tag_changes(sc_get_all_vminfo(session, host), "linux", "add", "patched")
+    >>> [vm_uuid for vm_uuid, entry in report.items() if entry["new"] != entry["old"]]
+
+    :param vms: list of vm dicts with at least uuid, name and tags.
+    :type vms: list
+    :param selector: a tag (str), a list of vm names or uuids, or a function that gets a vm dict and returns True for
+        the vms to change.
+    :type selector: str | list | callable
+    :param method: which method will be used, can be "add", "remove", "group" or "manual"
+    :type method: str
+    :param tags: tag to add, remove, group by, or comma delimited manual list.
+    :type tags: str
+    :return: dict with per selected vm uuid a dict with name, old, new, status ("unchanged"), taskTag and error
+    :raises Exception: a vm in the selector list could not be found, or an unknown method.
+    """
+
+    if isinstance(selector, str):
+        selected = [vm for vm in vms if selector in vm["tags"].split(",")]
+    elif callable(selector):
+        selected = [vm for vm in vms if selector(vm)]
+    else:
+        by_uuid = {vm["uuid"]: vm for vm in vms}
+        by_name = {vm["name"].upper(): vm for vm in vms}
+        selected = []
+        for identifier in selector:
+            vm = by_uuid.get(identifier) or by_name.get(identifier.upper())
+            if vm is None:
+                raise Exception(f'vm {identifier} could not be found on the targeted cluster')
+            selected.append(vm)
+
+    report = {}
+    for vm in selected:
+        entry = {"name": vm["name"], "old": vm["tags"], "new": vm["tags"], "status": "unchanged", "taskTag": None,
+                 "error": None}
+        report[vm["uuid"]] = entry
+        if method == "remove" and tags not in vm["tags"].split(","):
+            continue
+        entry["new"] = sc_new_tags(vm["tags"], method, tags)
+    return report
+
+
+def sc_change_tags_bulk(selector, method: str, tags: str, api_headers: dict, node: str, max_in_flight: int = 8) -> dict:
+    """
+    Change tags for many vm's at once
+
+    This function selects vms from a single VirDomain fetch, computes their new tag strings locally (see
+    sc_plan_tag_changes) and only sends a POST for the vms whose tags actually change. The POSTs run through a bounded worker pool with at
+    most max_in_flight requests at the same time. Where sc_change_tag raises when removing a tag a vm does not have,
+    here that vm is simply reported as unchanged.
+
+    :example:
+    >>> report = sc_change_tags_bulk("linux", "add", "patched", session, host)
+    >>> report = sc_change_tags_bulk(["testvm01", "testvm02"], "group", "dmo", session, host)
+    >>> report = sc_change_tags_bulk(lambda vm: vm["state"] == "SHUTOFF", "remove", "prod", session, host)
+
+    :param selector: a tag (str), a list of vm names or uuids, or a function that gets a vm dict and returns True for
+        the vms to change.
+    :type selector: str | list | callable
+    :param method: which method will be used, can be "add", "remove", "group" or "manual"
+    :type method: str
+    :param tags: tag to add, remove, group by, or comma delimited manual list.
+    :type tags: str
+    :param api_headers: a dict with the api headers that include the sessionID cookie.
+    :type api_headers: dict
+    :param node: IP address or FQDN for a scale computing node, this can be any node in the cluster you are managing.
+    :type node: str
+    :param max_in_flight: maximum number of tag change requests running at the same time.
+    :type max_in_flight: int
+    :return: dict with per vm uuid a dict with name, old, new, status ("changed", "unchanged" or "error"), taskTag and
+        error
+    """
+
+    inventory = sc_get_inventory(api_headers, node)
+    report = sc_plan_tag_changes(inventory.refresh_vms(force=True), selector, method, tags)
+    to_change = [vm_uuid for vm_uuid, entry in report.items() if entry["new"] != entry["old"]]
+
+    client = sc_get_client(node)
+
+    def change(vm_uuid: str) -> str:
+        tagchange_payload = json.dumps({
+            "tags": report[vm_uuid]["new"]
+        })
+        tagchange_response = client.request("POST", 'VirDomain/' + vm_uuid, api_headers, tagchange_payload)
+        if tagchange_response.status_code != 200:
+            raise Exception(f'tag change failed with status {tagchange_response.status_code}: {tagchange_response.text}')
+        return json.loads(tagchange_response.text).get("taskTag")
+
+    with ThreadPoolExecutor(max_workers=max(1, max_in_flight)) as pool:
+        futures = {pool.submit(change, vm_uuid): vm_uuid for vm_uuid in to_change}
+        for future in as_completed(futures):
+            entry = report[futures[future]]
+            try:
+                entry["taskTag"] = future.result()
+                entry["status"] = "changed"
+            except Exception as e:
+                entry["status"] = "error"
+                entry["error"] = str(e)
+
+    if to_change:
+        inventory.invalidate()
+    return report
+
+
+def sc_plan_evacuation(evacuate_uuid: str, vms: list, nodes: list, headroom: int = 2 * 1024**3) -> dict:
+    """
+    Decide where the running vms of a node go when it is evacuated
+
+    The running vms of the node are placed on the other nodes by their memory, largest vm first, each on the node that
+    has the most free memory left (memSize - totalMemUsageBytes, minus headroom). That keeps the nodes evenly loaded
+    and a vm that fits nowhere is reported as unplaced instead of being sent to a node that can not take it. Vms that
+    are not running are not on a node and are skipped. Nothing is sent to the cluster here.
+
+    :example:
+    >>> plan = sc_plan_evacuation(node_uuid, sc_get_all_vminfo(session, host), sc_get_all_nodeinfo(session, host))
+    >>> plan["moves"][0]
+    {'uuid': '0946a2b5-...', 'name': 'TestVM01', 'mem': 17179869184, 'from': '5c7a...', 'to': '9f3e...'}
+
+    :param evacuate_uuid: uuid of the node to evacuate.
+    :type evacuate_uuid: str
+    :param vms: the decoded /rest/v1/VirDomain list.
+    :type vms: list
+    :param nodes: the decoded /rest/v1/Node list.
+    :type nodes: list
+    :param headroom: bytes of memory to leave free on every target node.
+    :type headroom: int
+    :return: dict with node, moves (uuid, name, mem, from, to), unplaced and skipped vms (uuid, name, mem) and
+        free_after (the free memory per target node after the moves)
+    """
+
+    free = {snode["uuid"]: snode["memSize"] - snode["totalMemUsageBytes"] - headroom
+            for snode in nodes if snode["uuid"] != evacuate_uuid}
+    plan = {"node": evacuate_uuid, "moves": [], "unplaced": [], "skipped": [], "free_after": free}
+    on_node = [vm for vm in vms if vm["nodeUUID"] == evacuate_uuid]
+    for vm in sorted(on_node, key=lambda vm: vm["mem"], reverse=True):
+        entry = {"uuid": vm["uuid"], "name": vm["name"], "mem": vm["mem"]}
+        if vm["state"] != "RUNNING":
+            plan["skipped"].append(entry)
+            continue
+        target = max(free, key=free.get, default=None)
+        if target is None or free[target] < vm["mem"]:
+            plan["unplaced"].append(entry)
+            continue
+        free[target] -= vm["mem"]
+        plan["moves"].append(dict(entry, **{"from": evacuate_uuid, "to": target}))
+    return plan
+
+
+def sc_live_migrate(moves: list, api_headers: dict, node: str, per_node_in_flight: int = 2,
+                    timeout: int = 3600) -> dict:
+    """
+    Live migrate many vms at once
+
+    Every move is a dict with at least uuid and to (the target node uuid), name is used in the printed lines. The
+    migrations run concurrently, with at most per_node_in_flight migrations going to the same node at the same time.
+    All migration tasks are waited on by one TaskWatcher.
+
+    :example:
+    >>> sc_live_migrate([{"uuid": vm_uuid, "name": "TestVM01", "to": node_uuid}], session, host)
+    {'0946a2b5-f16b-44f8-823a-e682824a6261': {'name': 'TestVM01', 'to': '9f3e...', 'status': 'migrated', 'error': None,
+                                              'seconds': 12.4}}
+
+    :param moves: the migrations to do.
+    :type moves: list
+    :param api_headers: a dict with the api headers that include the sessionID cookie.
+    :type api_headers: dict
+    :param node: IP address or FQDN for a scale computing node, this can be any node in the cluster you are managing.
+    :type node: str
+    :param per_node_in_flight: maximum number of migrations to the same node at the same time.
+    :type per_node_in_flight: int
+    :param timeout: Timeout per migration in seconds.
+    :type timeout: int
+    :return: dict with per vm uuid a dict with name, to, status ("migrated" or "error"), error and seconds
+    """
+
+    client = sc_get_client(node)
+    watcher = TaskWatcher(api_headers, node, timeout)
+    results = {move["uuid"]: {"name": move.get("name"), "to": move["to"], "status": None, "error": None,
+                              "seconds": None} for move in moves}
+
+    def migrate(move: dict) -> None:
+        result = results[move["uuid"]]
+        start = time.time()
+        try:
+            migrate_payload = json.dumps([{
+                "actionType": "LIVEMIGRATE",
+                "virDomainUUID": move["uuid"],
+                "nodeUUID": move["to"]
+            }])
+            migrate_response = client.request("POST", 'VirDomain/action', api_headers, migrate_payload)
+            if migrate_response.status_code != 200:
+                raise Exception(f'migration failed with status {migrate_response.status_code}: {migrate_response.text}')
+            if not watcher.add(json.loads(migrate_response.text)["taskTag"])[0].result():
+                raise Exception('migration task failed on the cluster')
+            result["status"] = "migrated"
+            print(f'{move.get("name", move["uuid"])} migrated to {move["to"]}')
+        except Exception as e:
+            result["status"] = "error"
+            result["error"] = str(e)
+            print(f'{move.get("name", move["uuid"])} could not be migrated: {e}')
+        result["seconds"] = round(time.time() - start, 3)
+
+    # one pool per target node, so a node that is slow to receive only holds up the vms going to it
+    by_target = {}
+    for move in moves:
+        by_target.setdefault(move["to"], []).append(move)
+    pools = [ThreadPoolExecutor(max_workers=max(1, per_node_in_flight)) for _ in by_target]
+    watcher.start(keep_running=True)
+    try:
+        futures = [pool.submit(migrate, move) for pool, target_moves in zip(pools, by_target.values())
+                   for move in target_moves]
+        wait(futures)
+    finally:
+        for pool in pools:
+            pool.shutdown()
+        watcher.stop()
+    if moves:
+        sc_get_inventory(api_headers, node).invalidate()
+    return results
+
+
+def sc_evacuate_node(evacuate: str, api_headers: dict, node: str, per_node_in_flight: int = 2,
+                     placement_file: str = None, headroom: int = 2 * 1024**3, dry_run: bool = False,
+                     timeout: int = 3600) -> dict:
+    """
+    Move all running vms off a node
+
+    The vms and nodes are read once, sc_plan_evacuation decides where every vm goes and sc_live_migrate does the
+    migrations concurrently. The original placement of the moved vms is recorded (in placement_file as well, written
+    before the first migration starts) so sc_move_back can put them back in one go. With dry_run only the plan is
+    returned.
+
+    :example:
+    >>> result = sc_evacuate_node("10.0.0.3", session, host, placement_file="placement.json")
+    >>> # maintenance on 10.0.0.3
+    >>> sc_move_back("placement.json", session, host)
+
+    :param evacuate: lanIP or uuid of the node to evacuate.
+    :type evacuate: str
+    :param api_headers: a dict with the api headers that include the sessionID cookie.
+    :type api_headers: dict
+    :param node: IP address or FQDN for a scale computing node, this can be any node in the cluster you are managing.
+    :type node: str
+    :param per_node_in_flight: maximum number of migrations to the same node at the same time.
+    :type per_node_in_flight: int
+    :param placement_file: JSON file to record the original placement in.
+    :type placement_file: str
+    :param headroom: bytes of memory to leave free on every target node.
+    :type headroom: int
+    :param dry_run: only plan, do not migrate anything.
+    :type dry_run: bool
+    :param timeout: Timeout per migration in seconds.
+    :type timeout: int
+    :return: dict with plan (see sc_plan_evacuation), placement (vm uuid -> original node uuid) and migrations (see
+        sc_live_migrate)
+    :raises Exception: The node was not found, or vms did not fit on the other nodes.
+    """
+
+    nodes = sc_get_all_nodeinfo(api_headers, node)
+    evacuate_uuid = next((snode["uuid"] for snode in nodes if evacuate in (snode["uuid"], snode["lanIP"])), None)
+    if evacuate_uuid is None:
+        raise Exception(f'node {evacuate} could not be found on the targeted cluster')
+    vms = sc_get_all_vminfo(api_headers, node, fields=("uuid", "name", "nodeUUID", "state", "mem"))
+    plan = sc_plan_evacuation(evacuate_uuid, vms, nodes, headroom)
+    placement = {move["uuid"]: move["from"] for move in plan["moves"]}
+    if dry_run:
+        return {"plan": plan, "placement": placement, "migrations": {}}
+    if plan["unplaced"]:
+        raise Exception(f'{len(plan["unplaced"])} vms do not fit on the other nodes: '
+                        f'{", ".join(vm["name"] for vm in plan["unplaced"])}')
+
+    if placement_file is not None:
+        temporary = placement_file + '.tmp'
+        with open(temporary, 'w') as f:
+            json.dump(placement, f, indent=2)
+        os.replace(temporary, placement_file)
+    return {"plan": plan, "placement": placement,
+            "migrations": sc_live_migrate(plan["moves"], api_headers, node, per_node_in_flight, timeout)}
+
+
+def sc_move_back(placement, api_headers: dict, node: str, per_node_in_flight: int = 2, timeout: int = 3600) -> dict:
+    """
+    Put vms back on the nodes they were on before an evacuation
+
+    Replays the placement recorded by sc_evacuate_node: every vm that still exists and is not on its original node is
+    live migrated back, all at once with at most per_node_in_flight migrations per node.
+
+    :example:
+    >>> sc_move_back("placement.json", session, host)
+
+    :param placement: dict with vm uuid -> node uuid, or the placement_file written by sc_evacuate_node.
+    :type placement: dict | str
+    :param api_headers: a dict with the api headers that include the sessionID cookie.
+    :type api_headers: dict
+    :param node: IP address or FQDN for a scale computing node, this can be any node in the cluster you are managing.
+    :type node: str
+    :param per_node_in_flight: maximum number of migrations to the same node at the same time.
+    :type per_node_in_flight: int
+    :param timeout: Timeout per migration in seconds.
+    :type timeout: int
+    :return: see sc_live_migrate
+    """
+
+    if isinstance(placement, str):
+        with open(placement) as f:
+            placement = json.load(f)
+    vms = {vm["uuid"]: vm for vm in sc_get_all_vminfo(api_headers, node, fields=("uuid", "name", "nodeUUID", "state"))}
+    moves = [{"uuid": vm_uuid, "name": vms[vm_uuid]["name"], "to": node_uuid} for vm_uuid, node_uuid in placement.items()
+             if vm_uuid in vms and vms[vm_uuid]["nodeUUID"] != node_uuid and vms[vm_uuid]["state"] == "RUNNING"]
+    return sc_live_migrate(moves, api_headers, node, per_node_in_flight, timeout)
+
+
+# A change on a vm found by sc_watch_vms. type is one of "added", "removed", "state_changed", "tags_changed" or
+# "node_changed", old and new hold the value before and after the change (None for added/removed) and vm is the
+# latest vm dict. For removed vms, which are no longer in the list, vm only holds the uuid, name and watched fields
+# that were kept from the last poll.
+VmEvent = namedtuple("VmEvent", ["type", "uuid", "name", "old", "new", "vm"])
+
+# the vm fields sc_watch_vms reports changes for, with the event type for each
+_watched_fields = (("state", "state_changed"), ("tags", "tags_changed"), ("nodeUUID", "node_changed"))
+
+
+def _vm_fingerprint(vm: dict) -> int:
+    return hash(tuple(vm[field] for field, _ in _watched_fields))
+
+
+def _vm_watched(vm: dict) -> dict:
+    # what sc_diff_vms keeps of a vm between two polls
+    watched = {field: vm[field] for field, _ in _watched_fields}
+    watched["uuid"] = vm["uuid"]
+    watched["name"] = vm["name"]
+    return watched
+
+
+def sc_diff_vms(previous: dict, vms: list) -> tuple:
+    """
+    Compare a fresh VirDomain list against the fingerprints of the previous poll
+
+    This is the diffing step of sc_watch_vms, usable on its own when you already have the vm list. The state keeps per
+    vm the fingerprint and the name and watched fields only, not the vm dicts of the list, so it stays small between
+    polls. Only vms whose fingerprint changed are compared field by field.
+
+    :example:
+    >>> state, events = sc_diff_vms({}, sc_get_all_vminfo(session, host))
+    >>> state, events = sc_diff_vms(state, sc_get_all_vminfo(session, host))
+
+    :param previous: the state returned by the previous call, an empty dict for the first call.
+    :type previous: dict
+    :param vms: the decoded /rest/v1/VirDomain list.
+    :type vms: list
+    :return: (new state, list of VmEvent)
+    :rtype: tuple
+    """
+
+    current = {}
+    events = []
+    for vm in vms:
+        fingerprint = _vm_fingerprint(vm)
+        known = previous.get(vm["uuid"])
+        if known is not None and known[0] == fingerprint and known[1]["name"] == vm["name"]:
+            current[vm["uuid"]] = known
+        else:
+            current[vm["uuid"]] = (fingerprint, _vm_watched(vm))
+        if known is None:
+            events.append(VmEvent("added", vm["uuid"], vm["name"], None, None, vm))
+        elif known[0] != fingerprint:
+            old_vm = known[1]
+            for field, event_type in _watched_fields:
+                if old_vm[field] != vm[field]:
+                    events.append(VmEvent(event_type, vm["uuid"], vm["name"], old_vm[field], vm[field], vm))
+
+    for vm_uuid, (fingerprint, old_vm) in previous.items():
+        if vm_uuid not in current:
+            events.append(VmEvent("removed", vm_uuid, old_vm["name"], None, None, old_vm))
+    return current, events
+
+
+def sc_watch_vms(api_headers: dict, node: str, interval: float = 10, emit_initial: bool = False):
+    """
+    Yield vm change events as they happen
+
+    This generator polls the VirDomain list every interval seconds and yields a VmEvent for every vm that was added,
+    removed, changed power state, got different tags or moved to another node. Per vm only a fingerprint and the
+    watched fields are kept, so unchanged vms cost one hash per poll. Every poll also refreshes the cached inventory
+    (see sc_get_inventory), so lookups done while handling the events do not fetch the list again.
+    The generator runs until you stop iterating.
+
+    :example:
+    >>> for event in sc_watch_vms(session, host, interval=30):
+    ...     if event.type == "tags_changed":
+    ...         print(f'{event.name}: {event.old} -> {event.new}')
+
+    :param api_headers: a dict with the api headers that include the sessionID cookie.
+    :type api_headers: dict
+    :param node: IP address or FQDN for a scale computing node, this can be any node in the cluster you are managing.
+    :type node: str
+    :param interval: seconds between the start of two polls.
+    :type interval: float
+    :param emit_initial: yield an "added" event for every vm found by the first poll.
+    :type emit_initial: bool
+    :return: generator of VmEvent
+    """
+
+    inventory = sc_get_inventory(api_headers, node)
+    state = None
+    deadline = time.monotonic()
+    while True:
+        vms = inventory.refresh_vms(force=True)
+        if state is None:
+            state, events = sc_diff_vms({}, vms)
+            if not emit_initial:
+                events = []
+        else:
+            state, events = sc_diff_vms(state, vms)
+        yield from events
+
+        # a poll that ran past the next deadline moves the schedule instead of firing the missed polls back to back
+        deadline = max(deadline + interval, time.monotonic())
+        time.sleep(max(0.0, deadline - time.monotonic()))
+
+
 if __name__ == "__main__":
     print("This script was never intended to be run directly. Feel free to do so, but a more elegant way would be to import it"
           " as a module into your own code.")
@@ -0,0 +1,197 @@
+import asyncio
+import threading
+import time
+from collections import deque
+
+# Client side rate limiting for the hypercore API.
+#
+# The API is served by the same nodes that run the GUI and the vms, so parallel scripts should not push it harder than
+# it can take. A RateLimiter combines a token bucket (requests per second) with an AIMD limit on the number of requests
+# in flight: every healthy response raises the limits a little (additive increase), a 429, a 5xx or a response that is
+# clearly slower than usual halves them (multiplicative decrease). Parallel workloads then run as fast as the cluster
+# allows and slow down by themselves when it gets busy.
+#
+# ScaleFunctions and ScaleAsyncFunctions give every node client one limiter, configured by their rate_limits dict.
+
+
+class RateLimiter:
+    """
+    Token bucket plus AIMD in-flight limit for one cluster
+
+    Call acquire() before a request and release() with the outcome after it, or from a coroutine await acquire_async()
+    and call release_async(). A limiter serves either threads or the coroutines of one event loop, not both: the
+    thread methods share a lock, the async ones never block the loop on it. The limits
+    start at their maximum and only drop when the cluster shows it is struggling. "Slower than usual" is judged per
+    endpoint (the first part of the path, so VirDomain and TaskTag are not compared with each other): the smoothed
+    latency of the endpoint rises above latency_factor times the fastest smoothed latency seen for it, and above
+    latency_floor.
+
+    :example:
+    >>> limiter = RateLimiter(max_rate=50, max_in_flight=8)
+    >>> limiter.acquire()
+    >>> limiter.release("VirDomain/", 0.04, 200)
+
+    :param max_rate: maximum requests per second, 0 for no rate limit.
+    :type max_rate: float
+    :param max_in_flight: maximum number of requests running at the same time.
+    :type max_in_flight: int
+    :param min_in_flight: the in flight limit never drops below this.
+    :type min_in_flight: int
+    :param latency_factor: an endpoint this many times slower than its baseline counts as overload.
+    :type latency_factor: float
+    :param latency_floor: a smoothed latency below this many seconds never counts as overload.
+    :type latency_floor: float
+    :param cooldown: minimum seconds between two decreases, so one burst of errors only halves the limits once.
+    :type cooldown: float
+    """
+
+    def __init__(self, max_rate: float = 100.0, max_in_flight: int = 16, min_in_flight: int = 1,
+                 latency_factor: float = 4.0, latency_floor: float = 0.5, cooldown: float = 1.0):
+        self.max_rate = max_rate
+        self.max_in_flight = max(1, max_in_flight)
+        self.min_in_flight = max(1, min(min_in_flight, self.max_in_flight))
+        self.latency_factor = latency_factor
+        self.latency_floor = latency_floor
+        self.cooldown = cooldown
+
+        self.rate = float(max_rate)
+        self.limit = float(self.max_in_flight)
+        self.in_flight = 0
+        self.tokens = float(self.max_in_flight)
+        self.refilled = time.monotonic()
+        self.paused_until = 0.0
+        self.decreased = 0.0
+        self.backoffs = 0
+        self.latency = {}
+        self.baseline = {}
+        self._condition = threading.Condition()
+        # waiting coroutines, first come first served. Only the first one checks the limits, the others sleep until
+        # it got its slot, so a release or a new token wakes one coroutine instead of all of them.
+        self._waiters = deque()
+
+    def _try_acquire(self, now: float) -> float:
+        # 0 when a slot was taken, otherwise the seconds to wait before trying again (None: wait for a release)
+        if now < self.paused_until:
+            return self.paused_until - now
+        if self.in_flight >= int(self.limit):
+            return None
+        if self.max_rate:
+            self.tokens = min(float(self.max_in_flight), self.tokens + (now - self.refilled) * self.rate)
+            self.refilled = now
+            if self.tokens < 1.0:
+                return (1.0 - self.tokens) / self.rate
+            self.tokens -= 1.0
+        self.in_flight += 1
+        return 0
+
+    def acquire(self) -> None:
+        """
+        Block until a request may be sent.
+        """
+
+        with self._condition:
+            while True:
+                wait = self._try_acquire(time.monotonic())
+                if wait == 0:
+                    return
+                self._condition.wait(wait)
+
+    async def acquire_async(self) -> None:
+        """
+        Wait on the event loop until a request may be sent.
+        """
+
+        if not self._waiters and self._try_acquire(time.monotonic()) == 0:
+            return
+        loop = asyncio.get_running_loop()
+        waiter = asyncio.Event()
+        self._waiters.append(waiter)
+        try:
+            while True:
+                waiter.clear()
+                timer = None
+                if self._waiters[0] is waiter:
+                    wait = self._try_acquire(time.monotonic())
+                    if wait == 0:
+                        return
+                    if wait is not None:
+                        # sleep exactly until the next token is due (or the pause ends), a release wakes us earlier
+                        timer = loop.call_later(wait, waiter.set)
+                try:
+                    await waiter.wait()
+                finally:
+                    if timer is not None:
+                        timer.cancel()
+        finally:
+            self._waiters.remove(waiter)
+            if self._waiters:
+                # the next in line checks the limits now
+                self._waiters[0].set()
+
+    def release(self, endpoint: str, seconds: float, status: int, retry_after: float = None) -> None:
+        """
+        Report the outcome of a request that was acquired and adjust the limits.
+
+        :param endpoint: the endpoint below /rest/v1/ that was requested.
+        :type endpoint: str
+        :param seconds: how long the request took.
+        :type seconds: float
+        :param status: HTTP status code, None when the request failed without a response.
+        :type status: int
+        :param retry_after: seconds from a Retry-After header, pauses all requests that long.
+        :type retry_after: float
+        """
+
+        with self._condition:
+            self._update(endpoint, seconds, status, retry_after)
+            self._condition.notify_all()
+
+    def release_async(self, endpoint: str, seconds: float, status: int, retry_after: float = None) -> None:
+        """
+        release() for a request acquired with acquire_async(), called from the event loop.
+        """
+
+        self._update(endpoint, seconds, status, retry_after)
+        if self._waiters:
+            self._waiters[0].set()
+
+    def _update(self, endpoint: str, seconds: float, status: int, retry_after: float) -> None:
+        # the bookkeeping of release() and release_async()
+        key = endpoint.split('/', 1)[0]
+        self.in_flight -= 1
+        now = time.monotonic()
+
+        overloaded = status is None or status == 429 or status >= 500
+        if not overloaded:
+            # smoothed latency per endpoint, the baseline follows its lowest value and slowly forgets it
+            smoothed = self.latency.get(key, seconds) * 0.8 + seconds * 0.2
+            self.latency[key] = smoothed
+            baseline = min(self.baseline.get(key, smoothed) * 1.01, smoothed)
+            self.baseline[key] = baseline
+            # judged on the smoothed latency, a single slow response (a new connection) is no overload yet
+            overloaded = smoothed > self.latency_floor and smoothed > baseline * self.latency_factor
+
+        if retry_after:
+            self.paused_until = max(self.paused_until, now + retry_after)
+
+        if overloaded:
+            if now - self.decreased >= self.cooldown:
+                self.decreased = now
+                self.backoffs += 1
+                self.limit = max(float(self.min_in_flight), self.limit / 2)
+                if self.max_rate:
+                    self.rate = max(1.0, self.rate / 2)
+        else:
+            # about +1 in flight and +5% of max_rate for every limit worth of healthy responses
+            self.limit = min(float(self.max_in_flight), self.limit + 1 / self.limit)
+            if self.max_rate:
+                self.rate = min(float(self.max_rate), self.rate + self.max_rate / 20 / self.limit)
+
+    def __repr__(self) -> str:
+        return (f'RateLimiter(rate={self.rate:.1f}/s, limit={int(self.limit)}, in_flight={self.in_flight}, '
+                f'backoffs={self.backoffs})')
+
+
+if __name__ == "__main__":
+    print("This script was never intended to be run directly. Feel free to do so, but a more elegant way would be to import it"
+          " as a module into your own code.")
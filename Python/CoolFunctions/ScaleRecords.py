@@ -0,0 +1,194 @@
+# Compact record types for the hypercore API objects.
+#
+# The API hands out large nested dicts. Scripts that keep vms and nodes around for a long time (or walk them in a hot
+# loop) are better off with these slotted classes: no per object __dict__, only the fields the scripts here use, and
+# plain attribute access. Every class has a from_json constructor that takes the decoded API dict. Fields missing from
+# the dict (for example when it was decoded with a field projection, see ScaleFunctions.sc_iter_json) become None.
+#
+# The fields tuple of every class lists the API fields from_json reads, so it can be used directly as projection:
+# >>> vms = [Vm.from_json(vm) for vm in sc_iter_json(chunks, Vm.fields)]
+
+
+class BlockDev:
+    """
+    A virtual disk (or cdrom) of a vm, from the blockDevs list of a VirDomain entry.
+
+    :example:
+    >>> disk = BlockDev.from_json(vm_json["blockDevs"][0])
+    >>> disk.capacity / 1000**3
+    100.0
+    """
+
+    __slots__ = ("uuid", "type", "capacity", "allocation")
+    fields = ("uuid", "type", "capacity", "allocation")
+
+    def __init__(self, uuid: str, type: str, capacity: int = None, allocation: int = None):
+        self.uuid = uuid
+        self.type = type
+        self.capacity = capacity
+        self.allocation = allocation
+
+    @classmethod
+    def from_json(cls, data: dict) -> "BlockDev":
+        return cls(data.get("uuid"), data.get("type"), data.get("capacity"), data.get("allocation"))
+
+    def __repr__(self) -> str:
+        return f'BlockDev({self.uuid!r}, {self.type!r})'
+
+
+class Vm:
+    """
+    A vm, from /rest/v1/VirDomain
+
+    tags is a tuple of the separate tags, snap_count the number of snapshots. block_devs holds BlockDev records, disks
+    only the VIRTIO_DISK and IDE_DISK ones.
+
+    :example:
+    >>> vm = Vm.from_json(sc_get_vm_info("vm", "testvm01", session, host)[0])
+    >>> vm.name, vm.state, vm.tags
+    ('testvm01', 'RUNNING', ('linux', 'prod'))
+    """
+
+    __slots__ = ("uuid", "name", "description", "tags", "state", "node_uuid", "mem", "num_vcpu", "machine_type",
+                 "source_uuid", "snap_count", "block_devs")
+    fields = ("uuid", "name", "description", "tags", "state", "nodeUUID", "mem", "numVCPU", "machineType",
+              "sourceVirDomainUUID", "snapUUIDs") + tuple("blockDevs." + field for field in BlockDev.fields)
+
+    disk_types = ("VIRTIO_DISK", "IDE_DISK")
+
+    def __init__(self, uuid: str, name: str, description: str = None, tags: tuple = (), state: str = None,
+                 node_uuid: str = None, mem: int = None, num_vcpu: int = None, machine_type: str = None,
+                 source_uuid: str = None, snap_count: int = None, block_devs: tuple = ()):
+        self.uuid = uuid
+        self.name = name
+        self.description = description
+        self.tags = tags
+        self.state = state
+        self.node_uuid = node_uuid
+        self.mem = mem
+        self.num_vcpu = num_vcpu
+        self.machine_type = machine_type
+        self.source_uuid = source_uuid
+        self.snap_count = snap_count
+        self.block_devs = block_devs
+
+    @classmethod
+    def from_json(cls, data: dict) -> "Vm":
+        tags = data.get("tags")
+        snapshots = data.get("snapUUIDs")
+        return cls(data.get("uuid"),
+                   data.get("name"),
+                   data.get("description"),
+                   tuple(tag for tag in tags.split(",") if tag) if tags is not None else (),
+                   data.get("state"),
+                   data.get("nodeUUID"),
+                   data.get("mem"),
+                   data.get("numVCPU"),
+                   data.get("machineType"),
+                   data.get("sourceVirDomainUUID"),
+                   len(snapshots) if snapshots is not None else None,
+                   tuple(BlockDev.from_json(disk) for disk in data.get("blockDevs", ())))
+
+    @property
+    def disks(self) -> list:
+        return [disk for disk in self.block_devs if disk.type in self.disk_types]
+
+    @property
+    def is_replica(self) -> bool:
+        return bool(self.source_uuid)
+
+    def __repr__(self) -> str:
+        return f'Vm({self.uuid!r}, {self.name!r})'
+
+
+class Node:
+    """
+    A cluster node, from /rest/v1/Node
+
+    mem_free is memSize minus totalMemUsageBytes, what is left for running more vms on the node.
+
+    :example:
+    >>> nodes = [Node.from_json(node) for node in sc_get_all_nodeinfo(session, host)]
+    >>> max(nodes, key=lambda node: node.mem_free).lan_ip
+    '10.0.0.3'
+    """
+
+    __slots__ = ("uuid", "lan_ip", "backplane_ip", "capacity", "mem_size", "mem_usage", "mem_usage_pct", "cpu_usage",
+                 "cpu_hz", "num_sockets", "num_cores", "num_threads")
+    fields = ("uuid", "lanIP", "backplaneIP", "capacity", "memSize", "totalMemUsageBytes", "memUsagePercentage",
+              "cpuUsage", "CPUhz", "numSockets", "numCores", "numThreads")
+
+    def __init__(self, uuid: str, lan_ip: str, backplane_ip: str = None, capacity: int = None, mem_size: int = None,
+                 mem_usage: int = None, mem_usage_pct: float = None, cpu_usage: float = None, cpu_hz: int = None,
+                 num_sockets: int = None, num_cores: int = None, num_threads: int = None):
+        self.uuid = uuid
+        self.lan_ip = lan_ip
+        self.backplane_ip = backplane_ip
+        self.capacity = capacity
+        self.mem_size = mem_size
+        self.mem_usage = mem_usage
+        self.mem_usage_pct = mem_usage_pct
+        self.cpu_usage = cpu_usage
+        self.cpu_hz = cpu_hz
+        self.num_sockets = num_sockets
+        self.num_cores = num_cores
+        self.num_threads = num_threads
+
+    @classmethod
+    def from_json(cls, data: dict) -> "Node":
+        return cls(*(data.get(field) for field in cls.fields))
+
+    @property
+    def mem_free(self) -> int:
+        return self.mem_size - self.mem_usage
+
+    def __repr__(self) -> str:
+        return f'Node({self.uuid!r}, {self.lan_ip!r})'
+
+
+class VmStatsSample:
+    """
+    One measurement of a vm, from /rest/v1/VirDomainStats
+
+    disk_rates is a tuple with per disk a tuple (disk uuid, reads per second, writes per second, mean read latency
+    microseconds, mean write latency microseconds). The API reports the rates as milli-operations, they are converted
+    to operations per second here.
+
+    :example:
+    >>> sample = VmStatsSample.from_json(client.get_json("VirDomainStats/" + vm.uuid, session)[0])
+    >>> sample.cpu_usage
+    12.5
+    """
+
+    __slots__ = ("uuid", "cpu_usage", "rx_bit_rate", "tx_bit_rate", "disk_rates")
+    fields = ("uuid", "cpuUsage", "rxBitRate", "txBitRate", "vsdStats.uuid", "vsdStats.rates")
+
+    def __init__(self, uuid: str, cpu_usage: float, rx_bit_rate: float = None, tx_bit_rate: float = None,
+                 disk_rates: tuple = ()):
+        self.uuid = uuid
+        self.cpu_usage = cpu_usage
+        self.rx_bit_rate = rx_bit_rate
+        self.tx_bit_rate = tx_bit_rate
+        self.disk_rates = disk_rates
+
+    @classmethod
+    def from_json(cls, data: dict) -> "VmStatsSample":
+        disk_rates = []
+        for disk in data.get("vsdStats", ()):
+            if disk.get("rates"):
+                rates = disk["rates"][0]
+                disk_rates.append((disk["uuid"],
+                                   rates["millireadsPerSecond"] / 1000,
+                                   rates["milliwritesPerSecond"] / 1000,
+                                   rates["meanReadLatencyMicroseconds"],
+                                   rates["meanWriteLatencyMicroseconds"]))
+        return cls(data.get("uuid"), data.get("cpuUsage"), data.get("rxBitRate"), data.get("txBitRate"),
+                   tuple(disk_rates))
+
+    def __repr__(self) -> str:
+        return f'VmStatsSample({self.uuid!r}, {self.cpu_usage!r})'
+
+
+if __name__ == "__main__":
+    print("This script was never intended to be run directly. Feel free to do so, but a more elegant way would be to import it"
+          " as a module into your own code.")
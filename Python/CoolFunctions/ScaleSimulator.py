@@ -0,0 +1,478 @@
+#!/usr/bin/env python3
+
+"""
+
+Local HTTPS stand-in for the hypercore REST API, for testing and benchmarking the scripts without a cluster.
+
+It implements the endpoints used in this repo on a synthetic cluster: login/logout, VirDomain, VirDomain/<uuid>
+(including clone, export and DELETE), VirDomain/action (LIVEMIGRATE), VirDomainBlockDevice clone and DELETE, Node, VirDomainStats, VirDomainSnapshot and
+TaskTag. Cluster size, latency per
+request, task duration and error rates can be configured. Tasks (snapshots, vm updates, clones) complete after
+task_seconds, exports after export_seconds.
+
+The node certificate is self-signed and generated with the openssl binary, just like the real nodes the scripts talk
+to with verify=False.
+
+Usage as a module:
+>>> with ScaleSimulator(vm_count=500, latency=0.005) as sim:
+...     session = sc.sc_login("admin", "admin", sim.node)
+
+Usage from the command line (runs until ctrl-c):
+python3 ScaleSimulator.py [vm count] [latency in seconds]
+
+dependencies: openssl binary on the path
+
+"""
+
+import itertools
+import json
+import os
+import random
+import ssl
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+class ClusterState:
+    """
+    The synthetic cluster served by the simulator
+
+    :param vm_count: number of vms.
+    :type vm_count: int
+    :param node_count: number of nodes.
+    :type node_count: int
+    :param seed: seed for the random data, the same seed gives the same cluster.
+    :type seed: int
+    """
+
+    def __init__(self, vm_count: int = 100, node_count: int = 3, seed: int = 0):
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+        self.sessions = set()
+        self.tasks = {}
+        self.task_counter = itertools.count(1)
+        self.snapshots = {}
+
+        self.nodes = []
+        for number in range(node_count):
+            self.nodes.append({
+                "uuid": str(uuid.UUID(int=self.random.getrandbits(128))),
+                "lanIP": "10.0.0." + str(number + 1),
+                "backplaneIP": "10.1.0." + str(number + 1),
+                "capacity": 8 * 1000**4,
+                "memSize": 512 * 1024**3,
+                "totalMemUsageBytes": 64 * 1024**3,
+                "memUsagePercentage": 12.5,
+                "cpuUsage": 10.0,
+                "CPUhz": 2400000000,
+                "numSockets": 2,
+                "numCores": 32,
+                "numThreads": 64,
+                "drives": [{"disks": {"scribe": {"capacityBytes": 2 * 1000**4, "usedBytes": 500 * 1000**3}}}
+                           for _ in range(4)],
+            })
+
+        self.vms = {}
+        tags = ["linux", "windows", "prod", "test", "backup", "SnapMeScript"]
+        for number in range(vm_count):
+            vm_uuid = str(uuid.UUID(int=self.random.getrandbits(128)))
+            disks = [{
+                "uuid": str(uuid.UUID(int=self.random.getrandbits(128))),
+                "type": "VIRTIO_DISK",
+                "capacity": 100 * 1000**3,
+                "allocation": self.random.randint(1, 100) * 1000**3,
+            } for _ in range(self.random.randint(1, 3))]
+            disks.append({"uuid": str(uuid.UUID(int=self.random.getrandbits(128))), "type": "IDE_CDROM",
+                          "capacity": 0, "allocation": 0})
+            self.vms[vm_uuid] = {
+                "uuid": vm_uuid,
+                "name": "vm" + str(number).zfill(5),
+                "description": "",
+                "tags": ",".join(self.random.sample(tags, self.random.randint(0, 3))),
+                "state": self.random.choice(["RUNNING", "RUNNING", "RUNNING", "SHUTOFF"]),
+                "nodeUUID": self.nodes[number % node_count]["uuid"],
+                "mem": self.random.choice([2, 4, 8, 16]) * 1024**3,
+                "numVCPU": self.random.choice([1, 2, 4, 8]),
+                "machineType": "scale-7.2",
+                "sourceVirDomainUUID": "",
+                "snapUUIDs": [],
+                "blockDevs": disks,
+                "netDevs": [{"uuid": str(uuid.UUID(int=self.random.getrandbits(128))), "type": "VIRTIO"}],
+            }
+
+    def new_task(self, task_seconds: float, task_error_rate: float) -> str:
+        with self.lock:
+            task_tag = str(next(self.task_counter))
+            state = "ERROR" if self.random.random() < task_error_rate else "COMPLETE"
+            self.tasks[task_tag] = (time.time() + task_seconds, state)
+        return task_tag
+
+    def task_state(self, task_tag: str) -> str:
+        done, state = self.tasks.get(task_tag, (0, "COMPLETE"))
+        return state if time.time() >= done else "RUNNING"
+
+    def vm_stats(self, vm: dict) -> dict:
+        return {
+            "uuid": vm["uuid"],
+            "cpuUsage": self.random.uniform(0, 100) if vm["state"] == "RUNNING" else 0.0,
+            "rxBitRate": self.random.uniform(0, 10**8),
+            "txBitRate": self.random.uniform(0, 10**8),
+            "vsdStats": [{"uuid": disk["uuid"], "rates": [{
+                "millireadsPerSecond": self.random.randint(0, 10**6),
+                "milliwritesPerSecond": self.random.randint(0, 10**6),
+                "meanReadLatencyMicroseconds": self.random.randint(50, 5000),
+                "meanWriteLatencyMicroseconds": self.random.randint(50, 5000),
+            }]} for disk in vm["blockDevs"] if disk["type"] != "IDE_CDROM"],
+        }
+
+
+class SimulatorHandler(BaseHTTPRequestHandler):
+    # keep-alive needs HTTP/1.1, and without disabling nagle every response waits for a delayed ack
+    protocol_version = "HTTP/1.1"
+    disable_nagle_algorithm = True
+
+    # set per server by ScaleSimulator
+    simulator = None
+    node_index = 0
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send(self, status: int, body, cookie: str = None) -> None:
+        data = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        if cookie is not None:
+            self.send_header("Set-Cookie", "sessionID=" + cookie + "; Path=/; Secure; HttpOnly")
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _body(self):
+        length = int(self.headers.get("Content-Length") or 0)
+        return json.loads(self.rfile.read(length)) if length else None
+
+    def _authorized(self) -> bool:
+        cookie = self.headers.get("Cookie") or ""
+        session = cookie.split("sessionID=", 1)[1].split(";", 1)[0] if "sessionID=" in cookie else None
+        return session in self.simulator.state.sessions
+
+    def _handle(self, method: str) -> None:
+        sim = self.simulator
+        state = sim.state
+        body = self._body()
+        path = self.path.split("?", 1)[0]
+        if not path.startswith("/rest/v1/"):
+            return self._send(404, {"error": "not found"})
+        parts = [part for part in path[len("/rest/v1/"):].split("/") if part]
+
+        with state.lock:
+            sim.request_count += 1
+            endpoint = parts[0] if parts else ""
+            sim.endpoint_counts[endpoint] = sim.endpoint_counts.get(endpoint, 0) + 1
+            sim.node_counts[self.node_index] += 1
+        if self.node_index in sim.down_nodes:
+            # like a rebooting node: the connection drops without an answer
+            self.close_connection = True
+            return
+        latency = sim.latency + sim.node_latency.get(self.node_index, 0.0)
+        if latency:
+            time.sleep(latency)
+
+        if parts == ["login"] and method == "POST":
+            if not body or body.get("username") != sim.username or body.get("password") != sim.password:
+                return self._send(401, {"error": "login failed"})
+            session = str(uuid.uuid4())
+            with state.lock:
+                state.sessions.add(session)
+            return self._send(200, {}, cookie=session)
+
+        if not self._authorized():
+            return self._send(401, {"error": "not logged in"})
+
+        if parts == ["logout"] and method == "POST":
+            cookie = self.headers.get("Cookie")
+            with state.lock:
+                state.sessions.discard(cookie.split("sessionID=", 1)[1].split(";", 1)[0])
+            return self._send(200, {})
+
+        if sim.error_rate and state.random.random() < sim.error_rate:
+            return self._send(500, {"error": "simulated internal error"})
+
+        match method, parts:
+            case "GET", ["VirDomain"]:
+                return self._send(200, list(state.vms.values()))
+            case "GET", ["VirDomain", vm_uuid]:
+                vm = state.vms.get(vm_uuid)
+                return self._send(200, [vm]) if vm else self._send(404, {"error": "no such vm"})
+            case "POST", ["VirDomain", "action"]:
+                for action in body or []:
+                    vm = state.vms.get(action.get("virDomainUUID"))
+                    nodes = {snode["uuid"]: snode for snode in state.nodes}
+                    if action.get("actionType") != "LIVEMIGRATE" or vm is None or action.get("nodeUUID") not in nodes:
+                        return self._send(400, {"error": "only LIVEMIGRATE of a known vm to a known node is simulated"})
+                    with state.lock:
+                        # the memory of the vm moves along with it
+                        for node_uuid, delta in ((vm["nodeUUID"], -vm["mem"]), (action["nodeUUID"], vm["mem"])):
+                            if node_uuid in nodes and vm["state"] == "RUNNING":
+                                nodes[node_uuid]["totalMemUsageBytes"] += delta
+                                nodes[node_uuid]["memUsagePercentage"] = round(
+                                    nodes[node_uuid]["totalMemUsageBytes"] / nodes[node_uuid]["memSize"] * 100, 2)
+                        vm["nodeUUID"] = action["nodeUUID"]
+                        sim.migrations.append((vm["uuid"], action["nodeUUID"], time.time()))
+                return self._send(200, {"taskTag": state.new_task(sim.task_seconds, sim.task_error_rate),
+                                        "createdUUID": ""})
+            case "POST", ["VirDomain", vm_uuid]:
+                vm = state.vms.get(vm_uuid)
+                if vm is None:
+                    return self._send(404, {"error": "no such vm"})
+                with state.lock:
+                    vm.update({key: value for key, value in (body or {}).items() if key in vm})
+                return self._send(200, {"taskTag": state.new_task(sim.task_seconds, sim.task_error_rate),
+                                        "createdUUID": ""})
+            case "DELETE", ["VirDomain", vm_uuid]:
+                with state.lock:
+                    vm = state.vms.pop(vm_uuid, None)
+                    if vm is not None:
+                        for snap_uuid in vm["snapUUIDs"]:
+                            state.snapshots.pop(snap_uuid, None)
+                if vm is None:
+                    return self._send(404, {"error": "no such vm"})
+                return self._send(200, {"taskTag": state.new_task(sim.task_seconds, sim.task_error_rate),
+                                        "createdUUID": ""})
+            case "POST", ["VirDomain", vm_uuid, "clone"]:
+                vm = state.vms.get(vm_uuid)
+                if vm is None:
+                    return self._send(404, {"error": "no such vm"})
+                template = (body or {}).get("template", {})
+                clone_uuid = str(uuid.uuid4())
+                with state.lock:
+                    state.vms[clone_uuid] = dict(vm, uuid=clone_uuid, name=template.get("name", vm["name"] + "-clone"),
+                                                 tags=template.get("tags", vm["tags"]), state="SHUTOFF",
+                                                 sourceVirDomainUUID="", snapUUIDs=[],
+                                                 blockDevs=[dict(disk, uuid=str(uuid.uuid4())) for disk in vm["blockDevs"]])
+                return self._send(200, {"taskTag": state.new_task(sim.task_seconds, sim.task_error_rate),
+                                        "createdUUID": clone_uuid})
+            case "POST", ["VirDomain", vm_uuid, "export"]:
+                if vm_uuid not in state.vms:
+                    return self._send(404, {"error": "no such vm"})
+                target = (body or {}).get("target", {})
+                if not target.get("pathURI"):
+                    return self._send(400, {"error": "target.pathURI is required"})
+                started = time.time()
+                with state.lock:
+                    sim.exports.append({"vmUUID": vm_uuid, "pathURI": target["pathURI"],
+                                        "snapUUID": body.get("snapUUID"), "started": started,
+                                        "done": started + sim.export_seconds})
+                return self._send(200, {"taskTag": state.new_task(sim.export_seconds, sim.task_error_rate),
+                                        "createdUUID": ""})
+            case "GET", ["Node"]:
+                return self._send(200, state.nodes)
+            case "GET", ["VirDomainStats"]:
+                return self._send(200, [state.vm_stats(vm) for vm in state.vms.values()])
+            case "GET", ["VirDomainStats", vm_uuid]:
+                vm = state.vms.get(vm_uuid)
+                return self._send(200, [state.vm_stats(vm)]) if vm else self._send(404, {"error": "no such vm"})
+            case "GET", ["VirDomainSnapshot"]:
+                return self._send(200, list(state.snapshots.values()))
+            case "POST", ["VirDomainSnapshot"]:
+                vm = state.vms.get((body or {}).get("domainUUID"))
+                if vm is None:
+                    return self._send(400, {"error": "no such vm"})
+                snap_uuid = str(uuid.uuid4())
+                with state.lock:
+                    state.snapshots[snap_uuid] = {"uuid": snap_uuid, "domainUUID": vm["uuid"],
+                                                  "label": body.get("label", ""), "type": "USER",
+                                                  "timestamp": int(time.time()),
+                                                  "domain": {"name": vm["name"], "tags": vm["tags"],
+                                                             "blockDevs": [dict(disk) for disk in vm["blockDevs"]]}}
+                    vm["snapUUIDs"].append(snap_uuid)
+                return self._send(200, {"taskTag": state.new_task(sim.task_seconds, sim.task_error_rate),
+                                        "createdUUID": snap_uuid})
+            case "GET", ["VirDomainSnapshot", snap_uuid]:
+                snapshot = state.snapshots.get(snap_uuid)
+                return self._send(200, [snapshot]) if snapshot else self._send(404, {"error": "no such snapshot"})
+            case "POST", ["VirDomainBlockDevice", disk_uuid, "clone"]:
+                template = (body or {}).get("template", {})
+                snapshot = state.snapshots.get((body or {}).get("snapUUID"))
+                target = state.vms.get(template.get("virDomainUUID"))
+                if snapshot is None or target is None or disk_uuid not in [disk["uuid"] for disk in snapshot["domain"]["blockDevs"]]:
+                    return self._send(400, {"error": "no such snapshot, disk or target vm"})
+                clone_uuid = str(uuid.uuid4())
+                with state.lock:
+                    target["blockDevs"].append({"uuid": clone_uuid, "type": template.get("type", "VIRTIO_DISK"),
+                                                "capacity": template.get("capacity", 0), "allocation": 0})
+                return self._send(200, {"taskTag": state.new_task(sim.task_seconds, sim.task_error_rate),
+                                        "createdUUID": clone_uuid})
+            case "DELETE", ["VirDomainBlockDevice", disk_uuid]:
+                with state.lock:
+                    for vm in state.vms.values():
+                        if any(disk["uuid"] == disk_uuid for disk in vm["blockDevs"]):
+                            vm["blockDevs"] = [disk for disk in vm["blockDevs"] if disk["uuid"] != disk_uuid]
+                            break
+                    else:
+                        vm = None
+                if vm is None:
+                    return self._send(404, {"error": "no such disk"})
+                return self._send(200, {"taskTag": state.new_task(sim.task_seconds, sim.task_error_rate),
+                                        "createdUUID": ""})
+            case "DELETE", ["VirDomainSnapshot", snap_uuid]:
+                with state.lock:
+                    snapshot = state.snapshots.pop(snap_uuid, None)
+                    if snapshot is not None and snap_uuid in state.vms.get(snapshot["domainUUID"], {}).get("snapUUIDs", []):
+                        state.vms[snapshot["domainUUID"]]["snapUUIDs"].remove(snap_uuid)
+                if snapshot is None:
+                    return self._send(404, {"error": "no such snapshot"})
+                return self._send(200, {"taskTag": state.new_task(sim.task_seconds, sim.task_error_rate),
+                                        "createdUUID": ""})
+            case "GET", ["TaskTag", task_tag]:
+                return self._send(200, [{"taskTag": task_tag, "state": state.task_state(task_tag),
+                                         "progressPercent": 100 if state.task_state(task_tag) != "RUNNING" else 50}])
+
+        return self._send(404, {"error": "not implemented in the simulator"})
+
+    def do_GET(self):
+        self._handle("GET")
+
+    def do_POST(self):
+        self._handle("POST")
+
+    def do_DELETE(self):
+        self._handle("DELETE")
+
+
+class ScaleSimulator:
+    """
+    Run a simulated cluster on 127.0.0.1 with a random free port
+
+    With serve_nodes every node of the cluster gets its own listener on 127.0.0.<n> (same port), and the lanIP in Node
+    is that address, so clients can spread requests over the nodes. node_latency adds extra seconds per node index to
+    make a single node slow, node indexes in down_nodes drop every connection, node_counts counts the requests per node.
+    Every export request is recorded in exports, with its vm, pathURI and the time it started and completes, every live
+    migration in migrations as (vm uuid, node uuid, time).
+
+    :example:
+    >>> with ScaleSimulator(vm_count=1000, latency=0.002, task_seconds=0.5) as sim:
+    ...     session = sc.sc_login("admin", "admin", sim.node)
+    ...     print(sim.request_count)
+
+    :param vm_count: number of vms in the cluster.
+    :type vm_count: int
+    :param node_count: number of nodes in the cluster.
+    :type node_count: int
+    :param latency: seconds every request is delayed before it is answered.
+    :type latency: float
+    :param task_seconds: seconds before a task (snapshot, vm update, ...) is reported COMPLETE.
+    :type task_seconds: float
+    :param export_seconds: seconds before an export task is reported COMPLETE, defaults to task_seconds.
+    :type export_seconds: float
+    :param error_rate: fraction of requests (apart from login/logout) answered with a 500 error.
+    :type error_rate: float
+    :param task_error_rate: fraction of tasks that end in the ERROR state.
+    :type task_error_rate: float
+    :param username: username accepted by the login endpoint.
+    :type username: str
+    :param password: password accepted by the login endpoint.
+    :type password: str
+    :param seed: seed for the random data.
+    :type seed: int
+    :param serve_nodes: serve every node on its own loopback address.
+    :type serve_nodes: bool
+    """
+
+    def __init__(self, vm_count: int = 100, node_count: int = 3, latency: float = 0.0, task_seconds: float = 1.0,
+                 error_rate: float = 0.0, task_error_rate: float = 0.0, username: str = "admin",
+                 password: str = "admin", seed: int = 0, serve_nodes: bool = False, export_seconds: float = None):
+        self.state = ClusterState(vm_count, node_count, seed)
+        self.serve_nodes = serve_nodes
+        self.node_latency = {}
+        self.down_nodes = set()
+        self.node_counts = [0] * node_count
+        self.servers = []
+        self.latency = latency
+        self.task_seconds = task_seconds
+        self.export_seconds = task_seconds if export_seconds is None else export_seconds
+        self.exports = []
+        self.migrations = []
+        self.error_rate = error_rate
+        self.task_error_rate = task_error_rate
+        self.username = username
+        self.password = password
+        self.request_count = 0
+        self.endpoint_counts = {}
+        self.server = None
+        self.node = None
+
+    def start(self) -> str:
+        """
+        Start serving in a background thread and return the "ip:port" to use as node.
+        """
+
+        with tempfile.TemporaryDirectory() as workdir:
+            cert = os.path.join(workdir, "cert.pem")
+            key = os.path.join(workdir, "key.pem")
+            subprocess.run(["openssl", "req", "-x509", "-newkey", "rsa:2048", "-nodes", "-days", "1",
+                            "-subj", "/CN=localhost", "-keyout", key, "-out", cert],
+                           check=True, capture_output=True)
+            context = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+            context.load_cert_chain(cert, key)
+
+        port = 0
+        for index in range(len(self.state.nodes) if self.serve_nodes else 1):
+            handler = type("Handler", (SimulatorHandler,), {"simulator": self, "node_index": index})
+            server = ThreadingHTTPServer(("127.0.0." + str(index + 1), port), handler)
+            server.daemon_threads = True
+            # the handshake is done lazily in the handler thread, otherwise every new connection waits in the accept loop
+            server.socket = context.wrap_socket(server.socket, server_side=True, do_handshake_on_connect=False)
+            threading.Thread(target=server.serve_forever, daemon=True).start()
+            port = server.server_address[1]
+            self.servers.append(server)
+            if self.serve_nodes:
+                self.state.nodes[index]["lanIP"] = "127.0.0." + str(index + 1)
+        self.server = self.servers[0]
+        self.node = "127.0.0.1:" + str(port)
+        return self.node
+
+    def stop(self) -> None:
+        """
+        Stop serving.
+        """
+
+        for server in self.servers:
+            server.shutdown()
+            server.server_close()
+        self.servers = []
+        self.server = None
+
+    def reset_counters(self) -> None:
+        """
+        Set the request counters back to zero.
+        """
+
+        with self.state.lock:
+            self.request_count = 0
+            self.endpoint_counts = {}
+            self.node_counts = [0] * len(self.node_counts)
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.stop()
+
+
+if __name__ == "__main__":
+    sim = ScaleSimulator(vm_count=int(sys.argv[1]) if len(sys.argv) > 1 else 100,
+                         latency=float(sys.argv[2]) if len(sys.argv) > 2 else 0.0)
+    print(f'simulated cluster listening on https://{sim.start()}/rest/v1/ (login admin / admin), ctrl-c to stop')
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        sim.stop()
@@ -0,0 +1,209 @@
+import os
+import threading
+import time
+from collections import namedtuple
+
+# Request instrumentation for ScaleFunctions and ScaleAsyncFunctions.
+#
+# Every API request made by a ScaleClient / AsyncScaleClient is counted per cluster, node, endpoint, method and HTTP
+# status, and its duration goes into a latency histogram. sc_wait_for_task and TaskWatcher add the time spent waiting
+# on tasks. Everything is kept in memory in the module level metrics object; openmetrics() turns it into the
+# Prometheus / OpenMetrics text format and hot_paths() lists where the time went. Hooks get every event as it happens,
+# for sending them on to another system.
+#
+# Endpoints are reduced to their first path part (VirDomain/<uuid> counts as VirDomain) to keep the number of series
+# bounded.
+
+# A single measured event, handed to the hooks. kind is "request" or "task_wait". For task waits endpoint is the task
+# tag and status the final state (COMPLETE, ERROR, TIMEOUT).
+MetricEvent = namedtuple("MetricEvent", ["kind", "cluster", "node", "method", "endpoint", "status", "seconds"])
+
+REQUEST_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+TASK_BUCKETS = (1.0, 2.0, 5.0, 10.0, 30.0, 60.0, 120.0, 300.0, 600.0, 1800.0, 3600.0)
+
+
+def endpoint_name(endpoint: str) -> str:
+    """
+    The part of an endpoint used as label, "VirDomain/1234" -> "VirDomain".
+    """
+
+    return endpoint.split('/', 1)[0].split('?', 1)[0] or "/"
+
+
+def _escape(value) -> str:
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _labels(names: tuple, values: tuple, extra: str = None) -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra is not None:
+        pairs.append(extra)
+    return '{' + ','.join(pairs) + '}'
+
+
+class _Histogram:
+    __slots__ = ("counts", "total", "count")
+
+    def __init__(self, buckets: tuple):
+        self.counts = [0] * len(buckets)
+        self.total = 0.0
+        self.count = 0
+
+    def observe(self, buckets: tuple, seconds: float) -> None:
+        for index, bound in enumerate(buckets):
+            if seconds <= bound:
+                self.counts[index] += 1
+                break
+        self.total += seconds
+        self.count += 1
+
+
+class RequestMetrics:
+    """
+    Counters and latency histograms for API requests and task waits
+
+    ScaleFunctions and ScaleAsyncFunctions report into the shared module level instance ScaleTelemetry.metrics, set
+    metrics.enabled = False to switch the bookkeeping off.
+
+    :example:
+    >>> from ScaleTelemetry import metrics
+    >>> sc_snapshot_by_tag("SnapMeScript", "nightly", session, host)
+    >>> print(metrics.openmetrics())
+    >>> metrics.hot_paths(5)
+    [{'cluster': '192.168.0.1', 'method': 'POST', 'endpoint': 'VirDomainSnapshot', 'requests': 25, 'seconds': 3.2, ...}]
+    >>> metrics.add_hook(lambda event: print(event.endpoint, event.seconds))
+    """
+
+    def __init__(self):
+        self.enabled = True
+        self.hooks = []
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self) -> None:
+        """
+        Forget everything measured so far.
+        """
+
+        with self._lock:
+            self.started = time.time()
+            self.requests = {}
+            self.latency = {}
+            self.task_waits = {}
+
+    def add_hook(self, hook) -> None:
+        """
+        Call hook(event) with a MetricEvent for every request and task wait. A hook that raises is removed.
+        """
+
+        self.hooks.append(hook)
+
+    def remove_hook(self, hook) -> None:
+        if hook in self.hooks:
+            self.hooks.remove(hook)
+
+    def _emit(self, event: MetricEvent) -> None:
+        for hook in list(self.hooks):
+            try:
+                hook(event)
+            except Exception:
+                self.remove_hook(hook)
+
+    def observe_request(self, cluster: str, node: str, method: str, endpoint: str, status, seconds: float) -> None:
+        """
+        Record one API request. status is the HTTP status code, or None when there was no response.
+        """
+
+        if not self.enabled:
+            return
+        endpoint = endpoint_name(endpoint)
+        status = str(status) if status is not None else "error"
+        with self._lock:
+            key = (cluster, node, method, endpoint, status)
+            self.requests[key] = self.requests.get(key, 0) + 1
+            key = (cluster, method, endpoint)
+            histogram = self.latency.get(key)
+            if histogram is None:
+                histogram = self.latency[key] = _Histogram(REQUEST_BUCKETS)
+            histogram.observe(REQUEST_BUCKETS, seconds)
+        if self.hooks:
+            self._emit(MetricEvent("request", cluster, node, method, endpoint, status, seconds))
+
+    def observe_task_wait(self, cluster: str, task_tag: str, state: str, seconds: float) -> None:
+        """
+        Record how long was waited on a task and how it ended.
+        """
+
+        if not self.enabled:
+            return
+        with self._lock:
+            key = (cluster, state)
+            histogram = self.task_waits.get(key)
+            if histogram is None:
+                histogram = self.task_waits[key] = _Histogram(TASK_BUCKETS)
+            histogram.observe(TASK_BUCKETS, seconds)
+        if self.hooks:
+            self._emit(MetricEvent("task_wait", cluster, cluster, None, task_tag, state, seconds))
+
+    def hot_paths(self, limit: int = 10) -> list:
+        """
+        The endpoints that took the most time, as dicts with cluster, method, endpoint, requests, seconds and mean.
+        """
+
+        with self._lock:
+            paths = [{"cluster": cluster, "method": method, "endpoint": endpoint, "requests": histogram.count,
+                      "seconds": round(histogram.total, 4), "mean": round(histogram.total / histogram.count, 4)}
+                     for (cluster, method, endpoint), histogram in self.latency.items() if histogram.count]
+        return sorted(paths, key=lambda path: path["seconds"], reverse=True)[:limit]
+
+    def openmetrics(self) -> str:
+        """
+        Everything measured so far in the OpenMetrics text format (also read by Prometheus).
+        """
+
+        lines = []
+        with self._lock:
+            lines.append('# TYPE scale_api_requests counter')
+            lines.append('# HELP scale_api_requests Hypercore API requests by cluster, node, method, endpoint and status.')
+            for key, count in sorted(self.requests.items()):
+                lines.append('scale_api_requests_total' +
+                             _labels(("cluster", "node", "method", "endpoint", "status"), key) + ' ' + str(count))
+
+            for name, help_text, label_names, histograms, buckets in (
+                    ("scale_api_request_seconds", "Hypercore API request duration in seconds.",
+                     ("cluster", "method", "endpoint"), self.latency, REQUEST_BUCKETS),
+                    ("scale_task_wait_seconds", "Seconds spent waiting on hypercore tasks, by final state.",
+                     ("cluster", "state"), self.task_waits, TASK_BUCKETS)):
+                lines.append(f'# TYPE {name} histogram')
+                lines.append(f'# UNIT {name} seconds')
+                lines.append(f'# HELP {name} {help_text}')
+                for key, histogram in sorted(histograms.items()):
+                    cumulative = 0
+                    for bound, count in zip(buckets, histogram.counts):
+                        cumulative += count
+                        lines.append(name + '_bucket' + _labels(label_names, key, f'le="{bound}"') + ' ' +
+                                     str(cumulative))
+                    lines.append(name + '_bucket' + _labels(label_names, key, 'le="+Inf"') + ' ' + str(histogram.count))
+                    lines.append(name + '_count' + _labels(label_names, key) + ' ' + str(histogram.count))
+                    lines.append(name + '_sum' + _labels(label_names, key) + ' ' + repr(round(histogram.total, 6)))
+        lines.append('# EOF')
+        return '\n'.join(lines) + '\n'
+
+    def dump(self, path: str) -> None:
+        """
+        Write openmetrics() to a file, through a temporary file so a reader never sees half of it.
+        """
+
+        temporary = path + '.tmp'
+        with open(temporary, 'w') as f:
+            f.write(self.openmetrics())
+        os.replace(temporary, path)
+
+
+# the instance all clients report into
+metrics = RequestMetrics()
+
+
+if __name__ == "__main__":
+    print("This script was never intended to be run directly. Feel free to do so, but a more elegant way would be to import it"
+          " as a module into your own code.")
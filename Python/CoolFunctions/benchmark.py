@@ -0,0 +1,227 @@
+#!/usr/bin/env python3
+
+"""
+
+Benchmark suite for ScaleFunctions and the SCinventory perf cycle, run against the local ScaleSimulator.
+
+Cases:
+    connection    calls per second with a fresh requests.request per call versus the pooled ScaleClient
+    uuid_lookup   sc_get_uuid by vm name for every vm, served from the inventory with max_age
+    tag_snapshot  snapshot all vms with a tag, serial and with 16 in flight, then wait for all the tasks
+    tag_change    add a tag to every vm in a tag group, one sc_change_tag per vm and with sc_change_tags_bulk
+    snapshot_prune  plan and run a keep-last-1 retention over three snapshots per vm in a tag group, serial and with 16
+                  in flight
+    export        clone, export and clean up every vm in a tag group, one vm at a time (like the PowerShell scripts)
+                  and through the ExportPipeline (8 clones, 2 exports per SMB server)
+    perf_cycle    one SCinventory measurement: VirDomainStats for every vm plus the perf derivations
+
+Every case reports wall time, throughput and the number of API requests it made. The results are appended to a
+JSON file (one entry per run, with the git commit) so regressions are visible between runs.
+
+Usage: python3 benchmark.py [--vms 1000] [--latency 0.02] [--cases tag_snapshot,perf_cycle] [--out results.json]
+       [--no-rate-limit] [--metrics metrics.txt]
+
+dependencies: requests, openssl binary on the path (numpy for the vectorized perf_cycle)
+
+"""
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+import ScaleFunctions as sc
+from ScaleExport import ExportPipeline
+from ScaleSimulator import ScaleSimulator
+from ScaleTelemetry import metrics
+
+CASES = ("connection", "uuid_lookup", "tag_snapshot", "tag_change", "snapshot_prune", "export", "perf_cycle")
+
+
+def measure(sim: ScaleSimulator, function, operations: int) -> dict:
+    sim.reset_counters()
+    start = time.perf_counter()
+    function()
+    wall = time.perf_counter() - start
+    return {
+        "wall_seconds": round(wall, 4),
+        "operations": operations,
+        "ops_per_second": round(operations / wall, 2) if wall else None,
+        "requests": sim.request_count,
+    }
+
+
+def case_connection(sim: ScaleSimulator, session: dict) -> dict:
+    calls = 200
+    api_virdomain = 'https://' + sim.node + '/rest/v1/Node/'
+
+    def per_call():
+        for _ in range(calls):
+            json.loads(requests.request("GET", api_virdomain, headers=session, verify=False).text)
+
+    def pooled():
+        for _ in range(calls):
+            sc.sc_get_all_nodeinfo(session, sim.node)
+
+    return {"per_call": measure(sim, per_call, calls), "pooled": measure(sim, pooled, calls)}
+
+
+def case_uuid_lookup(sim: ScaleSimulator, session: dict) -> dict:
+    names = [vm["name"] for vm in sim.state.vms.values()]
+    sc.sc_invalidate_inventory(sim.node)
+
+    def lookup():
+        for name in names:
+            sc.sc_get_uuid("vm", name, session, sim.node, max_age=60)
+
+    return {"cached_inventory": measure(sim, lookup, len(names))}
+
+
+def case_tag_snapshot(sim: ScaleSimulator, session: dict) -> dict:
+    tag = "linux"
+    results = {}
+    task_tags = []
+    for label, in_flight in (("serial", 1), ("parallel_16", 16)):
+        sc.sc_invalidate_inventory(sim.node)
+        tagged = len(sc.sc_get_by_tag(tag, session, sim.node))
+
+        def snapshot():
+            result = sc.sc_snapshot_by_tag(tag, "benchmark", session, sim.node, max_in_flight=in_flight)
+            task_tags[:] = [r["taskTag"] for r in result.values() if r["taskTag"]]
+
+        results[label] = measure(sim, snapshot, tagged)
+
+    results["wait_all"] = measure(sim, lambda: sc.sc_wait_for_tasks(session, task_tags, 600, sim.node), len(task_tags))
+    return results
+
+
+def case_tag_change(sim: ScaleSimulator, session: dict) -> dict:
+    tag = "test"
+    sc.sc_invalidate_inventory(sim.node)
+    uuids = list(sc.sc_get_by_tag(tag, session, sim.node).values())
+
+    def retag():
+        for vm_uuid in uuids:
+            sc.sc_change_tag("uuid", vm_uuid, "add", "benchmark", session, sim.node)
+
+    def retag_bulk():
+        sc.sc_change_tags_bulk(tag, "add", "benchmark_bulk", session, sim.node, max_in_flight=16)
+
+    return {"sc_change_tag": measure(sim, retag, len(uuids)), "bulk_16": measure(sim, retag_bulk, len(uuids))}
+
+
+def case_snapshot_prune(sim: ScaleSimulator, session: dict) -> dict:
+    tag = "backup"
+    policy = {"keep_last": 1, "label": "^prune"}
+    results = {}
+    for label, in_flight in (("dry_run", 0), ("serial", 1), ("parallel_16", 16)):
+        sc.sc_invalidate_inventory(sim.node)
+        for number in range(3):
+            sc.sc_snapshot_by_tag(tag, "prune" + str(number), session, sim.node, max_in_flight=16)
+        deletes = [entry for entry in sc.sc_plan_snapshot_pruning(list(sim.state.snapshots.values()), policy).values()
+                   if entry["action"] == "delete"]
+        results[label] = measure(sim, lambda: sc.sc_prune_snapshots(policy, session, sim.node, dry_run=not in_flight,
+                                                                    max_in_flight=in_flight), len(deletes))
+        sc.sc_prune_snapshots({"keep_last": 0, "label": "^prune"}, session, sim.node, dry_run=False, max_in_flight=16)
+    return results
+
+
+def case_export(sim: ScaleSimulator, session: dict) -> dict:
+    tag = "backup"
+    target = {"server": "fileserver", "path": "/exports", "domain": "bench", "username": "bench", "password": "bench"}
+    sc.sc_invalidate_inventory(sim.node)
+    inventory = sc.sc_get_inventory(session, sim.node)
+    vms = inventory.tagged_vms(tag)
+    results = {}
+    for label, limits in (("one_at_a_time", (1, 1, 1)), ("pipelined", (8, 2, 8))):
+        pipeline = ExportPipeline(session, sim.node, target, clone_in_flight=limits[0], export_in_flight=limits[1],
+                                  cleanup_in_flight=limits[2], poll_interval=0.1, progress_interval=0)
+        results[label] = measure(sim, lambda: pipeline.run(vms), len(vms))
+        results[label]["stages"] = pipeline.summary()["stages"]
+    return results
+
+
+def case_perf_cycle(sim: ScaleSimulator, session: dict) -> dict:
+    sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "VMList"))
+    try:
+        import ScaleMetrics
+    except ImportError:
+        ScaleMetrics = None
+
+    client = sc.sc_get_client(sim.node)
+    vms = sc.sc_get_all_vminfo(session, sim.node)
+    nodes = sc.sc_get_all_nodeinfo(session, sim.node)
+    index = ScaleMetrics.VmPerfIndex(vms, nodes) if ScaleMetrics else None
+
+    def cycle():
+        with ThreadPoolExecutor(max_workers=8) as collector:
+            stats = list(collector.map(lambda vm: client.get_json('VirDomainStats/' + vm["uuid"], session), vms))
+        if index is not None:
+            ScaleMetrics.vm_rows(int(time.time()), index, ScaleMetrics.compute_vm_metrics(index, stats))
+        client.get_json('Node/', session)
+
+    result = measure(sim, cycle, len(vms))
+    result["vectorized"] = index is not None
+    return {"one_cycle": result}
+
+
+def git_commit() -> str:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip() or None
+    except OSError:
+        return None
+
+
+def run(vm_count: int, latency: float, task_seconds: float, cases: list) -> dict:
+    run_result = {
+        "timestamp": int(time.time()),
+        "commit": git_commit(),
+        "vms": vm_count,
+        "latency": latency,
+        "task_seconds": task_seconds,
+        "rate_limits": sc.rate_limits,
+        "cases": {},
+    }
+    with ScaleSimulator(vm_count=vm_count, latency=latency, task_seconds=task_seconds) as sim:
+        session = sc.sc_login("admin", "admin", sim.node)
+        for case in cases:
+            run_result["cases"][case] = globals()["case_" + case](sim, session)
+            for variant, result in run_result["cases"][case].items():
+                print(f'{case:<13} {variant:<17} {result["wall_seconds"]:>9.3f}s {result["ops_per_second"] or 0:>10.1f} ops/s '
+                      f'{result["requests"]:>7} requests')
+        sc.sc_logout(session, sim.node)
+    return run_result
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="benchmark ScaleFunctions against the local simulator")
+    parser.add_argument("--vms", type=int, default=500, help="number of vms in the simulated cluster")
+    parser.add_argument("--latency", type=float, default=0.02, help="seconds of latency per request")
+    parser.add_argument("--task-seconds", type=float, default=0.5, help="seconds before a task completes")
+    parser.add_argument("--cases", default=",".join(CASES), help="comma separated cases to run")
+    parser.add_argument("--out", default="benchmark_results.json", help="JSON file the results are appended to")
+    parser.add_argument("--no-rate-limit", action="store_true", help="run without the client side RateLimiter")
+    parser.add_argument("--metrics", help="write the request metrics of the whole run to this file (OpenMetrics text)")
+    args = parser.parse_args()
+    if args.no_rate_limit:
+        sc.rate_limits = None
+
+    result = run(args.vms, args.latency, args.task_seconds, [case for case in args.cases.split(",") if case])
+
+    history = []
+    if os.path.exists(args.out):
+        with open(args.out) as f:
+            history = json.load(f)
+    history.append(result)
+    with open(args.out, "w") as f:
+        json.dump(history, f, indent=2)
+    print(f'results appended to {args.out}')
+    if args.metrics:
+        metrics.dump(args.metrics)
+        print(f'request metrics written to {args.metrics}')
@@ -0,0 +1,103 @@
+#!/usr/bin/env python3
+
+"""
+
+Benchmark for decoding a large VirDomain response: json.loads on the whole body (what sc_get_all_vminfo did) against
+sc_iter_json, which decodes the body while it streams in and keeps only vm_summary_fields.
+
+The body is a synthetic 5000 vm VirDomain list from the ScaleSimulator cluster, padded with the fields a real
+hypercore VirDomain entry carries (snapshot uuids, full blockDevs and netDevs, stats, ...). It is fed to sc_iter_json
+in 64 KiB chunks, as requests hands it over. Peak memory is measured with tracemalloc in a separate pass, so it does
+not slow down the timed rounds.
+
+Usage: python3 benchmark_json.py [vm count]
+
+dependencies: requests (imported by ScaleFunctions)
+
+"""
+
+import json
+import sys
+import time
+import tracemalloc
+import uuid
+
+import ScaleFunctions as sc
+from ScaleSimulator import ClusterState
+
+ROUNDS = 5
+
+
+def realistic_body(vm_count: int) -> bytes:
+    state = ClusterState(vm_count=vm_count, seed=vm_count)
+    vms = []
+    for vm in state.vms.values():
+        vm = dict(vm)
+        vm["snapUUIDs"] = [str(uuid.UUID(int=state.random.getrandbits(128))) for _ in range(state.random.randint(0, 30))]
+        vm["blockDevs"] = [dict(disk, virDomainUUID=vm["uuid"], cacheMode="WRITETHROUGH", slot=slot, disableSnapshotting=False,
+                                tieringPriorityFactor=8, mountPoints=[], readOnly=False, path="scribe/" + disk["uuid"],
+                                createdTimestamp=1690000000, name="", shareUUID="", snapshotAllocationBlocks=0)
+                           for slot, disk in enumerate(vm["blockDevs"])]
+        vm["netDevs"] = [dict(net, virDomainUUID=vm["uuid"], vlan=0, macAddress="7C:4C:58:12:34:56", connected=True,
+                              ipv4Addresses=["10.10.0." + str(state.random.randint(2, 254))]) for net in vm["netDevs"]]
+        vm.update({
+            "operatingSystem": "os_other", "bootDevices": [disk["uuid"] for disk in vm["blockDevs"][:1]],
+            "uiState": "RUNNING", "lastSeenRunningOnNodeUUID": vm["nodeUUID"], "affinityStrategy": {
+                "strictAffinity": False, "preferredNodeUUID": "", "backupNodeUUID": ""},
+            "snapshotScheduleUUID": "", "replicationUUIDs": [], "created": 1690000000, "latestTaskTag": {
+                "taskTag": "1234", "progressPercent": 100, "state": "COMPLETE", "formattedDescription": "Update VM",
+                "descriptionParameters": [vm["name"]], "formattedMessage": "", "messageParameters": [],
+                "objectUUID": vm["uuid"], "created": 1690000000, "modified": 1690000000, "completed": 1690000000},
+            "console": {"type": "VNC", "ip": "10.0.0.1", "port": 5900, "password": "", "keymap": "en-us"},
+            "cloudInitData": {"userData": "", "metaData": ""}, "cpuType": "clusterBaseline-7.3",
+            "snapshotSerialNumber": len(vm["snapUUIDs"]), "vsdStats": [],
+        })
+        vms.append(vm)
+    return json.dumps(vms).encode()
+
+
+def chunked(body: bytes, size: int = 65536):
+    return (body[i:i + size] for i in range(0, len(body), size))
+
+
+def full_decode(body: bytes) -> list:
+    # what requests + json.loads(response.text) does: the whole text, then the whole tree
+    return json.loads(body.decode())
+
+
+def streamed_decode(body: bytes) -> list:
+    return list(sc.sc_iter_json(chunked(body), sc.vm_summary_fields))
+
+
+def measure(function, body: bytes) -> tuple:
+    start = time.perf_counter()
+    for _ in range(ROUNDS):
+        result = function(body)
+    seconds = (time.perf_counter() - start) / ROUNDS
+    del result
+
+    tracemalloc.start()
+    result = function(body)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return result, seconds * 1000, peak / 1024**2
+
+
+if __name__ == "__main__":
+    vm_count = int(sys.argv[1]) if len(sys.argv) > 1 else 5000
+    body = realistic_body(vm_count)
+    print(f'{vm_count} vms, {len(body) / 1024**2:.1f} MiB body')
+    print(f'{"decoder":<10} {"ms":>9} {"peak MiB":>9} {"kept MiB":>9}')
+    full, full_ms, full_peak = measure(full_decode, body)
+    streamed, streamed_ms, streamed_peak = measure(streamed_decode, body)
+    for label, ms, peak, result in (("json.loads", full_ms, full_peak, full),
+                                    ("streamed", streamed_ms, streamed_peak, streamed)):
+        tracemalloc.start()
+        kept = json.loads(json.dumps(result))
+        kept_mib = tracemalloc.get_traced_memory()[0] / 1024**2
+        tracemalloc.stop()
+        del kept
+        print(f'{label:<10} {ms:>9.1f} {peak:>9.1f} {kept_mib:>9.1f}')
+    same = all(vm["name"] == kept["name"] and vm["blockDevs"][0]["uuid"] == kept["blockDevs"][0]["uuid"]
+               for vm, kept in zip(full, streamed))
+    print(f'same vms: {same and len(full) == len(streamed)}')
@@ -0,0 +1,114 @@
+#!/usr/bin/env python3
+
+"""
+
+Benchmark for the slotted record types (ScaleRecords.py) against the raw API dicts.
+
+Uses the same synthetic 5000 vm VirDomain body as benchmark_json.py and reports:
+
+    memory     what stays resident: the full decoded dicts, the dicts projected to Vm.fields, and Vm records
+    hot loop   a typical per vm walk (state, memory, disk types and capacity), over dicts and over records
+    stats      one perf cycle worth of VirDomainStats: walking the raw dicts versus building VmStatsSample records
+
+Usage: python3 benchmark_records.py [vm count]
+
+dependencies: requests (imported by ScaleFunctions)
+
+"""
+
+import json
+import random
+import sys
+import time
+import tracemalloc
+
+import ScaleFunctions as sc
+from ScaleRecords import Vm, VmStatsSample
+from benchmark_json import chunked, realistic_body
+
+ROUNDS = 20
+
+
+def resident(function) -> tuple:
+    tracemalloc.start()
+    result = function()
+    size = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    return result, size / 1024**2
+
+
+def timed(function, *args) -> float:
+    start = time.perf_counter()
+    for _ in range(ROUNDS):
+        function(*args)
+    return (time.perf_counter() - start) / ROUNDS * 1000
+
+
+def walk_dicts(vms: list) -> int:
+    total = 0
+    for vm in vms:
+        if vm["state"] == "RUNNING":
+            total += vm["mem"]
+            for disk in vm["blockDevs"]:
+                if disk["type"] in ("VIRTIO_DISK", "IDE_DISK"):
+                    total += disk["capacity"]
+    return total
+
+
+def walk_records(vms: list) -> int:
+    total = 0
+    for vm in vms:
+        if vm.state == "RUNNING":
+            total += vm.mem
+            for disk in vm.block_devs:
+                if disk.type in ("VIRTIO_DISK", "IDE_DISK"):
+                    total += disk.capacity
+    return total
+
+
+def stats_dicts(stat_responses: list) -> float:
+    total = 0.0
+    for stat in stat_responses:
+        total += stat["cpuUsage"]
+        for disk in stat["vsdStats"]:
+            rates = disk["rates"][0]
+            total += rates["millireadsPerSecond"] / 1000 + rates["milliwritesPerSecond"] / 1000
+    return total
+
+
+def stats_records(stat_responses: list) -> float:
+    total = 0.0
+    for sample in map(VmStatsSample.from_json, stat_responses):
+        total += sample.cpu_usage
+        for disk_uuid, reads, writes, read_latency, write_latency in sample.disk_rates:
+            total += reads + writes
+    return total
+
+
+if __name__ == "__main__":
+    vm_count = int(sys.argv[1]) if len(sys.argv) > 1 else 5000
+    body = realistic_body(vm_count)
+
+    full, full_mib = resident(lambda: json.loads(body))
+    projected, projected_mib = resident(lambda: list(sc.sc_iter_json(chunked(body), Vm.fields)))
+    records, records_mib = resident(lambda: [Vm.from_json(vm) for vm in sc.sc_iter_json(chunked(body), Vm.fields)])
+    print(f'{vm_count} vms resident: full dicts {full_mib:.1f} MiB, Vm.fields dicts {projected_mib:.1f} MiB, '
+          f'Vm records {records_mib:.1f} MiB ({records_mib * 1024**2 / vm_count:.0f} bytes per vm)')
+
+    assert walk_dicts(full) == walk_records(records)
+    dict_ms = timed(walk_dicts, full)
+    record_ms = timed(walk_records, records)
+    print(f'hot loop: dicts {dict_ms:.2f} ms, records {record_ms:.2f} ms ({dict_ms / record_ms:.2f}x)')
+
+    rng = random.Random(vm_count)
+    stat_responses = json.loads(json.dumps([{
+        "uuid": vm["uuid"], "cpuUsage": rng.uniform(0, 100), "rxBitRate": rng.uniform(0, 10**8),
+        "txBitRate": rng.uniform(0, 10**8), "vsdStats": [{"uuid": disk["uuid"], "rates": [{
+            "millireadsPerSecond": rng.randint(0, 10**6), "milliwritesPerSecond": rng.randint(0, 10**6),
+            "meanReadLatencyMicroseconds": rng.randint(50, 5000), "meanWriteLatencyMicroseconds": rng.randint(50, 5000)
+        }]} for disk in vm["blockDevs"] if disk["type"] != "IDE_CDROM"]} for vm in full]))
+    samples, samples_mib = resident(lambda: [VmStatsSample.from_json(stat) for stat in stat_responses])
+    stats_json_mib = resident(lambda: json.loads(json.dumps(stat_responses)))[1]
+    print(f'stats cycle: dicts walk {timed(stats_dicts, stat_responses):.2f} ms, records build+walk '
+          f'{timed(stats_records, stat_responses):.2f} ms, resident {stats_json_mib:.1f} MiB dicts vs '
+          f'{samples_mib:.1f} MiB records')
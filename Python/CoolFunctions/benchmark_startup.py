@@ -0,0 +1,86 @@
+#!/usr/bin/env python3
+
+"""
+
+Cold start benchmark for the scale command line (scale.py).
+
+Every case is started as a new python process, the median wall time of --runs runs is reported:
+
+    python        an empty interpreter, the floor nothing can go below
+    scale --help  parsing the command line only, must stay close to the floor
+    bad argument  an argument error, also without importing ScaleFunctions
+    ScaleFunctions  importing ScaleFunctions (requests, urllib3), what every command that talks to a cluster adds
+    login-check   a full login-check against the local ScaleSimulator, with the cached session of the run before
+
+It also checks that importing scale.py does not import requests, and lists the slowest imports of scale --help
+(python -X importtime).
+
+Usage: python3 benchmark_startup.py [--runs 20]
+
+dependencies: requests and the openssl binary for the login-check case (ScaleSimulator)
+
+"""
+
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+
+def started(command: list, runs: int, env: dict = None) -> float:
+    times = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        subprocess.run(command, cwd=HERE, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        times.append(time.perf_counter() - start)
+    return statistics.median(times) * 1000
+
+
+def slowest_imports(command: list, limit: int) -> list:
+    output = subprocess.run([sys.executable, "-X", "importtime"] + command, cwd=HERE, capture_output=True,
+                            text=True).stderr
+    imports = []
+    for line in output.splitlines():
+        if line.startswith("import time:") and "|" in line and "cumulative" not in line:
+            self_us, cumulative_us, name = (part.strip() for part in line[len("import time:"):].split("|"))
+            imports.append((int(cumulative_us), name.strip()))
+    return sorted(imports, reverse=True)[:limit]
+
+
+if __name__ == "__main__":
+    arguments = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    arguments.add_argument("--runs", type=int, default=20)
+    options = arguments.parse_args()
+
+    lazy = subprocess.run([sys.executable, "-c", "import sys, scale; print('requests' in sys.modules)"], cwd=HERE,
+                          capture_output=True, text=True).stdout.strip()
+    print(f'requests imported by "import scale": {lazy}')
+
+    results = {
+        "python": started([sys.executable, "-c", "pass"], options.runs),
+        "scale --help": started([sys.executable, "scale.py", "--help"], options.runs),
+        "bad argument": started([sys.executable, "scale.py", "no-such-command"], options.runs),
+        "ScaleFunctions": started([sys.executable, "-c", "import ScaleFunctions"], options.runs),
+    }
+
+    try:
+        from ScaleSimulator import ScaleSimulator
+    except ImportError as e:
+        print(f'login-check skipped: {e}')
+    else:
+        with ScaleSimulator(vm_count=50) as sim, tempfile.TemporaryDirectory() as directory:
+            env = dict(os.environ, SCALE_NODE=sim.node, SCALE_USERNAME="admin", SCALE_PASSWORD="admin",
+                       SCALE_SESSION_CACHE=os.path.join(directory, "session"))
+            results["login-check"] = started([sys.executable, "scale.py", "login-check"], options.runs, env)
+
+    for name, milliseconds in results.items():
+        print(f'{name:<16} {milliseconds:7.1f} ms  (+{milliseconds - results["python"]:.1f} ms over python)')
+
+    print('slowest imports of scale --help:')
+    for cumulative_us, name in slowest_imports(["scale.py", "--help"], 5):
+        print(f'    {name:<24} {cumulative_us / 1000:6.1f} ms')
@@ -0,0 +1,272 @@
+#!/usr/bin/env python3
+
+"""
+
+One command line entry point for the everyday ScaleFunctions jobs, meant to be started often from cron and monitoring.
+
+Subcommands:
+    login-check   log in and read the nodes, exits 1 when the cluster can not be reached or the login fails
+    inventory     list the vms (optionally only those with a tag) or, with --nodes, the nodes
+    snapshot      snapshot a vm by name or uuid, or every vm with a tag, optionally waiting for the tasks
+    tag           add, remove, group by or set the tags of vms selected by tag or by name
+    wait          wait for task tags to complete
+    collect       read the stats of all vms and nodes, once or every --interval seconds
+
+The cluster and credentials come from --node / --username or the SCALE_NODE, SCALE_USERNAME and SCALE_PASSWORD
+environment variables, the password is asked for when it is not set and a terminal is attached. Every run logs in
+and out, unless --session-cache (or SCALE_SESSION_CACHE) names a file to keep the session cookie in (see
+ScaleSession): back to back runs then skip the login, and the session is logged out once it is too old to be reused.
+
+Only the standard library modules needed to parse the command line are imported at the top. ScaleFunctions, and
+with it requests and urllib3, is imported once a subcommand actually talks to the cluster, so --help and argument
+errors return right away. See benchmark_startup.py.
+
+With --json the result is written to stdout as JSON (collect writes one JSON object per measurement per line), the
+progress lines of the sc_* functions go to stderr.
+
+Usage: python3 scale.py [--node 192.168.0.1] [--json] <subcommand> [options]
+       python3 scale.py snapshot --tag SnapMeScript --label nightly --wait
+       python3 scale.py --json inventory --tag linux
+       python3 scale.py --session-cache ~/.scale_session login-check
+
+The script is not packaged, it runs from a checkout next to ScaleFunctions.py. Python looks for the imports in the
+directory of the script (symlinks resolved), so it can be started from anywhere with its path, or put on the PATH
+with a symlink, e.g. ln -s "$PWD/scale.py" ~/bin/scale.
+
+dependencies: requests (imported by ScaleFunctions, only when a subcommand runs)
+
+"""
+
+import argparse
+import json
+import os
+import sys
+import time
+
+EXIT_OK = 0
+EXIT_FAILED = 1
+
+
+def _sc():
+    # the heavy import, only done by the subcommands that need it
+    import ScaleFunctions
+    return ScaleFunctions
+
+
+def _session(args):
+    if not args.node:
+        raise Exception('no node given, use --node or set SCALE_NODE')
+    sc = _sc()
+    password = os.environ.get("SCALE_PASSWORD")
+    if password is None:
+        if not sys.stdin.isatty():
+            raise Exception('no password given, set SCALE_PASSWORD')
+        import getpass
+        password = getpass.getpass(f'password for {args.username}@{args.node}: ')
+    cache_file = None if args.no_session_cache else args.session_cache
+    return sc.ScaleSession(args.username, password, args.node, cache_file=cache_file)
+
+
+def _output(args, result, lines) -> None:
+    if args.json:
+        json.dump(result, sys.stdout, separators=(',', ':') if args.compact else None, indent=None if args.compact else 2)
+        sys.stdout.write('\n')
+    else:
+        for line in lines:
+            print(line)
+    sys.stdout.flush()
+
+
+def _progress():
+    # the sc_* functions print their progress, keep stdout for the result
+    from contextlib import redirect_stdout
+    return redirect_stdout(sys.stderr)
+
+
+def cmd_login_check(args) -> int:
+    sc = _sc()
+    start = time.perf_counter()
+    session = _session(args)
+    with session as api_headers:
+        nodes = sc.sc_get_all_nodeinfo(api_headers, args.node, fields=("uuid", "lanIP"))
+    result = {"node": args.node, "ok": True, "nodes": [snode["lanIP"] for snode in nodes],
+              "relogins": session.relogins, "seconds": round(time.perf_counter() - start, 3)}
+    _output(args, result, [f'{args.node} - login ok, {len(nodes)} nodes, {result["seconds"]}s'])
+    return EXIT_OK
+
+
+def cmd_inventory(args) -> int:
+    sc = _sc()
+    with _session(args) as api_headers:
+        if args.nodes:
+            nodes = sc.sc_get_all_nodeinfo(api_headers, args.node, fields=(
+                "uuid", "lanIP", "memSize", "totalMemUsageBytes", "cpuUsage", "numCores"))
+            _output(args, nodes, [f'{snode["lanIP"]}  {snode["uuid"]}  cpu {snode["cpuUsage"]:.1f}%  mem '
+                                  f'{snode["totalMemUsageBytes"] / 1024**3:.1f}/{snode["memSize"] / 1024**3:.1f} GiB'
+                                  for snode in nodes])
+            return EXIT_OK
+        vms = sc.sc_get_all_vminfo(api_headers, args.node, fields=(
+            "uuid", "name", "state", "nodeUUID", "tags", "mem", "numVCPU"))
+    if args.tag:
+        vms = [vm for vm in vms if args.tag in vm["tags"].split(",")]
+    vms.sort(key=lambda vm: vm["name"])
+    _output(args, vms, [f'{vm["name"]}  {vm["uuid"]}  {vm["state"]}  {vm["tags"]}' for vm in vms])
+    return EXIT_OK
+
+
+def cmd_snapshot(args) -> int:
+    sc = _sc()
+    with _session(args) as api_headers, _progress():
+        if args.tag:
+            result = sc.sc_snapshot_by_tag(args.tag, args.label, api_headers, args.node, args.in_flight)
+        else:
+            vm_uuid = args.uuid or sc.sc_get_uuid("vm", args.vm, api_headers, args.node)
+            if vm_uuid is None:
+                raise Exception(f'vm name {args.vm} could not be found on the targeted cluster')
+            response = sc.sc_snapshot("uuid", vm_uuid, args.label, api_headers, args.node)
+            result = {vm_uuid: {"name": args.vm, "taskTag": response["taskTag"], "error": None}}
+        if args.wait:
+            tags = [entry["taskTag"] for entry in result.values() if entry["taskTag"]]
+            done = sc.sc_wait_for_tasks(api_headers, tags, args.timeout, args.node)
+            for entry in result.values():
+                if entry["taskTag"]:
+                    entry["complete"] = done.get(entry["taskTag"])
+    failed = [entry for entry in result.values() if entry["error"] or entry.get("complete", True) is not True]
+    _output(args, result, [f'{entry["name"] or vm_uuid} - {entry["error"] or "task " + str(entry["taskTag"])}'
+                           + ('' if "complete" not in entry else f', complete: {entry["complete"]}')
+                           for vm_uuid, entry in result.items()])
+    return EXIT_FAILED if failed else EXIT_OK
+
+
+def cmd_tag(args) -> int:
+    sc = _sc()
+    selector = args.tag if args.tag else args.vms
+    with _session(args) as api_headers, _progress():
+        report = sc.sc_change_tags_bulk(selector, args.method, args.tags, api_headers, args.node, args.in_flight)
+        if args.wait:
+            tags = [entry["taskTag"] for entry in report.values() if entry["taskTag"]]
+            done = sc.sc_wait_for_tasks(api_headers, tags, args.timeout, args.node)
+            for entry in report.values():
+                if entry["taskTag"] and done.get(entry["taskTag"]) is not True:
+                    entry["status"] = "error"
+                    entry["error"] = f'task {entry["taskTag"]} did not complete'
+    _output(args, report, [f'{entry["name"]} - {entry["status"]}: {entry["old"]!r} -> {entry["new"]!r}'
+                           + (f' ({entry["error"]})' if entry["error"] else '') for entry in report.values()])
+    return EXIT_FAILED if any(entry["status"] == "error" for entry in report.values()) else EXIT_OK
+
+
+def cmd_wait(args) -> int:
+    sc = _sc()
+    with _session(args) as api_headers:
+        done = sc.sc_wait_for_tasks(api_headers, args.task_tags, args.timeout, args.node)
+    states = {True: "complete", False: "error", None: "timeout"}
+    _output(args, {task_tag: states[value] for task_tag, value in done.items()},
+            [f'{task_tag} - {states[value]}' for task_tag, value in done.items()])
+    return EXIT_OK if all(value is True for value in done.values()) else EXIT_FAILED
+
+
+def _measurement(sc, api_headers, node: str, names: dict) -> dict:
+    nodes = sc.sc_get_all_nodeinfo(api_headers, node, fields=(
+        "uuid", "lanIP", "cpuUsage", "memUsagePercentage", "totalMemUsageBytes"))
+    vms = []
+    for sample in sc.sc_get_all_vmstats(api_headers, node, records=True):
+        vms.append({"uuid": sample.uuid, "name": names.get(sample.uuid), "cpuUsage": sample.cpu_usage,
+                    "rxBitRate": sample.rx_bit_rate, "txBitRate": sample.tx_bit_rate,
+                    "readIOPS": sum(disk[1] for disk in sample.disk_rates),
+                    "writeIOPS": sum(disk[2] for disk in sample.disk_rates)})
+    return {"time": int(time.time()), "vms": vms, "nodes": nodes}
+
+
+def cmd_collect(args) -> int:
+    sc = _sc()
+    with _session(args) as api_headers:
+        names = {vm["uuid"]: vm["name"] for vm in sc.sc_get_all_vminfo(api_headers, args.node, fields=("uuid", "name"))}
+        for count in range(args.count):
+            if count:
+                time.sleep(max(0.0, next_cycle - time.time()))
+            next_cycle = time.time() + args.interval
+            measurement = _measurement(sc, api_headers, args.node, names)
+            if args.json:
+                # one object per line, so a consumer can read the measurements as they come
+                sys.stdout.write(json.dumps(measurement, separators=(',', ':')) + '\n')
+                sys.stdout.flush()
+            else:
+                _output(args, measurement, [f'{measurement["time"]} {vm["name"]}  cpu {vm["cpuUsage"]:.1f}%  '
+                                            f'read {vm["readIOPS"]:.0f} iops  write {vm["writeIOPS"]:.0f} iops'
+                                            for vm in measurement["vms"]])
+    return EXIT_OK
+
+
+def parser() -> argparse.ArgumentParser:
+    main_parser = argparse.ArgumentParser(prog="scale", description="Scale Computing HyperCore command line.")
+    main_parser.add_argument("--node", default=os.environ.get("SCALE_NODE"),
+                             help="IP address or FQDN of any node of the cluster (SCALE_NODE)")
+    main_parser.add_argument("--username", default=os.environ.get("SCALE_USERNAME", "admin"),
+                             help="HyperCore username (SCALE_USERNAME), the password is read from SCALE_PASSWORD")
+    main_parser.add_argument("--session-cache", default=os.environ.get("SCALE_SESSION_CACHE"),
+                             help="file to keep the session cookie in between runs, by default every run logs in and "
+                                  "out (SCALE_SESSION_CACHE)")
+    main_parser.add_argument("--no-session-cache", action="store_true",
+                             help="ignore --session-cache / SCALE_SESSION_CACHE and log in and out on this run")
+    main_parser.add_argument("--json", action="store_true", help="write the result to stdout as JSON")
+    main_parser.add_argument("--compact", action="store_true", help="JSON without indentation")
+    subparsers = main_parser.add_subparsers(dest="command", required=True, metavar="command")
+
+    command = subparsers.add_parser("login-check", help="log in and read the nodes")
+    command.set_defaults(function=cmd_login_check)
+
+    command = subparsers.add_parser("inventory", help="list vms or nodes")
+    command.add_argument("--tag", help="only vms with this tag")
+    command.add_argument("--nodes", action="store_true", help="list the nodes instead of the vms")
+    command.set_defaults(function=cmd_inventory)
+
+    command = subparsers.add_parser("snapshot", help="snapshot a vm or every vm with a tag")
+    target = command.add_mutually_exclusive_group(required=True)
+    target.add_argument("--vm", help="name of the vm")
+    target.add_argument("--uuid", help="uuid of the vm")
+    target.add_argument("--tag", help="snapshot every vm with this tag")
+    command.add_argument("--label", default="scripted snapshot", help="snapshot label")
+    command.add_argument("--in-flight", type=int, default=8, help="snapshot requests at the same time for --tag")
+    command.add_argument("--wait", action="store_true", help="wait for the snapshot tasks to complete")
+    command.add_argument("--timeout", type=int, default=3600, help="seconds to wait for the tasks")
+    command.set_defaults(function=cmd_snapshot)
+
+    command = subparsers.add_parser("tag", help="change the tags of vms")
+    command.add_argument("method", choices=("add", "remove", "group", "manual"))
+    command.add_argument("tags", help="tag to add, remove or group by, or the comma delimited list for manual")
+    target = command.add_mutually_exclusive_group(required=True)
+    target.add_argument("--tag", help="change every vm with this tag")
+    target.add_argument("--vms", nargs="+", help="names or uuids of the vms to change")
+    command.add_argument("--in-flight", type=int, default=8, help="tag change requests at the same time")
+    command.add_argument("--wait", action="store_true", help="wait for the tag change tasks to complete")
+    command.add_argument("--timeout", type=int, default=600, help="seconds to wait for the tasks")
+    command.set_defaults(function=cmd_tag)
+
+    command = subparsers.add_parser("wait", help="wait for tasks to complete")
+    command.add_argument("task_tags", nargs="+", metavar="task_tag")
+    command.add_argument("--timeout", type=int, default=3600, help="seconds to wait for the tasks")
+    command.set_defaults(function=cmd_wait)
+
+    command = subparsers.add_parser("collect", help="read the stats of all vms and nodes")
+    command.add_argument("--count", type=int, default=1, help="number of measurements")
+    command.add_argument("--interval", type=float, default=10, help="seconds between the start of two measurements")
+    command.set_defaults(function=cmd_collect)
+    return main_parser
+
+
+def main(argv: list = None) -> int:
+    args = parser().parse_args(argv)
+    try:
+        return args.function(args)
+    except KeyboardInterrupt:
+        return 130
+    except Exception as e:
+        if args.json:
+            json.dump({"command": args.command, "ok": False, "error": str(e)}, sys.stdout)
+            sys.stdout.write('\n')
+        print(f'scale {args.command}: {e}', file=sys.stderr)
+        return EXIT_FAILED
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,156 @@
+#!/usr/bin/env python3
+
+"""
+
+Tests for ScaleFunctions, the ones that need an API run against the local ScaleSimulator.
+
+Usage: python3 -m unittest test_ScaleFunctions (or pytest) from this directory
+
+dependencies: requests and the openssl binary for the ScaleSimulator tests, aiohttp for the ScaleAsyncFunctions ones
+
+"""
+
+import asyncio
+import os
+import tempfile
+import time
+import unittest
+
+import ScaleFunctions as sc
+from ScaleSimulator import ScaleSimulator
+
+try:
+    import ScaleAsyncFunctions as sca
+except ImportError:
+    sca = None
+
+
+class SnapshotPruningTest(unittest.TestCase):
+
+    now = 1700000000
+
+    def snapshots(self, ages: list, label: str = "nightly", tags: str = "") -> list:
+        return [{"uuid": str(number), "domainUUID": "vm", "label": label, "type": "USER", "timestamp": self.now - age,
+                 "domain": {"name": "vm", "tags": tags}} for number, age in enumerate(ages, 1)]
+
+    def kept(self, snapshots: list, policy: dict) -> list:
+        plan = sc.sc_plan_snapshot_pruning(snapshots, policy, self.now)
+        return sorted(snapshot_uuid for snapshot_uuid, entry in plan.items() if entry["action"] == "keep")
+
+    def test_keep_last_is_a_floor_for_max_age(self):
+        # all five are too old, the newest two stay anyway
+        self.assertEqual(self.kept(self.snapshots([1000, 2000, 3000, 4000, 5000]), {"keep_last": 2, "max_age": 500}),
+                         ["1", "2"])
+
+    def test_max_age_applies_beyond_keep_last(self):
+        self.assertEqual(self.kept(self.snapshots([100, 200, 300, 1000, 2000]), {"keep_last": 2, "max_age": 500}),
+                         ["1", "2", "3"])
+
+    def test_keep_last_without_max_age(self):
+        self.assertEqual(self.kept(self.snapshots([100, 200, 300]), {"keep_last": 1}), ["1"])
+
+    def test_no_rule_deletes_nothing(self):
+        self.assertEqual(self.kept(self.snapshots([100, 200, 300]), {}), ["1", "2", "3"])
+
+    def test_label_and_tag_rules(self):
+        # the manual snapshot does not match the label, it is not part of the plan at all
+        snapshots = self.snapshots([100, 200, 300], tags="prod") + [dict(self.snapshots([100], label="manual")[0],
+                                                                         uuid="manual")]
+        plan = sc.sc_plan_snapshot_pruning(snapshots, {"keep_last": 1, "label": "^nightly",
+                                                       "tags": {"prod": {"keep_last": 2}}}, self.now)
+        self.assertEqual(sorted((snapshot_uuid, entry["action"]) for snapshot_uuid, entry in plan.items()),
+                         [("1", "keep"), ("2", "keep"), ("3", "delete")])
+
+
+class ScaleSessionCacheTest(unittest.TestCase):
+
+    def setUp(self):
+        try:
+            self.sim = ScaleSimulator(vm_count=5)
+            self.sim.start()
+        except Exception as e:
+            self.skipTest(f'ScaleSimulator could not start: {e}')
+        self.directory = tempfile.TemporaryDirectory()
+        self.cache_file = os.path.join(self.directory.name, "session")
+
+    def tearDown(self):
+        self.sim.stop()
+        self.directory.cleanup()
+
+    def run_job(self, cache_seconds: float) -> None:
+        with sc.ScaleSession("admin", "admin", self.sim.node, cache_file=self.cache_file,
+                             cache_seconds=cache_seconds) as session:
+            sc.sc_get_all_nodeinfo(session, self.sim.node)
+
+    def test_young_cache_is_reused(self):
+        self.run_job(60)
+        self.run_job(60)
+        self.assertEqual(len(self.sim.state.sessions), 1)
+
+    def test_expired_cache_is_logged_out(self):
+        # every run finds the session of the run before expired, that one has to end on the cluster
+        for _ in range(3):
+            self.run_job(0.2)
+            time.sleep(0.3)
+        self.assertEqual(len(self.sim.state.sessions), 1)
+
+
+class ScaleInventoryTest(unittest.TestCase):
+
+    def setUp(self):
+        try:
+            self.sim = ScaleSimulator(vm_count=20)
+            self.sim.start()
+        except Exception as e:
+            self.skipTest(f'ScaleSimulator could not start: {e}')
+        self.session = sc.ScaleSession("admin", "admin", self.sim.node)
+        self.inventory = sc.ScaleInventory(self.session.login(), self.sim.node, ttl=60)
+
+    def tearDown(self):
+        self.session.logout()
+        self.sim.stop()
+
+    def test_lookups_return_copies(self):
+        vm = next(iter(self.sim.state.vms.values()))
+        tag = next(tag for vm in self.sim.state.vms.values() for tag in vm["tags"].split(",") if tag)
+
+        self.inventory.vm(vm["uuid"])["name"] = "changed"
+        self.inventory.tagged(tag).clear()
+        self.inventory.on_node(vm["nodeUUID"]).clear()
+        self.inventory.tagged_vms(tag)[0]["name"] = "changed"
+
+        self.assertEqual(self.inventory.vm(vm["uuid"])["name"], vm["name"])
+        self.assertTrue(self.inventory.tagged(tag))
+        self.assertIn(vm["uuid"], [on_node["uuid"] for on_node in self.inventory.on_node(vm["nodeUUID"])])
+        self.assertNotIn("changed", [tagged["name"] for tagged in self.inventory.tagged_vms(tag)])
+
+
+@unittest.skipIf(sca is None, "aiohttp is not installed")
+class AsyncTaskWaitTest(unittest.IsolatedAsyncioTestCase):
+
+    def setUp(self):
+        try:
+            self.sim = ScaleSimulator(vm_count=5, task_seconds=30)
+            self.sim.start()
+        except Exception as e:
+            self.skipTest(f'ScaleSimulator could not start: {e}')
+
+    def tearDown(self):
+        self.sim.stop()
+
+    async def test_timeout_raises_like_the_sync_version(self):
+        session = await sca.sc_login("admin", "admin", self.sim.node)
+        try:
+            vm_uuid = next(iter(self.sim.state.vms))
+            sctag = (await sca.sc_snapshot("uuid", vm_uuid, "test", session, self.sim.node))["taskTag"]
+            with self.assertRaisesRegex(Exception, "^Timeout for task reached!") as raised:
+                await sca.sc_wait_for_task(session, sctag, 0.1, self.sim.node)
+            self.assertNotIsInstance(raised.exception, asyncio.TimeoutError)
+            self.assertEqual(await sca.sc_wait_for_tasks(session, [sctag], 0.1, self.sim.node), {str(sctag): None})
+        finally:
+            await sca.sc_logout(session, self.sim.node)
+            await sca.sc_close()
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -12,14 +12,28 @@ Usage: Fill out the variables below and run the script.
 William David van Collenburg
 Scale Computing
 
-dependencies: requests, json
+dependencies: requests, json, ScaleWriters.py, ../CoolFunctions/ScaleFunctions.py (optional: numpy for ScaleMetrics.py, pyarrow for parquet/arrow output,
+ScaleExporter.py for the Prometheus exporter mode, ScaleTimeSeries.py for the time series store)
 
 """
 
 # import required modules
 import requests
+import requests.adapters
 import json
+import os
+import signal
+import sys
+import threading
 import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import nullcontext
+
+import ScaleWriters
+
+# sc_iter_json() to read the vm list while it streams in
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "CoolFunctions"))
+from ScaleFunctions import sc_iter_json
 
 # the below module suppresses SSL warnings. It comes without saying that you should not use this. It is in here for educational reasons
 import urllib3
@@ -34,6 +48,17 @@ username = "doademo"              # Scale Computing Hypercore Username with at m
 password = "doademo"              # Scale Computing Hypercore Password
 url = "https://172.16.0.241/"   # URL to cluster
 measure_in_hours = 6
+cycle_seconds = 10                # time between the start of two perf measurements. Stats on cluster are refreshed every 10 seconds
+collector_workers = 8             # number of VirDomainStats requests running at the same time during a perf measurement
+vectorized_metrics = True         # derive the perf values with NumPy (ScaleMetrics.py). Falls back to plain python if numpy is missing
+output_format = "csv"             # "csv", or "parquet" / "arrow" for compressed columnar files (needs pyarrow)
+rotate_megabytes = 0              # start new perf files once they reach this size, 0 to never rotate on size
+rotate_hours = 0                  # start new perf files after this many hours, 0 to never rotate on time
+exporter_port = 0                 # serve the latest measurement on http://<exporter_address>:<port>/metrics for Prometheus instead of writing perf files. 0 to write files
+exporter_address = "127.0.0.1"    # address the exporter listens on, "0.0.0.0" to allow scrapes from other hosts
+timeseries_store = ""             # also keep every measurement in this directory as ring buffers with 1 minute and 1 hour rollups (ScaleTimeSeries.py). "" to not keep them
+timeseries_raw_days = 14          # days of raw measurements kept in the time series store, the rollups are kept for 30 days (1 minute) and 2 years (1 hour)
+vm_refresh_minutes = 10           # read the vm and node lists again every this many minutes during the perf measurements, so new and deleted vms are picked up
 
 # \|||||||||||||||||||||||||||||||||||||||||||||||||||||||||||||||||||||||||||||||||||||||||||||||||/ #
 # -   You should not have to change anything below this point for the script to work as designed.   - #
@@ -57,8 +82,12 @@ api_headers = {
     'Content-Type': 'application/json'
 }
 
+# one session with a connection pool, so the stats requests reuse connections instead of doing a TLS handshake per request
+http = requests.Session()
+http.mount('https://', requests.adapters.HTTPAdapter(pool_maxsize=collector_workers))
+
 # logging in
-login_response = requests.request("POST", 
+login_response = http.request("POST", 
                                   api_login,
                                   headers=api_headers,
                                   data=login_payload,
@@ -67,153 +96,283 @@ login_response = requests.request("POST",
 
 # update api_headers to include the cookie with the sessionID in it
 api_headers['Cookie'] = 'sessionID={0}'.format(login_response.cookies.get('sessionID'))
+http.cookies.clear()
+
+# Ctrl-C (or a SIGTERM from a service manager) ends the script after the current step or measurement, so we still log out
+stop = threading.Event()
+signal.signal(signal.SIGINT, lambda signum, frame: stop.set())
+signal.signal(signal.SIGTERM, lambda signum, frame: stop.set())
+
+# The perf measurements below run for hours, so decode the vms while the body streams in and keep only the fields this
+# script uses. A full VirDomain entry also carries every netDev, snapshot and blockDev detail.
+virdomain_fields = ("uuid", "name", "state", "numVCPU", "mem", "snapUUIDs", "machineType", "sourceVirDomainUUID",
+                    "nodeUUID", "blockDevs.uuid", "blockDevs.type", "blockDevs.capacity", "blockDevs.allocation")
 
-# get the virdomain list - the list all generic info on vm's
-virdomain_response = requests.request("GET",
+# get the virdomain list - the list all generic info on vm's. The measurements read it again now and then (see below).
+def get_virdomains():
+    virdomain_response = http.request("GET",
                                       api_virdomain,
                                       headers=api_headers,
-                                      verify=False
-)
+                                      verify=False,
+                                      stream=True
+    )
+    try:
+        return list(sc_iter_json(virdomain_response.iter_content(65536), virdomain_fields, virdomain_response.encoding))
+    finally:
+        virdomain_response.close()
 
-# dump the json output into a dict. Later on in this script i have done this in a single command.
-virdomain_json = json.loads(virdomain_response.text)
+virdomain_json = get_virdomains()
+virdomains_read = time.time()
 
 # now iterate over the array that has just been created and put the vm infos in a .csv
-# using the with open(.... ) statement makes sure we close the file at the end of the with block. No need to manually close.
-with open("vmOverview.csv","w") as f:
-    f.write("vmname,state,VCPUs,RAM,Snapshots,VMType,Location,DriveType1,SizeGB1,AllocatedPct1,DriveType2,SizeGB2,AllocatedPct2\n")
-
+# every row is collected as a list and handed to a buffered writer (ScaleWriters.py) that writes it in one go.
+vm_overview_columns = ["vmname", "state", "VCPUs", "RAM", "Snapshots", "VMType", "Location", "DriveType1", "SizeGB1",
+                       "AllocatedPct1", "DriveType2", "SizeGB2", "AllocatedPct2"]
+vm_overview_types = ["str", "str", "int", "float", "int", "str", "str", "str", "float", "float", "str", "float", "float"]
+with ScaleWriters.open_writer(output_format, "vmOverview", vm_overview_columns, vm_overview_types) as f:
     for vm in virdomain_json:
         if vm['state'] in("RUNNING","SHUTOFF"):
-            api_virdomainstats = prefix + 'VirDomainStats/' + vm['uuid']
-            
-            f.write(vm['name']
-                    + "," + vm['state']
-                    + "," + str(vm['numVCPU'])
-                    + "," + str(vm['mem'] / 1024**3)
-                    + "," + str(len(vm['snapUUIDs']))
-                    + "," + vm['machineType']
-                    )
+            row = [vm['name'], vm['state'], vm['numVCPU'], vm['mem'] / 1024**3, len(vm['snapUUIDs']), vm['machineType']]
             # Fake some disk data because otherwise it will break the grafana interpetation.
             if not vm['sourceVirDomainUUID'] == "":
-                f.write(",REPLICA,NO_DISK,0,0,NO_DISK,0,0")
+                row.extend(("REPLICA", "NO_DISK", 0, 0, "NO_DISK", 0, 0))
             else:
-                f.write(",LOCAL")
+                row.append("LOCAL")
             
             disk_count = 8
             for disk in vm['blockDevs']:
                 if disk['type'] == "VIRTIO_DISK" or disk['type'] == "IDE_DISK": # ugly OR version, cooler OR later in script (if disk in ('comma, delimited, list'))
-                    f.write("," + disk['type'])
-                    f.write("," + str(round(disk['capacity'] / 1000**3, 2)))
-                    f.write("," + str(round(disk['allocation'] / disk['capacity'] * 100, 2)))
+                    row.append(disk['type'])
+                    row.append(round(disk['capacity'] / 1000**3, 2))
+                    row.append(round(disk['allocation'] / disk['capacity'] * 100, 2))
                     disk_count -= 1
             if disk_count == 7: # if there is only 1 disk, fake a seccond because otherwise it will break grafana
-                f.write(",NO_DISK,0,0")
-            f.write("\n")
+                row.extend(("NO_DISK", 0, 0))
+            f.write_row(row)
 
 # Lets do the same for the nodes. Read the /node endpoint, iterate over the nodes and put their infos in a .csv
 # This time i immediately dump the json response in a dict. Important to make sure you end with the .text. if you forget it will store the result (http 200)
-node_response = json.loads(requests.request("GET",
+node_response = json.loads(http.request("GET",
                                       api_node,
                                       headers=api_headers,
                                       verify=False
                                       ).text)
 
-with open("nodeOverview.csv","w") as p:
-    p.write("lanIP,backplaneIP,NodeCapacity,RAMsize,RAMusage,CPUspeed,Sockets,Cores,Threads,NumDrives,DriveSize,DriveUsedPct\n")
+node_overview_columns = ["lanIP", "backplaneIP", "NodeCapacity", "RAMsize", "RAMusage", "CPUspeed", "Sockets", "Cores",
+                         "Threads", "NumDrives", "DriveSize", "DriveUsedPct"]
+node_overview_types = ["str", "str", "float", "float", "float", "float", "int", "int", "int", "int", "float", "float"]
+with ScaleWriters.open_writer(output_format, "nodeOverview", node_overview_columns, node_overview_types) as p:
     for node in node_response:
-        p.write(node['lanIP'])
-        p.write("," + node['backplaneIP'])
-        p.write("," + str(round(node['capacity'] / 1000**3, 2)))
-        p.write("," + str(round(node['memSize'] / 1024**3, 2)))
-        p.write("," + str(round(node['totalMemUsageBytes'] / 1024**3, 2)))
-        p.write("," + str(round(node['CPUhz'] / 1000**3, 2)))
-        p.write("," + str(node['numSockets']))
-        p.write("," + str(node['numCores']))
-        p.write("," + str(node['numThreads']))
-        p.write("," + str(len(node['drives'])))
+        row = [node['lanIP'],
+               node['backplaneIP'],
+               round(node['capacity'] / 1000**3, 2),
+               round(node['memSize'] / 1024**3, 2),
+               round(node['totalMemUsageBytes'] / 1024**3, 2),
+               round(node['CPUhz'] / 1000**3, 2),
+               node['numSockets'],
+               node['numCores'],
+               node['numThreads'],
+               len(node['drives'])]
 
         for disk in node['drives']:
-            p.write("," + str(round(disk['disks']['scribe']['capacityBytes'] / 1000**3, 2)))
-            p.write("," + str(round(disk['disks']['scribe']['usedBytes'] / disk['disks']['scribe']['capacityBytes'] * 100, 2)))
+            row.append(round(disk['disks']['scribe']['capacityBytes'] / 1000**3, 2))
+            row.append(round(disk['disks']['scribe']['usedBytes'] / disk['disks']['scribe']['capacityBytes'] * 100, 2))
         
-        p.write("\n")
+        p.write_row(row)
 
 # Now lets start doing some performance measurements. For this we are going to request data from the API every 10 seconds
 # We need to be carefull with this because we do not want to DDoS our API / GUI. Stats in cluster are refreshed every 10
 # seconds so there is no benefit of polling at a higher frequency. There will be some rapid successive check while iterating.
 
-# Lets open two more files, one with Node performance data, and one with vms performance data.
-with open("nodePerf.csv","w") as np, open("vmPerf.csv","w") as vp:
-    # set headers for both csv files
-    vp.write("epoch,name,numVCPU,cpuPct,cpuGhz,vmGhz,rxBit,txBit,DiskType1,IOPsread1,IOPswrite1,latencyReadUm1,latercyWriteUm1,DiskType2,IOPsread2,IOPswrite2,latencyReadUm2,latercyWriteUm2\n")
-    np.write("lanIP,memSize,totalMemUsageBytes,memUsagePercentage,cpuUsagePct\n")
-
-    # calculate untill which time in epoch we will run (epoch is time measured in seconds)
-    r_until = time.time() + (measure_in_hours * 3600)
-
-    # keep looping until we reach the above calculated time
-    while time.time() < r_until:
-
-        # Next i am going to reuse the earlier virdomain_json to iterate over all vm's, but now to retrieve their perf data
-        now = str(int(time.time())) # I am going to use this data later in grafana so need to strip the decimals (infini plugin doesnt understand decimals)
-        for pvm in virdomain_json:
-            api_virdomainstats = prefix + 'VirDomainStats/' + pvm['uuid']
-            stat_response = json.loads(requests.request("GET",
-                                                        api_virdomainstats,
-                                                        headers=api_headers,
-                                                        verify=False).text)
-            
-            # write data to vmPerf.csv
-            vp.write(now)
-            vp.write("," + pvm["name"])
-            vp.write("," + str(pvm['numVCPU']))
-            vp.write("," + str(round(stat_response[0]['cpuUsage'], 4)))
-            for vpnode in node_response:
-                if pvm['nodeUUID'] == vpnode['uuid']:
-                    vp.write("," + str(round(vpnode['CPUhz'] / 1000**3 ,2)))
-                    vp.write("," + str(round((vpnode['CPUhz'] * (stat_response[0]['cpuUsage'] / 100)) / 1000**3, 2)))
-            vp.write("," + str(round(stat_response[0]['rxBitRate'], 4)))
-            vp.write("," + str(round(stat_response[0]['txBitRate'], 4)))
-            disk_count = 8
-            for vdisk in pvm['blockDevs']:
-                if vdisk['type'] in ("VIRTIO_DISK", "IDE_DISK"):
-                    vp.write("," + vdisk['type'])
-                    for stat_disk in stat_response[0]['vsdStats']:
-                        if stat_disk['uuid'] == vdisk['uuid']:
-                            vp.write("," + str(stat_disk['rates'][0]['millireadsPerSecond'] / 1000))
-                            vp.write("," + str(stat_disk['rates'][0]['milliwritesPerSecond'] / 1000))
-                            vp.write("," + str(stat_disk['rates'][0]['meanReadLatencyMicroseconds']))
-                            vp.write("," + str(stat_disk['rates'][0]['meanWriteLatencyMicroseconds']))
-                            disk_count -= 1
-            if disk_count == 7:
-                vp.write(",NO_DISK,0,0,0,0")
-            vp.write("\n")
-        vp.flush()
-        
-        # Get performance data for the Nodes. This is limited to CPU and RAM info
-        stat_node_response = json.loads(requests.request("GET",
-                                      api_node,
+# The vectorized metrics stage precomputes which node and which csv columns belong to every vm, once for the whole run.
+if vectorized_metrics:
+    try:
+        import ScaleMetrics
+        perf_index = ScaleMetrics.VmPerfIndex(virdomain_json, node_response)
+    except ImportError:
+        print("numpy is not installed, falling back to plain python for the perf measurements")
+        vectorized_metrics = False
+
+# Fetch the stats for a single vm. The collector runs this for many vms at the same time. A vm that was deleted since the
+# vm list was read (or whose stats can not be fetched) gives None, it is left out of the measurement.
+def get_vm_stats(pvm):
+    api_virdomainstats = prefix + 'VirDomainStats/' + pvm['uuid']
+    try:
+        stats_response = http.request("GET",
+                                      api_virdomainstats,
                                       headers=api_headers,
-                                      verify=False
-                                      ).text)
-        
-        # Write perf data to nodePerf.csv
-        for snode in stat_node_response:
-            np.write(snode['lanIP'])
-            np.write("," + str(round(snode['memSize'] / 1024**3, 2)))
-            np.write("," + str(round(snode['totalMemUsageBytes'] / 1024**3, 2)))
-            np.write("," + str(round(snode['memUsagePercentage'], 2)))
-            np.write("," + str(round(snode['cpuUsage'], 2)))
-            np.write("\n")
-        np.flush()
-        
-        time.sleep(10)      #stats on cluster are refreshed every 10 seconds so no need to check faster. again, also to prevent DoS-ing the API
+                                      verify=False)
+    except requests.RequestException as e:
+        print(f"stats for vm {pvm['name']} could not be fetched: {e}")
+        return None
+    if stats_response.status_code != 200:
+        print(f"stats for vm {pvm['name']} failed with status {stats_response.status_code}, the vm list is read again")
+        return None
+    stats = json.loads(stats_response.text)
+    return stats if stats else None
 
-# logging out again
+vm_perf_columns = ["epoch", "name", "numVCPU", "cpuPct", "cpuGhz", "vmGhz", "rxBit", "txBit",
+                   "DiskType1", "IOPsread1", "IOPswrite1", "latencyReadUm1", "latercyWriteUm1",
+                   "DiskType2", "IOPsread2", "IOPswrite2", "latencyReadUm2", "latercyWriteUm2"]
+vm_perf_types = ["int", "str", "int", "float", "float", "float", "float", "float",
+                 "str", "float", "float", "float", "float",
+                 "str", "float", "float", "float", "float"]
+node_perf_columns = ["lanIP", "memSize", "totalMemUsageBytes", "memUsagePercentage", "cpuUsagePct"]
+node_perf_types = ["str", "float", "float", "float", "float"]
+rotate_bytes = int(rotate_megabytes * 1024**2)
+rotate_seconds = rotate_hours * 3600
 
-logout_response = requests.request("POST",
-                                   api_logout,
-                                   headers=api_headers,
-                                   verify=False
-)
+# In exporter mode the measurements are not written to files at all. Every cycle renders its measurement once and hands
+# it to the exporter, a scrape of /metrics only returns what was rendered last (no API calls, no file access). The
+# exporter keeps running until it is stopped.
+exporter = None
+if exporter_port:
+    import ScaleExporter
+    exporter = ScaleExporter.MetricsExporter(exporter_address, exporter_port)
+    exporter.start()
+    print(f"serving metrics on http://{exporter_address}:{exporter_port}/metrics")
+
+# The time series store keeps the measurements next to the files or the exporter. It has a fixed size per series, older
+# samples are overwritten, so it can stay in place between runs and over weeks of measurements.
+if timeseries_store:
+    import ScaleTimeSeries
+
+# The measurements run until the end time or until they are stopped. Whatever ends them (also an error), the exporter is
+# stopped and we log out again.
+try:
+    # Lets open two more files, one with Node performance data, and one with vms performance data. The third file keeps track
+    # of how long every measurement took and how many 10 second slots were missed because a measurement ran too long.
+    write_files = exporter is None
+    with ScaleWriters.open_writer(output_format, "nodePerf", node_perf_columns, node_perf_types, rotate_bytes, rotate_seconds) if write_files else nullcontext() as np, \
+            ScaleWriters.open_writer(output_format, "vmPerf", vm_perf_columns, vm_perf_types, rotate_bytes, rotate_seconds) if write_files else nullcontext() as vp, \
+            ScaleWriters.open_writer("csv", "collectorStats", ["epoch", "durationSec", "missedDeadlines"]) if write_files else nullcontext() as cp, \
+            ScaleTimeSeries.TimeSeriesStore(timeseries_store, cycle_seconds, raw_retention=timeseries_raw_days * 86400) if timeseries_store else nullcontext() as ts, \
+            ThreadPoolExecutor(max_workers=collector_workers) as collector:
+
+        # calculate untill which time in epoch we will run (epoch is time measured in seconds), the exporter runs until stopped
+        r_until = time.time() + (measure_in_hours * 3600) if write_files else float("inf")
+
+        # every measurement starts on a fixed deadline (start + n * cycle_seconds) instead of sleeping after the work is done,
+        # so the time spent collecting does not push the following measurements further and further back.
+        deadline = time.time()
+
+        # keep looping until we reach the above calculated time
+        reread_vms = False
+        while time.time() < r_until and not stop.is_set():
+
+            # Next i am going to reuse the earlier virdomain_json to iterate over all vm's, but now to retrieve their perf data
+            cycle_start = time.time()
+            now = int(cycle_start) # I am going to use this data later in grafana so need to strip the decimals (infini plugin doesnt understand decimals)
+
+            # The measurements (the exporter above all) can run for weeks while vms are created and deleted, so read the
+            # vm and node lists again every vm_refresh_minutes and right after a vm could not be measured.
+            if reread_vms or cycle_start - virdomains_read >= vm_refresh_minutes * 60:
+                virdomain_json = get_virdomains()
+                node_response = json.loads(http.request("GET",
+                                              api_node,
+                                              headers=api_headers,
+                                              verify=False
+                                              ).text)
+                virdomains_read = cycle_start
+                reread_vms = False
+                if vectorized_metrics:
+                    perf_index = ScaleMetrics.VmPerfIndex(virdomain_json, node_response)
+
+            # fetch the stats of all vms concurrently, map() hands them back in the order of virdomain_json
+            stat_responses = list(collector.map(get_vm_stats, virdomain_json))
+
+            # leave the vms without stats (deleted since the vm list was read) out of this measurement
+            measured_vms = virdomain_json
+            measured_index = perf_index if vectorized_metrics else None
+            if any(stat_response is None for stat_response in stat_responses):
+                measured_vms = [pvm for pvm, stat_response in zip(virdomain_json, stat_responses) if stat_response is not None]
+                stat_responses = [stat_response for stat_response in stat_responses if stat_response is not None]
+                if vectorized_metrics:
+                    measured_index = ScaleMetrics.VmPerfIndex(measured_vms, node_response)
+                reread_vms = True
+
+            if exporter is not None:
+                # render the measurement once, every scrape until the next cycle gets these bytes as they are
+                stat_node_response = json.loads(http.request("GET",
+                                              api_node,
+                                              headers=api_headers,
+                                              verify=False
+                                              ).text)
+                exporter.publish(ScaleExporter.render(measured_vms, node_response, stat_responses, stat_node_response))
+            elif vectorized_metrics:
+                # compute the whole measurement at once
+                vm_metrics = ScaleMetrics.compute_vm_metrics(measured_index, stat_responses)
+                vp.write_rows(ScaleMetrics.vm_rows(now, measured_index, vm_metrics))
+            else:
+                for pvm, stat_response in zip(measured_vms, stat_responses):
+            
+                    # collect the data for vmPerf.csv
+                    row = [now, pvm["name"], pvm['numVCPU'], round(stat_response[0]['cpuUsage'], 4)]
+                    for vpnode in node_response:
+                        if pvm['nodeUUID'] == vpnode['uuid']:
+                            row.append(round(vpnode['CPUhz'] / 1000**3 ,2))
+                            row.append(round((vpnode['CPUhz'] * (stat_response[0]['cpuUsage'] / 100)) / 1000**3, 2))
+                    row.append(round(stat_response[0]['rxBitRate'], 4))
+                    row.append(round(stat_response[0]['txBitRate'], 4))
+                    disk_count = 8
+                    for vdisk in pvm['blockDevs']:
+                        if vdisk['type'] in ("VIRTIO_DISK", "IDE_DISK"):
+                            row.append(vdisk['type'])
+                            for stat_disk in stat_response[0]['vsdStats']:
+                                if stat_disk['uuid'] == vdisk['uuid']:
+                                    row.append(stat_disk['rates'][0]['millireadsPerSecond'] / 1000)
+                                    row.append(stat_disk['rates'][0]['milliwritesPerSecond'] / 1000)
+                                    row.append(stat_disk['rates'][0]['meanReadLatencyMicroseconds'])
+                                    row.append(stat_disk['rates'][0]['meanWriteLatencyMicroseconds'])
+                                    disk_count -= 1
+                    if disk_count == 7:
+                        row.extend(("NO_DISK", 0, 0, 0, 0))
+                    vp.write_row(row)
+
+            if write_files:
+                vp.flush()
+
+                # Get performance data for the Nodes. This is limited to CPU and RAM info
+                stat_node_response = json.loads(http.request("GET",
+                                              api_node,
+                                              headers=api_headers,
+                                              verify=False
+                                              ).text)
+
+                # Write perf data to nodePerf.csv
+                for snode in stat_node_response:
+                    np.write_row([snode['lanIP'],
+                                  round(snode['memSize'] / 1024**3, 2),
+                                  round(snode['totalMemUsageBytes'] / 1024**3, 2),
+                                  round(snode['memUsagePercentage'], 2),
+                                  round(snode['cpuUsage'], 2)])
+                np.flush()
+
+            if ts is not None:
+                ts.append_many(now, ScaleTimeSeries.measurement_samples(measured_vms, node_response, stat_responses,
+                                                                        stat_node_response))
+
+            # stats on cluster are refreshed every 10 seconds so no need to check faster. again, also to prevent DoS-ing the API
+            # if this measurement ran past one or more deadlines those slots are skipped and counted as missed.
+            cycle_end = time.time()
+            deadline += cycle_seconds
+            missed = 0
+            while deadline <= cycle_end:
+                deadline += cycle_seconds
+                missed += 1
+            if write_files:
+                cp.write_row([now, round(cycle_end - cycle_start, 3), missed])
+                cp.flush()
+            else:
+                exporter.cycle_done(now, round(cycle_end - cycle_start, 3), missed)
+            stop.wait(deadline - cycle_end)
+finally:
+    if exporter is not None:
+        exporter.stop()
+
+    # logging out again
+    logout_response = http.request("POST",
+                                       api_logout,
+                                       headers=api_headers,
+                                       verify=False
+    )
@@ -0,0 +1,213 @@
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Prometheus exporter mode for SCinventory.
+#
+# Instead of writing perf rows to files for the grafana infinity plugin, SCinventory can keep the most recent
+# measurement in memory and serve it on http://<address>:<port>/metrics in the Prometheus text format. The text is
+# rendered once per collection cycle, in the collector loop, so a scrape only hands over bytes that are already there:
+# it never calls the hypercore API and never touches a file, no matter how often Prometheus scrapes.
+#
+# Values are exported as they come from the API, with labels for the vm name, the node (lanIP) and the disk uuid, so
+# there is no need for stripped decimals or fake NO_DISK columns here.
+
+VM_METRICS = (
+    ("scale_vm_vcpus", "Number of virtual CPUs of the vm."),
+    ("scale_vm_cpu_usage_percent", "CPU usage of the vm in percent of its vcpus."),
+    ("scale_vm_cpu_ghz", "CPU used by the vm in GHz, based on the clock speed of its node."),
+    ("scale_vm_rx_bits_per_second", "Network receive rate of the vm."),
+    ("scale_vm_tx_bits_per_second", "Network transmit rate of the vm."),
+)
+DISK_METRICS = (
+    ("scale_vm_disk_read_iops", "Read operations per second of a vm disk."),
+    ("scale_vm_disk_write_iops", "Write operations per second of a vm disk."),
+    ("scale_vm_disk_read_latency_microseconds", "Mean read latency of a vm disk."),
+    ("scale_vm_disk_write_latency_microseconds", "Mean write latency of a vm disk."),
+)
+NODE_METRICS = (
+    ("scale_node_memory_bytes", "Memory size of the node."),
+    ("scale_node_memory_used_bytes", "Memory in use on the node."),
+    ("scale_node_memory_usage_percent", "Memory usage of the node in percent."),
+    ("scale_node_cpu_usage_percent", "CPU usage of the node in percent."),
+)
+
+
+def _escape(value) -> str:
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _families(names: tuple) -> dict:
+    return {name: [] for name, help_text in names}
+
+
+def _lines(metrics: tuple, samples: dict) -> list:
+    lines = []
+    for name, help_text in metrics:
+        lines.append(f'# HELP {name} {help_text}')
+        lines.append(f'# TYPE {name} gauge')
+        lines.extend(samples[name])
+    return lines
+
+
+def render(virdomain_json: list, node_response: list, stat_responses: list, stat_node_response: list) -> bytes:
+    """
+    Render one measurement in the Prometheus text format
+
+    :example:
+    >>> exporter.publish(render(virdomain_json, node_response, stat_responses, stat_node_response))
+
+    :param virdomain_json: the vms, in the same order as stat_responses.
+    :type virdomain_json: list
+    :param node_response: the decoded /rest/v1/Node list from the start of the run (for the node of every vm).
+    :type node_response: list
+    :param stat_responses: the decoded /rest/v1/VirDomainStats/<uuid> responses of this measurement.
+    :type stat_responses: list
+    :param stat_node_response: the decoded /rest/v1/Node list of this measurement.
+    :type stat_node_response: list
+    :return: bytes
+    """
+
+    node_ip = {node['uuid']: node['lanIP'] for node in node_response}
+    node_hz = {node['uuid']: node['CPUhz'] for node in node_response}
+
+    vm_samples = _families(VM_METRICS)
+    disk_samples = _families(DISK_METRICS)
+    for vm, stat_response in zip(virdomain_json, stat_responses):
+        stat = stat_response[0]
+        labels = f'vm="{_escape(vm["name"])}",node="{_escape(node_ip.get(vm["nodeUUID"], ""))}"'
+        vm_samples["scale_vm_vcpus"].append(f'scale_vm_vcpus{{{labels}}} {vm["numVCPU"]}')
+        vm_samples["scale_vm_cpu_usage_percent"].append(f'scale_vm_cpu_usage_percent{{{labels}}} {stat["cpuUsage"]!r}')
+        if vm["nodeUUID"] in node_hz:
+            vm_samples["scale_vm_cpu_ghz"].append(
+                f'scale_vm_cpu_ghz{{{labels}}} {node_hz[vm["nodeUUID"]] * (stat["cpuUsage"] / 100) / 1000**3!r}')
+        vm_samples["scale_vm_rx_bits_per_second"].append(f'scale_vm_rx_bits_per_second{{{labels}}} {stat["rxBitRate"]!r}')
+        vm_samples["scale_vm_tx_bits_per_second"].append(f'scale_vm_tx_bits_per_second{{{labels}}} {stat["txBitRate"]!r}')
+
+        disk_types = {disk['uuid']: disk['type'] for disk in vm['blockDevs']}
+        for stat_disk in stat['vsdStats']:
+            if not stat_disk['rates']:
+                continue
+            rates = stat_disk['rates'][0]
+            disk_labels = (labels + f',disk="{_escape(stat_disk["uuid"])}"'
+                           f',type="{_escape(disk_types.get(stat_disk["uuid"], ""))}"')
+            disk_samples["scale_vm_disk_read_iops"].append(
+                f'scale_vm_disk_read_iops{{{disk_labels}}} {rates["millireadsPerSecond"] / 1000!r}')
+            disk_samples["scale_vm_disk_write_iops"].append(
+                f'scale_vm_disk_write_iops{{{disk_labels}}} {rates["milliwritesPerSecond"] / 1000!r}')
+            disk_samples["scale_vm_disk_read_latency_microseconds"].append(
+                f'scale_vm_disk_read_latency_microseconds{{{disk_labels}}} {rates["meanReadLatencyMicroseconds"]}')
+            disk_samples["scale_vm_disk_write_latency_microseconds"].append(
+                f'scale_vm_disk_write_latency_microseconds{{{disk_labels}}} {rates["meanWriteLatencyMicroseconds"]}')
+
+    node_samples = _families(NODE_METRICS)
+    for snode in stat_node_response:
+        labels = f'node="{_escape(snode["lanIP"])}"'
+        node_samples["scale_node_memory_bytes"].append(f'scale_node_memory_bytes{{{labels}}} {snode["memSize"]}')
+        node_samples["scale_node_memory_used_bytes"].append(
+            f'scale_node_memory_used_bytes{{{labels}}} {snode["totalMemUsageBytes"]}')
+        node_samples["scale_node_memory_usage_percent"].append(
+            f'scale_node_memory_usage_percent{{{labels}}} {snode["memUsagePercentage"]!r}')
+        node_samples["scale_node_cpu_usage_percent"].append(
+            f'scale_node_cpu_usage_percent{{{labels}}} {snode["cpuUsage"]!r}')
+
+    lines = _lines(VM_METRICS, vm_samples) + _lines(DISK_METRICS, disk_samples) + _lines(NODE_METRICS, node_samples)
+    return ('\n'.join(lines) + '\n').encode()
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    # set per server by MetricsExporter
+    exporter = None
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        if self.path.split('?', 1)[0] != '/metrics':
+            self.send_error(404)
+            return
+        body = self.exporter.scrape()
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+class MetricsExporter:
+    """
+    Serve the last published measurement on /metrics
+
+    publish() swaps in the rendered text of a new measurement, cycle_done() records how the collection cycle went.
+    Scrapes read whatever was published last.
+
+    :example:
+    >>> exporter = MetricsExporter("127.0.0.1", 9109)
+    >>> exporter.start()
+    >>> exporter.publish(render(virdomain_json, node_response, stat_responses, stat_node_response))
+    >>> exporter.cycle_done(now, 1.2, 0)
+
+    :param address: address to listen on, "0.0.0.0" to allow scrapes from other hosts.
+    :type address: str
+    :param port: port to listen on.
+    :type port: int
+    """
+
+    def __init__(self, address: str, port: int):
+        self.address = address
+        self.port = port
+        self.measurement = b''
+        self.collector = b''
+        self.missed_total = 0
+        self.cycles = 0
+        self.server = None
+        self._lock = threading.Lock()
+
+    def start(self) -> None:
+        handler = type("Handler", (_MetricsHandler,), {"exporter": self})
+        self.server = ThreadingHTTPServer((self.address, self.port), handler)
+        self.server.daemon_threads = True
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+    def stop(self) -> None:
+        if self.server is not None:
+            self.server.shutdown()
+            self.server.server_close()
+            self.server = None
+
+    def publish(self, measurement: bytes) -> None:
+        """
+        Make a rendered measurement the one that is served.
+        """
+
+        self.measurement = measurement
+
+    def cycle_done(self, epoch: int, duration: float, missed: int) -> None:
+        """
+        Record the timing of the collection cycle that produced the last measurement.
+        """
+
+        with self._lock:
+            self.cycles += 1
+            self.missed_total += missed
+            self.collector = '\n'.join((
+                '# HELP scale_collector_last_cycle_timestamp_seconds Start of the last collection cycle.',
+                '# TYPE scale_collector_last_cycle_timestamp_seconds gauge',
+                f'scale_collector_last_cycle_timestamp_seconds {epoch}',
+                '# HELP scale_collector_cycle_duration_seconds Duration of the last collection cycle.',
+                '# TYPE scale_collector_cycle_duration_seconds gauge',
+                f'scale_collector_cycle_duration_seconds {duration!r}',
+                '# HELP scale_collector_cycles_total Collection cycles since the exporter started.',
+                '# TYPE scale_collector_cycles_total counter',
+                f'scale_collector_cycles_total {self.cycles}',
+                '# HELP scale_collector_missed_deadlines_total Collection slots skipped because a cycle ran too long.',
+                '# TYPE scale_collector_missed_deadlines_total counter',
+                f'scale_collector_missed_deadlines_total {self.missed_total}',
+            )).encode() + b'\n'
+
+    def scrape(self) -> bytes:
+        return self.measurement + self.collector
+
+
+if __name__ == "__main__":
+    print("This script was never intended to be run directly. Feel free to do so, but a more elegant way would be to import it"
+          " as a module into your own code.")
@@ -0,0 +1,173 @@
+import numpy as np
+
+# Vectorized metrics stage for the SCinventory perf loop.
+#
+# The VirDomain and Node lists only change between runs, so everything that can be looked up once (which node CPUhz
+# belongs to which vm, which disk uuid goes in which column) is precomputed in a VmPerfIndex. Every measurement then
+# only copies the raw VirDomainStats numbers into NumPy arrays and derives cpuGhz, vmGhz, IOPS and latencies for all
+# vms at once.
+
+# disk types that are reported in vmPerf.csv, other block devices (cdroms, ...) are skipped
+DISK_TYPES = ("VIRTIO_DISK", "IDE_DISK")
+
+
+class VmPerfIndex:
+    """
+    Precomputed lookups for the vm perf measurements
+
+    Built once from the VirDomain and Node lists. Row i of every array in a measurement belongs to vms[i], column j of
+    the disk arrays belongs to disk_uuids[i][j].
+
+    :example:
+    >>> index = VmPerfIndex(virdomain_json, node_response)
+    >>> batch = compute_vm_metrics(index, stat_responses)
+    >>> vp.write_rows(vm_rows(now, index, batch))
+
+    :param virdomain_json: the decoded /rest/v1/VirDomain list.
+    :type virdomain_json: list
+    :param node_response: the decoded /rest/v1/Node list.
+    :type node_response: list
+    """
+
+    def __init__(self, virdomain_json: list, node_response: list):
+        self.vms = virdomain_json
+        self.names = [vm['name'] for vm in virdomain_json]
+        self.num_vcpu = [vm['numVCPU'] for vm in virdomain_json]
+
+        # vm row -> CPUhz of the node it runs on, NaN when the node is unknown
+        node_hz = {node['uuid']: node['CPUhz'] for node in node_response}
+        self.cpu_hz = np.array([node_hz.get(vm['nodeUUID'], np.nan) for vm in virdomain_json], dtype=np.float64)
+
+        # vm row -> the reported disks in blockDevs order, and disk uuid -> (row, column)
+        self.disk_types = []
+        self.disk_uuids = []
+        self.disk_slot = {}
+        for row, vm in enumerate(virdomain_json):
+            disks = [disk for disk in vm['blockDevs'] if disk['type'] in DISK_TYPES]
+            self.disk_types.append([disk['type'] for disk in disks])
+            self.disk_uuids.append([disk['uuid'] for disk in disks])
+            for column, disk in enumerate(disks):
+                self.disk_slot[disk['uuid']] = (row, column)
+        self.max_disks = max([len(disks) for disks in self.disk_uuids], default=0) or 1
+
+
+def compute_vm_metrics(index: VmPerfIndex, stat_responses: list) -> dict:
+    """
+    Derive the vm perf values of one measurement for all vms at once
+
+    :param index: the VmPerfIndex for the vms that were measured.
+    :type index: VmPerfIndex
+    :param stat_responses: the decoded /rest/v1/VirDomainStats/<uuid> responses, in the same order as index.vms.
+    :type stat_responses: list
+    :return: dict of NumPy arrays: cpuPct, cpuGhz, vmGhz, rxBit, txBit (one value per vm) and IOPsread, IOPswrite,
+        latencyRead, latencyWrite (vms x disks, NaN where a disk has no stats)
+    """
+
+    count = len(index.vms)
+    cpu = np.empty(count)
+    rx = np.empty(count)
+    tx = np.empty(count)
+    disk_shape = (count, index.max_disks)
+    reads = np.full(disk_shape, np.nan)
+    writes = np.full(disk_shape, np.nan)
+    read_latency = np.full(disk_shape, np.nan)
+    write_latency = np.full(disk_shape, np.nan)
+
+    # the only per vm python work left: copy the raw numbers out of the json into the arrays
+    disk_slot = index.disk_slot
+    for row, stat_response in enumerate(stat_responses):
+        stat = stat_response[0]
+        cpu[row] = stat['cpuUsage']
+        rx[row] = stat['rxBitRate']
+        tx[row] = stat['txBitRate']
+        for stat_disk in stat['vsdStats']:
+            slot = disk_slot.get(stat_disk['uuid'])
+            if slot is not None and slot[0] == row:
+                rates = stat_disk['rates'][0]
+                reads[slot] = rates['millireadsPerSecond']
+                writes[slot] = rates['milliwritesPerSecond']
+                read_latency[slot] = rates['meanReadLatencyMicroseconds']
+                write_latency[slot] = rates['meanWriteLatencyMicroseconds']
+
+    return {
+        "cpuPct": cpu,
+        "cpuGhz": index.cpu_hz / 1000**3,
+        "vmGhz": index.cpu_hz * (cpu / 100) / 1000**3,
+        "rxBit": rx,
+        "txBit": tx,
+        "IOPsread": reads / 1000,
+        "IOPswrite": writes / 1000,
+        "latencyRead": read_latency,
+        "latencyWrite": write_latency,
+    }
+
+
+def _number(value: float):
+    # latencies come from the API as whole numbers, keep writing them without a trailing .0 as before
+    return int(value) if value.is_integer() else value
+
+
+def vm_rows(now, index: VmPerfIndex, batch: dict) -> list:
+    """
+    Turn a whole measurement into vmPerf rows (lists of values in the vmPerf.csv column order)
+
+    The values are rounded the same way SCinventory always wrote them, so joining them with str() gives the old csv
+    text, including the fake NO_DISK columns for vms with a single disk. Rounding is done here with the builtin
+    round(), np.round gives different digits for large values like the bit rates. When the node of a vm is unknown
+    cpuGhz and vmGhz are None.
+
+    :param now: epoch of the measurement without decimals.
+    :type now: int | str
+    :param index: the VmPerfIndex for the vms that were measured.
+    :type index: VmPerfIndex
+    :param batch: the result of compute_vm_metrics.
+    :type batch: dict
+    :return: list
+    """
+
+    # tolist() converts to python floats once for the whole batch, so str() gives the same text as before
+    cpu_pct = batch["cpuPct"].tolist()
+    cpu_ghz = batch["cpuGhz"].tolist()
+    vm_ghz = batch["vmGhz"].tolist()
+    rx = batch["rxBit"].tolist()
+    tx = batch["txBit"].tolist()
+    has_stats = (~np.isnan(batch["IOPsread"])).tolist()
+    reads = batch["IOPsread"].tolist()
+    writes = batch["IOPswrite"].tolist()
+    read_latency = batch["latencyRead"].tolist()
+    write_latency = batch["latencyWrite"].tolist()
+
+    rows = []
+    for row, name in enumerate(index.names):
+        fields = [now, name, index.num_vcpu[row], round(cpu_pct[row], 4)]
+        # NaN when the node of the vm is unknown
+        if cpu_ghz[row] == cpu_ghz[row]:
+            fields.append(round(cpu_ghz[row], 2))
+            fields.append(round(vm_ghz[row], 2))
+        else:
+            fields.append(None)
+            fields.append(None)
+        fields.append(round(rx[row], 4))
+        fields.append(round(tx[row], 4))
+        disks_with_stats = 0
+        for column, disk_type in enumerate(index.disk_types[row]):
+            fields.append(disk_type)
+            if has_stats[row][column]:
+                fields.append(reads[row][column])
+                fields.append(writes[row][column])
+                fields.append(_number(read_latency[row][column]))
+                fields.append(_number(write_latency[row][column]))
+                disks_with_stats += 1
+        if disks_with_stats == 1:
+            fields.extend(("NO_DISK", 0, 0, 0, 0))
+        rows.append(fields)
+    return rows
+
+
+def format_vm_rows(now, index: VmPerfIndex, batch: dict) -> str:
+    """
+    Format a whole measurement as vmPerf.csv text in one string, see vm_rows.
+    """
+
+    return "".join(",".join("" if value is None else str(value) for value in fields) + "\n"
+                   for fields in vm_rows(now, index, batch))
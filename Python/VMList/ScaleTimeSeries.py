@@ -0,0 +1,453 @@
+import json
+import mmap
+import os
+import struct
+
+# Embedded time series store for the SCinventory perf measurements.
+#
+# Every series (one metric of one vm, disk or node, e.g. "vm/testvm01/cpuPct") is kept at three resolutions: the raw
+# samples and 1 minute and 1 hour rollups with min, max and average. Each resolution is a single memory-mapped ring
+# file in which every series owns a fixed block of slots, so the files never grow beyond retention / step slots per
+# series no matter how long the capture runs. The slot of a sample follows from its timestamp
+# ((timestamp // step) % slots), a new sample simply overwrites the one that is retention seconds older and the
+# rollups are updated in place by the same write.
+#
+# The series are grouped in chunks of 64. A chunk stores its slots one after the other and every slot is a row with the
+# timestamps of its 64 series followed by each value column for those 64 series, so one measurement of all series
+# writes a few contiguous rows per chunk instead of touching a separate page for every series (that would keep
+# hundreds of MB of pages dirty for a few hundred kB of samples every cycle). A window of one series is handed out
+# as strided memoryview slices of the mapped file (at most two per column, when the window wraps around the end of the
+# ring) without copying or parsing anything, numpy.asarray() on those slices is zero-copy as well.
+#
+# The store is written by one process, any number of processes can read it with readonly=True.
+
+RESOLUTIONS = ("raw", "1m", "1h")
+ROLLUP_STEPS = {"1m": 60, "1h": 3600}
+COLUMNS = {"raw": ("value",), "1m": ("min", "max", "sum", "count"), "1h": ("min", "max", "sum", "count")}
+
+# magic, step, slots per series, value columns, padded to 64 bytes so the arrays behind it stay 8 byte aligned
+_HEADER = struct.Struct("<8sqqq")
+_HEADER_SIZE = 64
+_MAGIC = b"SCRING02"
+# series per chunk
+LANES = 64
+
+
+class _Ring:
+    # one resolution of the store: a header followed by chunks of LANES series. A chunk holds slots rows and every row
+    # the timestamps of the LANES series and then every value column for them.
+
+    def __init__(self, path: str, step: int, slots: int, columns: tuple, readonly: bool):
+        self.path = path
+        self.step = step
+        self.slots = slots
+        self.columns = columns
+        self.readonly = readonly
+        self.row_words = LANES * (1 + len(columns))
+        self.chunk_words = slots * self.row_words
+        self.retired = []
+        if not os.path.exists(path):
+            if readonly:
+                raise Exception(f'time series ring {path} does not exist')
+            with open(path, "wb") as f:
+                f.write(_HEADER.pack(_MAGIC, step, slots, len(columns)).ljust(_HEADER_SIZE, b"\0"))
+        self.file = open(path, "rb" if readonly else "r+b")
+        magic, file_step, file_slots, file_columns = _HEADER.unpack(self.file.read(_HEADER.size))
+        if magic != _MAGIC or (file_step, file_slots, file_columns) != (step, slots, len(columns)):
+            raise Exception(f'{path} is not a ring file with step {step}, {slots} slots and {len(columns)} columns')
+        self.map = None
+        self._remap()
+
+    def _remap(self) -> None:
+        if self.map is not None:
+            self.ints.release()
+            self.floats.release()
+            try:
+                self.map.close()
+            except BufferError:
+                # windows handed out earlier still point into this map, it is closed with the store
+                self.retired.append(self.map)
+        self.map = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ if self.readonly else mmap.ACCESS_WRITE)
+        self.ints = memoryview(self.map).cast("q")
+        self.floats = memoryview(self.map).cast("d")
+        self.capacity = (len(self.map) - _HEADER_SIZE) // (self.chunk_words * 8) * LANES
+
+    def reserve(self, series: int) -> None:
+        """
+        Make sure the file has room for this many series. Chunks are added by doubling the file, they are sparse
+        zeroes until written.
+        """
+
+        if series <= self.capacity:
+            return
+        if not self.readonly:
+            chunks = max(-(-series // LANES), 2 * self.capacity // LANES)
+            self.file.truncate(_HEADER_SIZE + chunks * self.chunk_words * 8)
+        self._remap()
+        if series > self.capacity:
+            raise Exception(f'{self.path} has room for {self.capacity} series, {series} expected')
+
+    def position(self, index: int, slot: int) -> int:
+        # word offset of the timestamp of series index in a slot, value column k is at + (k + 1) * LANES
+        return _HEADER_SIZE // 8 + (index // LANES) * self.chunk_words + slot * self.row_words + index % LANES
+
+    def close(self) -> None:
+        self.ints.release()
+        self.floats.release()
+        for mapped in self.retired + [self.map]:
+            try:
+                mapped.close()
+            except BufferError:
+                # a window is still being read, the map is closed when that is garbage collected
+                pass
+        self.retired = []
+        self.file.close()
+
+
+class Window:
+    """
+    The samples of one series between start and end, read straight from the ring file
+
+    segments is a list of (timestamps, columns) with timestamps a memoryview of int64 and columns a dict with a
+    memoryview of float64 per column, all strided slices of the mapped file. There are two segments when the window
+    wraps around the end of the ring. Slots in the window that were never written, or hold a sample older than the
+    window, are still in the segments; iterating over the window (or to_numpy()) skips them.
+
+    Raw windows iterate as (timestamp, value), rollups as (timestamp, min, max, avg, count) with the start of the
+    minute or hour as timestamp.
+
+    :example:
+    >>> with store.window("vm/testvm01/cpuPct", now - 3600, now, "1m") as window:
+    ...     for timestamp, low, high, avg, count in window:
+    ...         print(timestamp, avg)
+    """
+
+    def __init__(self, resolution: str, start: int, end: int, segments: list):
+        self.resolution = resolution
+        self.start = start
+        self.end = end
+        self.segments = segments
+
+    def __iter__(self):
+        for timestamps, columns in self.segments:
+            if self.resolution == "raw":
+                for timestamp, value in zip(timestamps, columns["value"]):
+                    if self.start <= timestamp <= self.end:
+                        yield timestamp, value
+            else:
+                for timestamp, low, high, total, count in zip(timestamps, columns["min"], columns["max"],
+                                                              columns["sum"], columns["count"]):
+                    if self.start <= timestamp <= self.end and count:
+                        yield timestamp, low, high, total / count, int(count)
+
+    def to_numpy(self) -> dict:
+        """
+        The valid samples as numpy arrays, a dict with timestamp and the columns (avg instead of sum for rollups).
+
+        The ring is read through numpy.asarray on the views, only the selected samples are copied.
+        """
+
+        import numpy
+        parts = []
+        for timestamps, columns in self.segments:
+            times = numpy.asarray(timestamps)
+            keep = (times >= self.start) & (times <= self.end)
+            if self.resolution != "raw":
+                keep &= numpy.asarray(columns["count"]) > 0
+            parts.append({"timestamp": times[keep]} |
+                         {name: numpy.asarray(view)[keep] for name, view in columns.items()})
+        arrays = {name: numpy.concatenate([part[name] for part in parts]) for name in parts[0]}
+        if self.resolution != "raw":
+            arrays["avg"] = arrays.pop("sum") / arrays["count"]
+        return arrays
+
+    def release(self) -> None:
+        """
+        Let go of the views into the ring file.
+        """
+
+        for timestamps, columns in self.segments:
+            timestamps.release()
+            for view in columns.values():
+                view.release()
+        self.segments = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.release()
+
+
+class TimeSeriesStore:
+    """
+    Memory-mapped ring buffers with 1 minute and 1 hour rollups for perf samples
+
+    The directory holds series.json (the settings and the list of series) and one ring file per resolution
+    (raw.ring, 1m.ring, 1h.ring). The disk use is fixed per series: 16 bytes per raw slot (retention / step slots)
+    and 40 bytes per rollup slot, reserved per 64 series, whatever the length of the capture. An existing store keeps
+    the step and retentions it was created with, the values passed when opening it again are ignored.
+
+    A timestamp falls in slot timestamp // step, so there is one raw sample per step: a second sample in the same step
+    replaces the first (the rollups count both). Samples older than what is already stored in their slot are ignored.
+
+    :example:
+    >>> with TimeSeriesStore("perfstore", step=10) as store:
+    ...     store.append_many(now, [("vm/testvm01/cpuPct", 12.5), ("node/10.0.0.1/cpuUsagePct", 40.1)])
+    >>> with TimeSeriesStore("perfstore", readonly=True) as store:
+    ...     samples = list(store.window("vm/testvm01/cpuPct", now - 600, now))
+
+    :param directory: directory of the store, created when it does not exist.
+    :type directory: str
+    :param step: seconds between two raw samples (the SCinventory cycle_seconds).
+    :type step: int
+    :param raw_retention: seconds of raw samples to keep.
+    :type raw_retention: int
+    :param minute_retention: seconds of 1 minute rollups to keep.
+    :type minute_retention: int
+    :param hour_retention: seconds of 1 hour rollups to keep.
+    :type hour_retention: int
+    :param readonly: open an existing store for reading only, also while another process writes it.
+    :type readonly: bool
+    """
+
+    def __init__(self, directory: str, step: int = 10, raw_retention: int = 14 * 86400,
+                 minute_retention: int = 30 * 86400, hour_retention: int = 730 * 86400, readonly: bool = False):
+        self.directory = directory
+        self.readonly = readonly
+        self.catalog_path = os.path.join(directory, "series.json")
+        if os.path.exists(self.catalog_path):
+            with open(self.catalog_path) as f:
+                catalog = json.load(f)
+        elif readonly:
+            raise Exception(f'{directory} is not a time series store')
+        else:
+            os.makedirs(directory, exist_ok=True)
+            catalog = {"step": step, "retention": {"raw": raw_retention, "1m": minute_retention, "1h": hour_retention},
+                       "series": []}
+        self.step = catalog["step"]
+        self.retention = catalog["retention"]
+        self.series = {key: index for index, key in enumerate(catalog["series"])}
+        self.steps = {"raw": self.step} | ROLLUP_STEPS
+        self.rings = {}
+        for resolution in RESOLUTIONS:
+            slots = max(1, self.retention[resolution] // self.steps[resolution])
+            self.rings[resolution] = _Ring(os.path.join(directory, resolution + ".ring"), self.steps[resolution],
+                                           slots, COLUMNS[resolution], readonly)
+            self.rings[resolution].reserve(len(self.series))
+        self._dirty = not os.path.exists(self.catalog_path)
+        if self._dirty and not readonly:
+            self._save_catalog()
+
+    def _save_catalog(self) -> None:
+        # through a temporary file, a reader never sees half a catalog
+        temporary = self.catalog_path + ".tmp"
+        with open(temporary, "w") as f:
+            json.dump({"step": self.step, "retention": self.retention, "series": list(self.series)}, f)
+        os.replace(temporary, self.catalog_path)
+        self._dirty = False
+
+    def _reload_catalog(self) -> None:
+        with open(self.catalog_path) as f:
+            self.series = {key: index for index, key in enumerate(json.load(f)["series"])}
+        for ring in self.rings.values():
+            ring.reserve(len(self.series))
+
+    def _index(self, key: str) -> int:
+        index = self.series.get(key)
+        if index is None:
+            if self.readonly:
+                self._reload_catalog()
+                if key not in self.series:
+                    raise Exception(f'series {key} is not in the store')
+                return self.series[key]
+            index = self.series[key] = len(self.series)
+            for ring in self.rings.values():
+                ring.reserve(index + 1)
+            self._dirty = True
+        return index
+
+    def keys(self, prefix: str = "") -> list:
+        """
+        The series in the store, optionally only those starting with prefix ("vm/testvm01/").
+        """
+
+        if self.readonly:
+            self._reload_catalog()
+        return [key for key in self.series if key.startswith(prefix)]
+
+    def _write(self, index: int, timestamp: int, value: float) -> None:
+        ring = self.rings["raw"]
+        position = ring.position(index, (timestamp // ring.step) % ring.slots)
+        if ring.ints[position] > timestamp:
+            return
+        ring.ints[position] = timestamp
+        ring.floats[position + LANES] = value
+
+        for resolution in ("1m", "1h"):
+            ring = self.rings[resolution]
+            bucket = timestamp - timestamp % ring.step
+            position = ring.position(index, (timestamp // ring.step) % ring.slots)
+            ints = ring.ints
+            floats = ring.floats
+            if ints[position] > bucket:
+                continue
+            if ints[position] != bucket:
+                ints[position] = bucket
+                floats[position + LANES] = value
+                floats[position + 2 * LANES] = value
+                floats[position + 3 * LANES] = value
+                floats[position + 4 * LANES] = 1.0
+            else:
+                if value < floats[position + LANES]:
+                    floats[position + LANES] = value
+                if value > floats[position + 2 * LANES]:
+                    floats[position + 2 * LANES] = value
+                floats[position + 3 * LANES] += value
+                floats[position + 4 * LANES] += 1.0
+
+    def append(self, key: str, timestamp: int, value: float) -> None:
+        """
+        Store one sample of a series, the series is added when it is new. None values are skipped.
+        """
+
+        if self.readonly:
+            raise Exception(f'{self.directory} is opened readonly')
+        if value is None:
+            return
+        self._write(self._index(key), int(timestamp), float(value))
+        if self._dirty:
+            self._save_catalog()
+
+    def append_many(self, timestamp: int, samples) -> None:
+        """
+        Store one measurement: an iterable of (key, value) that all have the same timestamp. None values are skipped.
+        """
+
+        if self.readonly:
+            raise Exception(f'{self.directory} is opened readonly')
+        timestamp = int(timestamp)
+        for key, value in samples:
+            if value is not None:
+                self._write(self._index(key), timestamp, float(value))
+        if self._dirty:
+            self._save_catalog()
+
+    def window(self, key: str, start: int, end: int, resolution: str = "raw") -> Window:
+        """
+        The samples of a series from start to end (epoch seconds, inclusive) at a resolution ("raw", "1m" or "1h").
+
+        A window longer than the retention of the resolution is cut to the most recent part.
+
+        :return: Window
+        :raises Exception: unknown series or resolution.
+        """
+
+        if resolution not in self.rings:
+            raise Exception(f'unknown resolution {resolution}, use one of {", ".join(RESOLUTIONS)}')
+        ring = self.rings[resolution]
+        index = self._index(key)
+        start, end = int(start), int(end)
+        first = max(start // ring.step, end // ring.step - ring.slots + 1)
+        count = max(0, end // ring.step - first + 1)
+        offset = first % ring.slots
+        ranges = [(offset, min(ring.slots, offset + count))]
+        if offset + count > ring.slots:
+            ranges.append((0, offset + count - ring.slots))
+
+        segments = []
+        for low, high in ranges:
+            if high <= low:
+                continue
+            first, last = ring.position(index, low), ring.position(index, high - 1) + 1
+            columns = {name: ring.floats[first + (column + 1) * LANES:last + (column + 1) * LANES:ring.row_words]
+                       for column, name in enumerate(ring.columns)}
+            segments.append((ring.ints[first:last:ring.row_words], columns))
+        # a rollup bucket counts when it starts inside the window or the window starts inside it
+        return Window(resolution, start if resolution == "raw" else start - start % ring.step, end, segments)
+
+    def disk_bytes(self) -> int:
+        """
+        Bytes the ring files take on disk once every series has filled its retention.
+
+        The ring files are sparse, they take less until then, and their size runs ahead as chunks are reserved.
+        """
+
+        chunks = -(-len(self.series) // LANES)
+        return sum(_HEADER_SIZE + chunks * ring.chunk_words * 8 for ring in self.rings.values())
+
+    def flush(self) -> None:
+        """
+        Write the changed pages of the ring files to disk, the OS also does this on its own.
+        """
+
+        for ring in self.rings.values():
+            ring.map.flush()
+        if self._dirty:
+            self._save_catalog()
+
+    def close(self) -> None:
+        if not self.readonly:
+            self.flush()
+        for ring in self.rings.values():
+            ring.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+def measurement_samples(virdomain_json: list, node_response: list, stat_responses: list,
+                        stat_node_response: list) -> list:
+    """
+    One SCinventory measurement as (key, value) samples for TimeSeriesStore.append_many
+
+    The keys are vm/<name>/<metric>, disk/<vm name>/<disk uuid>/<metric> and node/<lanIP>/<metric>, with the same
+    metrics as vmPerf.csv and nodePerf.csv, unrounded.
+
+    :example:
+    >>> store.append_many(now, measurement_samples(virdomain_json, node_response, stat_responses, stat_node_response))
+
+    :param virdomain_json: the vms, in the same order as stat_responses.
+    :type virdomain_json: list
+    :param node_response: the decoded /rest/v1/Node list from the start of the run (for the CPUhz of every vm).
+    :type node_response: list
+    :param stat_responses: the decoded /rest/v1/VirDomainStats/<uuid> responses of this measurement.
+    :type stat_responses: list
+    :param stat_node_response: the decoded /rest/v1/Node list of this measurement.
+    :type stat_node_response: list
+    :return: list
+    """
+
+    node_hz = {node['uuid']: node['CPUhz'] for node in node_response}
+    samples = []
+    for vm, stat_response in zip(virdomain_json, stat_responses):
+        stat = stat_response[0]
+        prefix = "vm/" + vm["name"] + "/"
+        samples.append((prefix + "cpuPct", stat["cpuUsage"]))
+        if vm["nodeUUID"] in node_hz:
+            samples.append((prefix + "vmGhz", node_hz[vm["nodeUUID"]] * (stat["cpuUsage"] / 100) / 1000**3))
+        samples.append((prefix + "rxBit", stat["rxBitRate"]))
+        samples.append((prefix + "txBit", stat["txBitRate"]))
+        for stat_disk in stat["vsdStats"]:
+            if not stat_disk["rates"]:
+                continue
+            rates = stat_disk["rates"][0]
+            prefix = "disk/" + vm["name"] + "/" + stat_disk["uuid"] + "/"
+            samples.append((prefix + "IOPsread", rates["millireadsPerSecond"] / 1000))
+            samples.append((prefix + "IOPswrite", rates["milliwritesPerSecond"] / 1000))
+            samples.append((prefix + "latencyReadUs", rates["meanReadLatencyMicroseconds"]))
+            samples.append((prefix + "latencyWriteUs", rates["meanWriteLatencyMicroseconds"]))
+    for snode in stat_node_response:
+        prefix = "node/" + snode["lanIP"] + "/"
+        samples.append((prefix + "totalMemUsageBytes", snode["totalMemUsageBytes"]))
+        samples.append((prefix + "memUsagePercentage", snode["memUsagePercentage"]))
+        samples.append((prefix + "cpuUsagePct", snode["cpuUsage"]))
+    return samples
+
+
+if __name__ == "__main__":
+    print("This script was never intended to be run directly. Feel free to do so, but a more elegant way would be to import it"
+          " as a module into your own code.")
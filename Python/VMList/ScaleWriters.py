@@ -0,0 +1,270 @@
+import os
+import time
+
+# Buffered row writers for the SCinventory output files.
+#
+# Rows are handed over as lists of values and buffered in memory, then written in one go. Next to plain csv (which is
+# what the grafana infinity plugin reads) the same rows can be written as compressed Parquet or Arrow IPC files, which
+# are a lot smaller and load straight into pandas. Long captures can be rotated into a new file by size or by time.
+#
+# Parquet and Arrow need pyarrow, which is only imported when one of those formats is used.
+
+FORMATS = ("csv", "parquet", "arrow")
+
+
+class RowWriter:
+    """
+    Base class for the buffered writers
+
+    The columns are the csv header names. types is an optional list with "str", "int" or "float" per column, used by
+    the columnar formats. Rotation starts a new file named <basename>-<epoch>.<ext> once the current file is larger
+    than rotate_bytes or older than rotate_seconds. Without rotation the file is simply <basename>.<ext>.
+
+    :example:
+    >>> writer = open_writer("csv", "nodePerf", ["lanIP", "memSize"], rotate_seconds=3600)
+    >>> writer.write_row(["10.0.0.1", 64.0])
+    >>> writer.flush()
+    >>> writer.close()
+
+    :param basename: file name without extension.
+    :type basename: str
+    :param columns: column names.
+    :type columns: list
+    :param types: column types for the columnar formats, defaults to "str" for every column.
+    :type types: list
+    :param rotate_bytes: start a new file when the current one grows past this size, 0 to disable.
+    :type rotate_bytes: int
+    :param rotate_seconds: start a new file when the current one is older than this, 0 to disable.
+    :type rotate_seconds: float
+    :param buffer_rows: number of buffered rows after which they are written to the file without waiting for flush().
+    :type buffer_rows: int
+    """
+
+    extension = ""
+    # csv flushes every buffered row so grafana sees them right away, the columnar formats wait for buffer_rows to
+    # keep their row groups large
+    write_on_flush = True
+
+    def __init__(self, basename: str, columns: list, types: list = None, rotate_bytes: int = 0,
+                 rotate_seconds: float = 0, buffer_rows: int = 10000):
+        self.basename = basename
+        self.columns = list(columns)
+        self.types = list(types) if types is not None else ["str"] * len(self.columns)
+        self.rotate_bytes = rotate_bytes
+        self.rotate_seconds = rotate_seconds
+        self.buffer_rows = buffer_rows
+        self.rows = []
+        self.path = None
+        self.opened = 0.0
+
+    def _next_path(self) -> str:
+        if self.rotate_bytes or self.rotate_seconds:
+            path = self.basename + "-" + str(int(time.time())) + self.extension
+            # two rotations within the same second
+            count = 1
+            while os.path.exists(path):
+                path = self.basename + "-" + str(int(time.time())) + "-" + str(count) + self.extension
+                count += 1
+            return path
+        return self.basename + self.extension
+
+    def _should_rotate(self) -> bool:
+        # the age of a file counts from its first row, columnar files are only created on the first write
+        if self.rotate_seconds and self.opened and time.time() - self.opened >= self.rotate_seconds:
+            return True
+        if self.rotate_bytes and self.path is not None and self._size() >= self.rotate_bytes:
+            return True
+        return False
+
+    def write_row(self, row: list) -> None:
+        """
+        Buffer a single row.
+        """
+
+        if not self.opened:
+            self.opened = time.time()
+        self.rows.append(row)
+        if len(self.rows) >= self.buffer_rows:
+            self.flush()
+
+    def write_rows(self, rows: list) -> None:
+        """
+        Buffer many rows at once.
+        """
+
+        if not self.opened:
+            self.opened = time.time()
+        self.rows.extend(rows)
+        if len(self.rows) >= self.buffer_rows:
+            self.flush()
+
+    def flush(self, force: bool = False) -> None:
+        """
+        Write the buffered rows to the current file and start a new file when rotation is due.
+
+        The columnar formats only write when buffer_rows is reached, on rotation or when force is set.
+        """
+
+        rotate = self._should_rotate()
+        if not (force or rotate or self.write_on_flush or len(self.rows) >= self.buffer_rows):
+            return
+        if self.path is None:
+            self.path = self._next_path()
+            self._open_file()
+        if self.rows:
+            self._write(self.rows)
+            self.rows = []
+        if rotate:
+            self._close_file()
+
+    def close(self) -> None:
+        """
+        Write what is left in the buffer and close the file.
+        """
+
+        self.flush(force=True)
+        self._close_file()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def _close_file(self) -> None:
+        if self.path is not None:
+            self._finish_file()
+            self.path = None
+        self.opened = 0.0
+
+    # implemented by the formats below
+    def _open_file(self) -> None:
+        raise NotImplementedError
+
+    def _write(self, rows: list) -> None:
+        raise NotImplementedError
+
+    def _finish_file(self) -> None:
+        raise NotImplementedError
+
+    def _size(self) -> int:
+        return os.path.getsize(self.path)
+
+
+class CsvWriter(RowWriter):
+    """
+    Plain csv with the column names as header, every (rotated) file gets its own header.
+
+    None is written as an empty field, all other values with str() so the text matches the old field by field output.
+    """
+
+    extension = ".csv"
+
+    def _open_file(self) -> None:
+        self.file = open(self.path, "w")
+        self.file.write(",".join(self.columns) + "\n")
+
+    def _write(self, rows: list) -> None:
+        self.file.write("".join(",".join("" if value is None else str(value) for value in row) + "\n" for row in rows))
+        self.file.flush()
+
+    def _finish_file(self) -> None:
+        self.file.close()
+
+    def _size(self) -> int:
+        return self.file.tell()
+
+
+class _ColumnarWriter(RowWriter):
+    # rows are turned into one pyarrow table per flush. Rows longer than the header are cut off and short rows are
+    # padded with nulls, as a columnar file needs the same columns in every row.
+
+    compression = "zstd"
+    write_on_flush = False
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        import pyarrow
+        self.pa = pyarrow
+        pa_types = {"str": pyarrow.string(), "int": pyarrow.int64(), "float": pyarrow.float64()}
+        self.schema = pyarrow.schema([(name, pa_types[kind]) for name, kind in zip(self.columns, self.types)])
+
+    def _table(self, rows: list):
+        width = len(self.columns)
+        padded = [list(row[:width]) + [None] * (width - len(row)) for row in rows]
+        arrays = []
+        for column, field in enumerate(self.schema):
+            values = [row[column] for row in padded]
+            if field.type == self.pa.string():
+                values = [None if value is None else str(value) for value in values]
+            arrays.append(self.pa.array(values, type=field.type))
+        return self.pa.Table.from_arrays(arrays, schema=self.schema)
+
+
+class ParquetWriter(_ColumnarWriter):
+    """
+    zstd compressed Parquet, every flush becomes a row group. A file is only readable once it is closed or rotated.
+    """
+
+    extension = ".parquet"
+
+    def _open_file(self) -> None:
+        import pyarrow.parquet
+        self.file = pyarrow.parquet.ParquetWriter(self.path, self.schema, compression=self.compression)
+
+    def _write(self, rows: list) -> None:
+        self.file.write_table(self._table(rows))
+
+    def _finish_file(self) -> None:
+        self.file.close()
+
+
+class ArrowWriter(_ColumnarWriter):
+    """
+    zstd compressed Arrow IPC file, every flush becomes a record batch. A file is only readable once it is closed or
+    rotated.
+    """
+
+    extension = ".arrow"
+
+    def _open_file(self) -> None:
+        import pyarrow.ipc
+        self.sink = self.pa.OSFile(self.path, "wb")
+        self.file = pyarrow.ipc.new_file(self.sink, self.schema,
+                                         options=pyarrow.ipc.IpcWriteOptions(compression=self.compression))
+
+    def _write(self, rows: list) -> None:
+        self.file.write_table(self._table(rows))
+
+    def _finish_file(self) -> None:
+        self.file.close()
+        self.sink.close()
+
+    def _size(self) -> int:
+        return self.sink.tell()
+
+
+def open_writer(format: str, basename: str, columns: list, types: list = None, rotate_bytes: int = 0,
+                rotate_seconds: float = 0, buffer_rows: int = 10000) -> RowWriter:
+    """
+    Create a writer for one of the FORMATS
+
+    :example:
+    >>> vp = open_writer("parquet", "vmPerf", columns, types, rotate_seconds=3600)
+
+    :param format: "csv", "parquet" or "arrow".
+    :type format: str
+    :return: RowWriter
+    :raises Exception: unknown format.
+    """
+
+    match format:
+        case "csv":
+            writer = CsvWriter
+        case "parquet":
+            writer = ParquetWriter
+        case "arrow":
+            writer = ArrowWriter
+        case _:
+            raise Exception(f'unknown output format {format}, use one of {", ".join(FORMATS)}')
+    return writer(basename, columns, types, rotate_bytes, rotate_seconds, buffer_rows)
@@ -0,0 +1,105 @@
+#!/usr/bin/env python3
+
+"""
+
+Benchmark for the vectorized perf metrics (ScaleMetrics.py) against the plain python loop in SCinventory.py.
+
+Builds synthetic VirDomain, Node and VirDomainStats data for 100, 1000 and 5000 vms, formats one measurement both
+ways, checks that the vmPerf.csv text is identical and prints the time per measurement. The "derive" column is the
+vectorized computation alone, without turning the numbers into csv text, which is what columnar writers get.
+
+Usage: python3 benchmark_metrics.py
+
+dependencies: numpy
+
+"""
+
+import io
+import random
+import time
+
+import ScaleMetrics
+
+NODE_COUNT = 8
+ROUNDS = 20
+
+
+def synthetic_cluster(vm_count: int):
+    random.seed(vm_count)
+    nodes = [{"uuid": "node-" + str(i), "CPUhz": 2100000000 + i * 100000000} for i in range(NODE_COUNT)]
+    vms = []
+    stats = []
+    for i in range(vm_count):
+        uuid = "vm-" + str(i)
+        disks = [{"uuid": uuid + "-disk" + str(d), "type": random.choice(ScaleMetrics.DISK_TYPES)}
+                 for d in range(random.randint(1, 3))]
+        disks.append({"uuid": uuid + "-cd", "type": "IDE_CDROM"})
+        vms.append({"uuid": uuid, "name": "vm" + str(i), "numVCPU": random.randint(1, 16),
+                    "nodeUUID": "node-" + str(i % NODE_COUNT), "blockDevs": disks})
+        stats.append([{
+            "cpuUsage": random.uniform(0, 100),
+            "rxBitRate": random.uniform(0, 10**9),
+            "txBitRate": random.uniform(0, 10**9),
+            "vsdStats": [{"uuid": disk["uuid"], "rates": [{
+                "millireadsPerSecond": random.randint(0, 10**7),
+                "milliwritesPerSecond": random.randint(0, 10**7),
+                "meanReadLatencyMicroseconds": random.randint(0, 10**5),
+                "meanWriteLatencyMicroseconds": random.randint(0, 10**5)}]}
+                for disk in disks if disk["type"] != "IDE_CDROM"]
+        }])
+    return vms, nodes, stats
+
+
+def plain_python(now, virdomain_json, node_response, stat_responses) -> str:
+    # the per vm loop from SCinventory.py
+    vp = io.StringIO()
+    for pvm, stat_response in zip(virdomain_json, stat_responses):
+        vp.write(now)
+        vp.write("," + pvm["name"])
+        vp.write("," + str(pvm['numVCPU']))
+        vp.write("," + str(round(stat_response[0]['cpuUsage'], 4)))
+        for vpnode in node_response:
+            if pvm['nodeUUID'] == vpnode['uuid']:
+                vp.write("," + str(round(vpnode['CPUhz'] / 1000**3, 2)))
+                vp.write("," + str(round((vpnode['CPUhz'] * (stat_response[0]['cpuUsage'] / 100)) / 1000**3, 2)))
+        vp.write("," + str(round(stat_response[0]['rxBitRate'], 4)))
+        vp.write("," + str(round(stat_response[0]['txBitRate'], 4)))
+        disk_count = 8
+        for vdisk in pvm['blockDevs']:
+            if vdisk['type'] in ("VIRTIO_DISK", "IDE_DISK"):
+                vp.write("," + vdisk['type'])
+                for stat_disk in stat_response[0]['vsdStats']:
+                    if stat_disk['uuid'] == vdisk['uuid']:
+                        vp.write("," + str(stat_disk['rates'][0]['millireadsPerSecond'] / 1000))
+                        vp.write("," + str(stat_disk['rates'][0]['milliwritesPerSecond'] / 1000))
+                        vp.write("," + str(stat_disk['rates'][0]['meanReadLatencyMicroseconds']))
+                        vp.write("," + str(stat_disk['rates'][0]['meanWriteLatencyMicroseconds']))
+                        disk_count -= 1
+        if disk_count == 7:
+            vp.write(",NO_DISK,0,0,0,0")
+        vp.write("\n")
+    return vp.getvalue()
+
+
+def vectorized(now, index, stat_responses) -> str:
+    return ScaleMetrics.format_vm_rows(now, index, ScaleMetrics.compute_vm_metrics(index, stat_responses))
+
+
+def timed(function, *args):
+    start = time.perf_counter()
+    for _ in range(ROUNDS):
+        result = function(*args)
+    return result, (time.perf_counter() - start) / ROUNDS * 1000
+
+
+if __name__ == "__main__":
+    now = str(int(time.time()))
+    print(f'{"vms":>6} {"python ms":>10} {"numpy ms":>10} {"derive ms":>10} {"speedup":>8}  identical')
+    for vm_count in (100, 1000, 5000):
+        vms, nodes, stats = synthetic_cluster(vm_count)
+        index = ScaleMetrics.VmPerfIndex(vms, nodes)
+        before, before_ms = timed(plain_python, now, vms, nodes, stats)
+        after, after_ms = timed(vectorized, now, index, stats)
+        batch, derive_ms = timed(ScaleMetrics.compute_vm_metrics, index, stats)
+        print(f'{vm_count:>6} {before_ms:>10.2f} {after_ms:>10.2f} {derive_ms:>10.2f} {before_ms / after_ms:>7.2f}x  '
+              f'{before == after}')
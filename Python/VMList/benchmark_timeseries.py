@@ -0,0 +1,111 @@
+#!/usr/bin/env python3
+
+"""
+
+Benchmark for the time series store (ScaleTimeSeries.py) against appending rows to a csv file like vmPerf.csv.
+
+Fills a store and a csv file with a day of 10 second samples for a number of series and reports:
+
+    append     time per measurement cycle for all series
+    disk       bytes on disk after the day, and the fixed size the store reaches once the retention is filled
+    read       one series over the last hour and over the whole day: a window from the store (iterated, and through
+               numpy when it is installed) versus scanning the csv file for that series
+
+Usage: python3 benchmark_timeseries.py [series count]
+
+dependencies: none (numpy optional)
+
+"""
+
+import os
+import sys
+import tempfile
+import time
+
+import ScaleTimeSeries
+
+DAY_CYCLES = 8640
+STEP = 10
+ROUNDS = 5
+
+
+def timed(function, *args) -> float:
+    start = time.perf_counter()
+    for _ in range(ROUNDS):
+        function(*args)
+    return (time.perf_counter() - start) / ROUNDS * 1000
+
+
+def csv_window(path: str, key: str, start: int, end: int) -> list:
+    samples = []
+    with open(path) as f:
+        next(f)
+        for line in f:
+            epoch, name, value = line.rstrip("\n").split(",")
+            if name == key and start <= int(epoch) <= end:
+                samples.append((int(epoch), float(value)))
+    return samples
+
+
+def store_window(store, key: str, start: int, end: int) -> list:
+    with store.window(key, start, end) as window:
+        return list(window)
+
+
+def store_numpy(store, key: str, start: int, end: int):
+    with store.window(key, start, end) as window:
+        return window.to_numpy()["value"].mean()
+
+
+def disk_usage(directory: str) -> int:
+    return sum(os.stat(os.path.join(directory, name)).st_blocks * 512 for name in os.listdir(directory))
+
+
+if __name__ == "__main__":
+    series_count = int(sys.argv[1]) if len(sys.argv) > 1 else 100
+    keys = ["vm/vm" + str(i // 4) + "/" + ("cpuPct", "vmGhz", "rxBit", "txBit")[i % 4] for i in range(series_count)]
+    first = int(time.time()) // 3600 * 3600 - DAY_CYCLES * STEP
+
+    with tempfile.TemporaryDirectory() as directory:
+        csv_path = os.path.join(directory, "perf.csv")
+        store_path = os.path.join(directory, "store")
+        store = ScaleTimeSeries.TimeSeriesStore(store_path, STEP)
+
+        store_seconds = 0.0
+        csv_seconds = 0.0
+        with open(csv_path, "w") as csv_file:
+            csv_file.write("epoch,name,value\n")
+            for cycle in range(DAY_CYCLES):
+                now = first + cycle * STEP
+                samples = [(key, (cycle * 31 + index) % 1000 / 10) for index, key in enumerate(keys)]
+                start = time.perf_counter()
+                store.append_many(now, samples)
+                store_seconds += time.perf_counter() - start
+                start = time.perf_counter()
+                csv_file.write("".join(f'{now},{key},{value}\n' for key, value in samples))
+                csv_file.flush()
+                csv_seconds += time.perf_counter() - start
+        store.flush()
+        print(f'{series_count} series, {DAY_CYCLES} cycles: append per cycle store '
+              f'{store_seconds / DAY_CYCLES * 1000:.3f} ms, csv {csv_seconds / DAY_CYCLES * 1000:.3f} ms')
+        print(f'disk after a day: store {disk_usage(store_path) / 1024**2:.1f} MiB, csv '
+              f'{os.path.getsize(csv_path) / 1024**2:.1f} MiB. store with full retention '
+              f'({store.retention["raw"] // 86400} days raw): {store.disk_bytes() / 1024**2:.1f} MiB, csv would grow '
+              f'to {os.path.getsize(csv_path) * store.retention["raw"] / 86400 / 1024**2:.1f} MiB in that time and '
+              f'keeps growing')
+
+        last = first + (DAY_CYCLES - 1) * STEP
+        reader = ScaleTimeSeries.TimeSeriesStore(store_path, readonly=True)
+        for label, start in (("last hour", last - 3600), ("whole day", first)):
+            assert store_window(reader, keys[1], start, last) == csv_window(csv_path, keys[1], start, last)
+            line = (f'read {label}: csv scan {timed(csv_window, csv_path, keys[1], start, last):.2f} ms, '
+                    f'store window {timed(store_window, reader, keys[1], start, last):.2f} ms')
+            try:
+                # the first to_numpy() imports numpy, keep that out of the timing
+                store_numpy(reader, keys[1], start, last)
+                line += f', store numpy {timed(store_numpy, reader, keys[1], start, last):.2f} ms'
+            except ImportError:
+                pass
+            print(line)
+        reader.close()
+        store.close()